@@ -1,10 +1,11 @@
 {% load code_generator_tags %}from rest_framework.serializers import ModelSerializer
 
+from contrib.serializers import SparseFieldsMixin
 from . import models
 {% for model in models %}
 
 
-class {{ model.name }}Serializer(ModelSerializer):
+class {{ model.name }}Serializer(SparseFieldsMixin, ModelSerializer):
     """ Main serializer interface for {{ model.name }}. """
 
     class Meta:
@@ -1,12 +1,13 @@
 {% load code_generator_tags %}from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 
+from contrib.views import SparseFieldsViewMixin
 from . import models
 from . import serializers{% comment %}
 {% endcomment %}{% for model in models %}
 
 
-class {{ model.name }}ViewSet(viewsets.ModelViewSet):
+class {{ model.name }}ViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     """ Full CRUD endpoint for {{ model.name }} model. """
 
     permission_classes = [IsAuthenticated]
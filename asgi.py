@@ -2,15 +2,29 @@
 
 from django.core.asgi import get_asgi_application
 
-asgi_app = get_asgi_application()
+django_app = get_asgi_application()
 
-from channels.auth import AuthMiddlewareStack  # noqa
+from asgiref.sync import ThreadSensitiveContext  # noqa
+
+
+async def asgi_app(scope, receive, send):
+    # each request's sync code (views, middleware) gets its own thread rather than all of them sharing
+    # one, as in Django 4 - so a slow request (i.e. hashing a password) doesn't hold up the others
+    async with ThreadSensitiveContext():
+        await django_app(scope, receive, send)
+
+
+from django.urls import re_path  # noqa
 from channels.routing import ProtocolTypeRouter, URLRouter  # noqa
-from contrib.urls import websocket_urls  # noqa
+from contrib.compression import CompressionMiddleware  # noqa
+from contrib.consumers import AdmissionMiddleware  # noqa
+from contrib.urls import http_urls, websocket_urls  # noqa
+from users.authentication import JWTAuthMiddleware  # noqa
 
 websocket_router = URLRouter(websocket_urls)
+http_router = URLRouter(http_urls + [re_path(r'', asgi_app)])
 
 application = ProtocolTypeRouter({
-    'http': asgi_app,
-    'websocket': AuthMiddlewareStack(websocket_router),
+    'http': CompressionMiddleware(http_router),
+    'websocket': AdmissionMiddleware(JWTAuthMiddleware(websocket_router)),
 })
@@ -46,6 +46,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "admin_reorder.middleware.ModelAdminReorder",
+    "contrib.exceptions.HashingBusyMiddleware",
 ]
 
 ROOT_URLCONF = "conf.urls"
@@ -88,6 +89,17 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Django's defaults, but PBKDF2 (same algorithm) runs in a pool of PASSWORD_HASHING_POOL_SIZE processes
+# (0 to hash inline) - past PASSWORD_HASHING_MAX_QUEUE hashes in flight per worker, requests get a 503
+PASSWORD_HASHERS = [
+    "users.hashers.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+]
+PASSWORD_HASHING_POOL_SIZE = 2
+PASSWORD_HASHING_MAX_QUEUE = 8
+
 LANGUAGE_CODE = "fr"
 TIME_ZONE = "Europe/Paris"
 USE_I18N = True
@@ -119,9 +131,11 @@ CACHES = {
 }
 
 # we need this to be able to send messages from django to specific groups/users on instance save, etc.
+# the fanout layer is channels_redis with one group membership per process instead of per socket
+# (use "channels_redis.core.RedisChannelLayer" if something outside this app sends to consumer channels directly)
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "contrib.layers.InstrumentedFanoutChannelLayer",
         "CONFIG": {
             "hosts": [("127.0.0.1", 6379)],
         },
@@ -133,16 +147,29 @@ REST_FRAMEWORK = {
     # or allow read-only access for unauthenticated users.
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "DEFAULT_METADATA_CLASS": "rest_framework.metadata.SimpleMetadata",
+    # JSON through orjson (same output as DRF's own JSON renderer/parser, only faster)
+    "DEFAULT_RENDERER_CLASSES": [
+        "contrib.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "contrib.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "PAGE_SIZE": 10,
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    # keyset pagination by the model's ordering - no COUNT(*) or OFFSET, list views get opaque next/previous cursors
+    "DEFAULT_PAGINATION_CLASS": "contrib.pagination.KeysetPagination",
     "DEFAULT_THROTTLE_CLASSES": [
         "rest_framework.throttling.ScopedRateThrottle",
     ],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    # DRF's, plus a 503 when the password hashing pool is saturated
+    "EXCEPTION_HANDLER": "contrib.exceptions.exception_handler",
 }
 HEALTH_RATE_THROTTLE = "120/hour"
 
@@ -262,6 +289,78 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 }
 
+# users loaded for authentication are cached in redis, and for a few seconds in each process too
+# (which is how long a deactivated user may still get through on other processes)
+AUTH_USER_CACHE_TTL = 60 * 5  # seconds
+AUTH_USER_LOCAL_CACHE_TTL = 5  # seconds
+AUTH_USER_LOCAL_CACHE_SIZE = 10000
+# a changed user isn't cached again for that long, so a request that read the old row just before can't cache it
+AUTH_USER_INVALIDATED_TTL = 10  # seconds
+
+# a user's tokens are signed once and reused until they have less than TOKEN_MIN_REMAINING seconds left -
+# set TOKEN_CACHE_TTL to also share them between requests through the cache for that long
+TOKEN_MIN_REMAINING = 60  # seconds
+TOKEN_CACHE_TTL = 0  # seconds, 0 to disable
+
+# serialized users (json bytes) are cached in redis and for a few seconds in each process, along with the
+# user version they were rendered from - saving a user clears them
+USER_PAYLOAD_CACHE_TTL = 60 * 60  # seconds
+USER_PAYLOAD_LOCAL_CACHE_TTL = 5  # seconds
+USER_PAYLOAD_LOCAL_CACHE_SIZE = 10000
+
+# websockets authenticate with the same JWT - by signature only, unless we ask for the real (cached) User
+WEBSOCKET_JWT_LOAD_USER = False
+
+# frames waiting to go out to one websocket - beyond this the oldest are dropped
+WEBSOCKET_MAX_QUEUE = 32
+# a client that can't take a frame within this many seconds gets disconnected
+WEBSOCKET_SEND_TIMEOUT = 10
+# we ping every websocket this often, and close it if we haven't heard anything back for the idle timeout
+WEBSOCKET_HEARTBEAT_INTERVAL = 25
+WEBSOCKET_IDLE_TIMEOUT = 60
+# handshakes one worker runs at once - past this, clients are told to retry after a (jittered) delay
+WEBSOCKET_MAX_HANDSHAKES = 100
+WEBSOCKET_RETRY_AFTER = 2  # seconds
+WEBSOCKET_RETRY_JITTER = 10  # seconds
+# resources one socket may subscribe to at once (contrib.subscriptions)
+WEBSOCKET_MAX_SUBSCRIPTIONS = 100
+# every user's updates are also kept in a capped redis stream, so reconnecting clients can catch up
+USER_STREAM_MAXLEN = 100
+USER_STREAM_TTL = 60 * 60 * 24  # seconds
+# server-sent events (/me/events/): comment lines keep quiet streams open, and clients reconnect after SSE_RETRY
+SSE_KEEPALIVE_INTERVAL = 15  # seconds
+SSE_RETRY = 3  # seconds
+# write user change events to the outbox table instead of publishing them inside post_save -
+# the `dispatch_outbox` command must then be running to publish them
+USER_EVENTS_OUTBOX = False
+
+# responses are compressed (brotli or gzip, see contrib.compression) from this size on, unless already compressed
+COMPRESSION_MIN_SIZE = 500  # bytes
+COMPRESSION_EXCLUDED_TYPES = [
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-7z-compressed",
+    "application/pdf",
+    "application/octet-stream",
+]
+# brotli quality 4 compresses better than gzip level 6 and about as fast - the higher ones are for static files
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
+# /batch/ takes up to BATCH_MAX_REQUESTS sub-requests - GETs can run BATCH_MAX_CONCURRENCY at a time per worker,
+# each in a thread with its own database connection, only with persistent connections (CONN_MAX_AGE)
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_CONCURRENCY = 1
+
+# how often each ASGI worker leaves its metrics (contrib.metrics) in the cache for /_metrics/
+METRICS_REPORT_INTERVAL = 10  # seconds
+
 DEFAULT_FROM_EMAIL = (
     "admin@wertkt.com"  # fallback - normally set by client via back office
 )
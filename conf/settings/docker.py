@@ -34,7 +34,7 @@ CACHES = {
 
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'contrib.layers.InstrumentedFanoutChannelLayer',
         'CONFIG': {
             'hosts': [('redis', 6379)],
         },
@@ -10,6 +10,12 @@ CORS_ORIGIN_WHITELIST = [
 
 ALLOWED_HOSTS = ['*']  # change to something more secure
 
+# JSON only - no browsable API (and its templates) in production
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,  # noqa
+    'DEFAULT_RENDERER_CLASSES': ['contrib.renderers.ORJSONRenderer'],
+}
+
 # Basic logging settings
 LOGGING_PATH = '/var/www/logs/new_fake_drf_project/'
 MAX_LOG_FILE_SIZE = 1024 * 1024 * 10  # 10 MB
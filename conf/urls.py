@@ -13,7 +13,7 @@ import os
 
 from users.urls import router as user_router
 from users.views import me, password_reset, password_reset_confirm
-from contrib.views import global_settings
+from contrib.views import batch, global_settings, metrics_report
 from contrib.urls import router as contrib_router
 from conf.router import Router
 
@@ -45,6 +45,8 @@ urlpatterns = [
     path('auth/password-reset/confirm/', password_reset_confirm, name='password-reset-confirm'),
     path('me/', me, name='me'),
     path('global-settings/', global_settings, name='globals'),
+    path('_metrics/', metrics_report, name='metrics'),
+    path('batch/', batch, name='batch'),
     path('', include(router.urls)),
 ]
 
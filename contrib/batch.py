@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections, connection
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from rest_framework.request import Request
+from rest_framework.response import Response
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from urllib.parse import urlsplit
+import copy
+import io
+import json
+import logging
+import threading
+
+from contrib.metrics import metrics
+
+logger = logging.getLogger('users')
+
+# headers of the batch request that aren't about its sub-requests
+SKIPPED_META = ('CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_CONTENT_LENGTH', 'HTTP_CONTENT_TYPE', 'HTTP_IF_NONE_MATCH',
+                'HTTP_IF_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'wsgi.input', 'PATH_INFO', 'QUERY_STRING', 'REQUEST_METHOD')
+
+
+class BatchPool:
+    """ Threads that run the GET sub-requests of batches side by side - `BATCH_MAX_CONCURRENCY` of them
+    per worker, shared by all batches. Every thread has its own database connection, so they're only
+    used with persistent connections (`CONN_MAX_AGE`), kept open from one sub-request to the next -
+    otherwise each GET would open one. Without them, or with `BATCH_MAX_CONCURRENCY = 1` (the default),
+    everything runs on the batch's own thread and connection. """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def map(self, run: Callable[[dict], dict], items: List[dict]) -> List[dict]:
+        if settings.BATCH_MAX_CONCURRENCY <= 1 or len(items) == 1 or connection.settings_dict['CONN_MAX_AGE'] == 0:
+            return [run(item) for item in items]
+        return list(self.get_executor().map(lambda item: self.run_and_close(run, item), items))
+
+    def run_and_close(self, run: Callable[[dict], dict], item: dict) -> dict:
+        try:
+            return run(item)
+        finally:
+            close_old_connections()  # only past CONN_MAX_AGE, or broken
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(settings.BATCH_MAX_CONCURRENCY, thread_name_prefix='batch')
+            return self.executor
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+batch_pool = BatchPool()
+
+
+def make_sub_request(request: Request, item: dict, user) -> WSGIRequest:
+    """ A request for `item` that looks like it came in with the batch: same headers (the item's own
+    added), and already authenticated as the batch's user - DRF views don't authenticate it again.
+    Each gets its own copy of `user`, so sub-requests running side by side don't share it. """
+
+    url = urlsplit(item['path'])
+    body = json.dumps(item['body']).encode() if item.get('body') is not None else b''
+    environ = {key: value for key, value in request.META.items() if key not in SKIPPED_META}
+    for name, value in item.get('headers', {}).items():
+        environ[f'HTTP_{name.upper().replace("-", "_")}'] = value
+    environ.update({
+        'REQUEST_METHOD': item['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': request.scheme,
+    })
+    sub_request = WSGIRequest(environ)
+    sub_request._force_auth_user = copy.copy(user)
+    sub_request._force_auth_token = request.auth
+    sub_request.user = sub_request._force_auth_user  # for plain Django views
+    if hasattr(request._request, 'session'):
+        sub_request.session = request._request.session
+    return sub_request
+
+
+def response_body(response: HttpResponse):
+    if isinstance(response, Response):
+        return response.data
+    if response.streaming or not response.content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(response.content)
+    return response.content.decode(response.charset, errors='replace')
+
+
+def run_sub_request(request: Request, item: dict, user) -> dict:
+    """ `{"status", "headers", "body"}` of one sub-request - errors included, they don't fail the batch. """
+
+    path = urlsplit(item['path']).path
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return {'status': 404, 'headers': {}, 'body': {'detail': 'Not found.'}}
+    if match.url_name == 'batch':
+        return {'status': 400, 'headers': {}, 'body': {'detail': 'Batches can\'t be nested.'}}
+
+    try:
+        response = match.func(make_sub_request(request, item, user), *match.args, **match.kwargs)
+    except Exception:
+        logger.exception(f'Sub-request {item["method"]} {item["path"]} of a batch failed.')
+        return {'status': 500, 'headers': {}, 'body': {'detail': 'Server error.'}}
+    if not isinstance(response, Response) and callable(getattr(response, 'render', None)):
+        response.render()  # a TemplateResponse - DRF's `Response.data` is used as it is
+    skipped = ('content-length', 'vary', 'content-type') if isinstance(response, Response) else ('content-length', 'vary')
+    headers = {name: value for name, value in response.items() if name.lower() not in skipped}
+    return {'status': response.status_code, 'headers': headers, 'body': response_body(response)}
+
+
+def reload_user(user):
+    """ The batch's user as it is now, after a write that may have changed it - a new instance, the
+    batch's `request.user` stays as it was. """
+
+    if not user.is_authenticated or not hasattr(user, 'refresh_from_db'):
+        return user
+    return type(user)._default_manager.filter(pk=user.pk).first() or user
+
+
+def run_batch(request: Request, items: List[dict]) -> List[dict]:
+    """ Runs the sub-requests in order - except that consecutive GETs may run side by side (see
+    `BatchPool`). Anything else runs on the batch's own thread and database connection, so a GET that
+    follows a write sees it, and runs as the user the write left. """
+
+    metrics.observe('batch.size', len(items))
+    user = request.user
+    results: List[dict] = []
+    reads: List[dict] = []
+    for item in items + [None]:
+        if item is not None and item['method'] == 'GET':
+            reads.append(item)
+            continue
+        if reads:
+            results += batch_pool.map(lambda read: run_sub_request(request, read, user), reads)
+            reads = []
+        if item is not None:
+            results.append(run_sub_request(request, item, user))
+            user = reload_user(user)
+    return results
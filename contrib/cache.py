@@ -0,0 +1,44 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import threading
+import time
+
+
+class LocalCache:
+    """ A small in-process LRU cache whose entries also expire after `ttl` seconds.
+
+    Meant to sit in front of the shared (redis) cache for very hot keys. Other processes can't
+    invalidate it, so keep `ttl` short - it is how stale an entry may get. """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()  # sync views run in a thread pool
+        self.entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,84 @@
+from django.core.exceptions import FieldDoesNotExist
+
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, Callable, Iterable, List, Optional, Tuple, Type
+
+# fields whose `to_representation` is exactly one of these (subclasses may do more, so only exact matches)
+CONVERTERS = {
+    serializers.CharField: str,
+    serializers.EmailField: str,
+    serializers.SlugField: str,
+    serializers.URLField: str,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+    serializers.ReadOnlyField: None,  # as is
+}
+
+
+class CompiledSerializer:
+    """ A read-only serializer flattened into `(name, getter, converter)` steps, worked out once from
+    a template instance - instead of DRF building the fields again for every serializer instance and
+    going through its generic `to_representation` for every object.
+
+    The output is the same as `serializer_class(instance).data` (a plain dict rather than a `ReturnDict`.)
+    Model fields are read with `attrgetter` and simple fields converted with `str`/`int`; anything else
+    (relations, nested serializers, dates...) keeps using the field's own methods. `SerializerMethodField`
+    methods are called on the template, so they can't rely on `context`. """
+
+    def __init__(self, serializer_class: Type[serializers.Serializer]) -> None:
+        self.serializer_class = serializer_class
+        self.template = serializer_class()
+        self.steps: List[Tuple[str, Callable[[Any], Any], Optional[Callable[[Any], Any]], bool]] = [
+            self.compile_field(field) for field in self.template._readable_fields
+        ]
+
+    def compile_field(self, field: serializers.Field) -> tuple:
+        """ `(name, getter, converter, simple)` - simple getters can't raise `SkipField` or return a `PKOnlyObject`. """
+
+        if isinstance(field, serializers.SerializerMethodField):
+            template, method_name = self.template, field.method_name
+            # looked up on every call rather than bound once, so patching the method still works
+            return field.field_name, lambda instance: instance, lambda obj: getattr(template, method_name)(obj), True
+
+        getter, simple = field.get_attribute, False
+        model = getattr(getattr(self.serializer_class, 'Meta', None), 'model', None)
+        if model is not None and len(field.source_attrs) == 1:
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is not None and model_field.concrete and not model_field.is_relation:
+                getter, simple = attrgetter(model_field.attname), True
+
+        converter = CONVERTERS.get(type(field), field.to_representation)
+        return field.field_name, getter, converter, simple
+
+    def to_representation(self, instance: Any) -> dict:
+        data = {}
+        for name, getter, converter, simple in self.steps:
+            if simple:
+                value = getter(instance)
+            else:
+                try:
+                    value = getter(instance)
+                except SkipField:
+                    continue
+                if isinstance(value, PKOnlyObject) and value.pk is None:
+                    data[name] = None
+                    continue
+            data[name] = value if value is None or converter is None else converter(value)
+        return data
+
+    def many(self, instances: Iterable[Any]) -> List[dict]:
+        return [self.to_representation(instance) for instance in instances]
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class: Type[serializers.Serializer]) -> CompiledSerializer:
+    """ The compiled version of a read-only serializer, built on first use. """
+
+    return CompiledSerializer(serializer_class)
@@ -0,0 +1,218 @@
+from django.conf import settings
+
+from typing import List, Optional, Tuple
+import zlib
+
+from contrib.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only then
+    brotli = None
+
+
+def parse_accept_encoding(value: str) -> dict:
+    """ `{coding: q}` from an `Accept-Encoding` header, i.e. `{'br': 1.0, 'gzip': 0.5}`. """
+
+    codings = {}
+    for item in value.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, number = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            codings[coding.strip()] = q
+    return codings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """ Brotli when the client takes it (and it's installed), then gzip - or None for no compression. """
+
+    codings = parse_accept_encoding(accept_encoding)
+    wildcard = codings.get('*', 0.0)
+    candidates = [('br', brotli is not None), ('gzip', True)]
+    accepted = [(codings.get(coding, wildcard), coding) for coding, available in candidates if available]
+    accepted = [(q, coding) for q, coding in accepted if q > 0]
+    if not accepted:
+        return None
+    best = max(q for q, _ in accepted)
+    return next(coding for q, coding in accepted if q == best)  # ties go to brotli
+
+
+class Compressor:
+    """ Incremental gzip or brotli - `compress()` as chunks come, with `flush=True` to push out everything
+    so far (a streamed event reaches the client right away), then `finish()`. """
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        if encoding == 'br':
+            self.brotli = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.zlib = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == 'br':
+            out = self.brotli.process(data)
+            return out + self.brotli.flush() if flush else out
+        out = self.zlib.compress(data)
+        return out + self.zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        if self.encoding == 'br':
+            return self.brotli.finish()
+        return self.zlib.flush()
+
+
+class CompressionMiddleware:
+    """ Compresses HTTP responses with brotli or gzip, whichever the client prefers - at the ASGI level,
+    so Django views and the async consumers (i.e. server-sent events) alike.
+
+    Skipped are: bodies under `COMPRESSION_MIN_SIZE` bytes, types in `COMPRESSION_EXCLUDED_TYPES`
+    (images, archives... already compressed), responses that already have a `Content-Encoding`, and
+    HEAD requests. Complete bodies that don't get any smaller go out as they were.
+
+    Streaming responses (no `Content-Length`) are compressed as they go, with every chunk flushed, so
+    the client gets each event when it's sent. Each compressed response observes its
+    `http.compression_ratio`, the compressed size in percent of the original, in `contrib.metrics` -
+    reported to `/_metrics/` by every worker serving HTTP.
+    """
+
+    def __init__(self, inner) -> None:
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            metrics.ensure_reporter()  # on workers that never open a socket too, for `/_metrics/`
+        if scope['type'] != 'http' or scope.get('method') == 'HEAD':
+            return await self.inner(scope, receive, send)
+        accept_encoding = b''
+        for name, value in scope.get('headers', []):
+            if name == b'accept-encoding':
+                accept_encoding = value
+        encoding = choose_encoding(accept_encoding.decode('latin1'))
+        if encoding is None:
+            return await self.inner(scope, receive, send)
+        return await self.inner(scope, receive, CompressedResponse(encoding, send))
+
+
+class CompressedResponse:
+    """ Stands in for `send` for one response, compressing the body on its way out. """
+
+    def __init__(self, encoding: str, send) -> None:
+        self.encoding = encoding
+        self.send = send
+        self.start: Optional[dict] = None
+        self.compressor: Optional[Compressor] = None
+        self.streaming = False  # no Content-Length, so every chunk is flushed
+        self.passthrough = False
+        self.buffer: List[bytes] = []
+        self.size = 0
+        self.compressed_size = 0
+
+    async def __call__(self, message: dict) -> None:
+        if self.passthrough:
+            return await self.send(message)
+        if message['type'] == 'http.response.start':
+            self.start = message
+            if not self.is_compressible(message):
+                self.passthrough = True
+                await self.send(message)
+            return
+        if message['type'] != 'http.response.body':
+            return await self.send(message)
+
+        body, more_body = message.get('body', b''), message.get('more_body', False)
+        if self.compressor is None and not await self.start_body(body, more_body):
+            return
+
+        self.size += len(body)
+        out = self.compressor.compress(body, flush=self.streaming and more_body)
+        if not more_body:
+            out += self.compressor.finish()
+            self.observe(self.compressed_size + len(out))
+        self.compressed_size += len(out)
+        if out or not more_body:
+            await self.send({'type': 'http.response.body', 'body': out, 'more_body': more_body})
+
+    async def start_body(self, body: bytes, more_body: bool) -> bool:
+        """ On the first chunk: whether the body gets compressed as it comes (the compressed start is
+        sent then) - or False if it already went out, as it was or compressed in one go. """
+
+        length = self.header(b'content-length')
+        if not more_body or length is not None:
+            # the whole body is known, or at least its size - only worth it past the threshold
+            self.buffer.append(body)
+            total = int(length) if length is not None and length.isdigit() else len(body)
+            if total < settings.COMPRESSION_MIN_SIZE:
+                await self.send_uncompressed(more_body)
+                return False
+            if not more_body:
+                await self.send_complete(body)
+                return False
+            self.buffer.clear()
+        else:
+            self.streaming = True
+        self.compressor = Compressor(self.encoding)
+        await self.send(self.compressed_start(content_length=None))
+        return True
+
+    def is_compressible(self, start: dict) -> bool:
+        if start['status'] < 200 or start['status'] in (204, 304) or self.header(b'content-encoding') is not None:
+            return False
+        content_type = (self.header(b'content-type') or b'').decode('latin1').lower()
+        return not content_type.startswith(tuple(settings.COMPRESSION_EXCLUDED_TYPES))
+
+    def header(self, name: bytes) -> Optional[bytes]:
+        for key, value in self.start.get('headers', []):
+            if key.lower() == name:
+                return value
+        return None
+
+    def compressed_start(self, content_length: Optional[int]) -> dict:
+        headers: List[Tuple[bytes, bytes]] = []
+        vary = None
+        for key, value in self.start.get('headers', []):
+            key = key.lower()
+            if key == b'content-length':
+                continue
+            if key == b'vary':
+                vary = value
+                continue
+            if key == b'etag' and value.startswith(b'"'):
+                value = b'W/' + value  # the bytes differ from the uncompressed ones
+            headers.append((key, value))
+        if vary is None:
+            vary = b'Accept-Encoding'
+        elif b'accept-encoding' not in vary.lower() and vary.strip() != b'*':
+            vary += b', Accept-Encoding'
+        headers += [(b'vary', vary), (b'content-encoding', self.encoding.encode())]
+        if content_length is not None:
+            headers.append((b'content-length', str(content_length).encode()))
+        return {**self.start, 'headers': headers}
+
+    async def send_uncompressed(self, more_body: bool) -> None:
+        self.passthrough = True
+        await self.send(self.start)
+        await self.send({'type': 'http.response.body', 'body': b''.join(self.buffer), 'more_body': more_body})
+        self.buffer.clear()
+
+    async def send_complete(self, body: bytes) -> None:
+        compressor = Compressor(self.encoding)
+        out = compressor.compress(body) + compressor.finish()
+        if len(out) >= len(body):
+            metrics.incr('http.compression_skipped')
+            return await self.send_uncompressed(more_body=False)
+        self.size = len(body)
+        self.observe(len(out))
+        await self.send(self.compressed_start(content_length=len(out)))
+        await self.send({'type': 'http.response.body', 'body': out})
+
+    def observe(self, compressed_size: int) -> None:
+        metrics.incr(f'http.compressed.{self.encoding}')
+        if self.size:
+            metrics.observe('http.compression_ratio', compressed_size * 100 / self.size)
@@ -1,49 +1,517 @@
+from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import AnonymousUser
 
+from channels.db import database_sync_to_async
+from channels.exceptions import StopConsumer
+from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from corsheaders.conf import conf as cors_conf
+from corsheaders.middleware import CorsMiddleware
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+import asyncio
 import logging
+import random
+import re
+import time
+import msgpack
+import json
 
+from contrib import streams
+from contrib.layers import group_send_many
+from contrib.metrics import metrics
+from contrib.models import OutboxEvent
+from users.authentication import JWT_SUBPROTOCOL
+from users.payloads import get_user_payloads, user_payload
 from users.serializers import UserSerializer
 from users.models import User
 
 
 logger = logging.getLogger('sockets')
 
+# frame encodings a client can ask for, either as websocket subprotocol or with `?encoding=`
+ENCODINGS = ('json', 'msgpack')
 
-class UserConsumer(AsyncJsonWebsocketConsumer):
-    """ Allows frontend to subscribe to updates to their user instance. """
+# message types that carry the full state of something - only the latest one is worth sending
+CONFLATED_TYPES = ('user.updated', 'resource.updated')
 
-    serializer_class = UserSerializer
+# custom close codes (4000-4999 are free for applications)
+CLOSE_TOO_SLOW = 4008
+CLOSE_IDLE = 4009
+CLOSE_TRY_AGAIN = 1013  # standard "try again later"
 
-    async def connect(self) -> None:
-        """ On connect register them in their own private group so we can
-        communicate with them directly from a Django signal later. """
+# users serialized and sent per round by `publish_users` (keeps the query and the layer message small)
+PUBLISH_BATCH_SIZE = 500
+
+
+def encode_frames(content: dict) -> Dict[str, Union[str, bytes]]:
+    """ Encodes a message once for every supported encoding, so consumers only pick the right one. """
+
+    return {
+        'json': json.dumps(content),
+        'msgpack': msgpack.packb(content),
+    }
+
+
+PING_FRAMES = encode_frames({'msg_type': 'ping'})
+
+
+def negotiate_encoding(scope: dict) -> Tuple[str, Optional[str]]:
+    """ `(encoding, subprotocol to accept with)` of a websocket. Binary clients can ask for msgpack
+    frames instead of JSON text. A requested subprotocol wins over the `?encoding=` query param, and is
+    echoed back on accept as the spec requires (browsers drop the connection if they offered
+    subprotocols and none comes back.) """
+
+    subprotocols = scope.get('subprotocols', [])
+    for subprotocol in subprotocols:
+        if subprotocol in ENCODINGS:
+            return subprotocol, subprotocol
+
+    params = parse_qs(scope.get('query_string', b'').decode())
+    encoding = params.get('encoding', ['json'])[0]
+    if encoding not in ENCODINGS:
+        encoding = 'json'
+    return encoding, JWT_SUBPROTOCOL if JWT_SUBPROTOCOL in subprotocols else None
+
+
+class AdmissionControl:
+    """ Caps how many websocket handshakes one worker runs at the same time.
+
+    After a deploy every client reconnects at once, and each connect costs auth, `accept` and
+    `group_add`. Past `WEBSOCKET_MAX_HANDSHAKES`, new sockets are told to come back later instead
+    (with some randomness, so the retries arrive spread out rather than as a second wave.) """
+
+    def __init__(self) -> None:
+        self.in_flight = 0  # one event loop per worker, no need for a lock
+
+    def enter(self) -> bool:
+        if self.in_flight >= settings.WEBSOCKET_MAX_HANDSHAKES:
+            metrics.incr('ws.handshakes.rejected')
+            return False
+        self.in_flight += 1
+        metrics.incr('ws.handshakes.admitted')
+        metrics.gauge('ws.handshakes.in_flight', 1)
+        return True
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+        metrics.gauge('ws.handshakes.in_flight', -1)
+
+    def retry_hint(self) -> dict:
+        """ `retry_after` is already jittered - `jitter` is how much more the client may add on its side. """
+
+        retry_after = settings.WEBSOCKET_RETRY_AFTER + random.uniform(0, settings.WEBSOCKET_RETRY_JITTER)
+        return {'retry_after': round(retry_after, 1), 'jitter': settings.WEBSOCKET_RETRY_JITTER}
+
+
+admission = AdmissionControl()
+
+
+class AdmissionMiddleware:
+    """ Runs `admission` in front of authentication (see asgi.py), so a socket turned away costs
+    neither a token check nor a user lookup. An admitted handshake holds its slot until the consumer
+    calls `scope['admission_done']` (`LiveConsumer` does once subscribed), closes, or goes away. """
+
+    def __init__(self, inner) -> None:
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.inner(scope, receive, send)
+        if not admission.enter():
+            return await self.reject_busy(scope, receive, send)
+
+        admitted = True
 
+        def done() -> None:
+            nonlocal admitted
+            if admitted:
+                admitted = False
+                admission.leave()
+
+        async def send_and_release(message: dict) -> None:
+            if message['type'] == 'websocket.close':
+                done()
+            await send(message)
+
+        try:
+            return await self.inner(dict(scope, admission_done=done), receive, send_and_release)
+        finally:
+            done()
+
+    async def reject_busy(self, scope, receive, send) -> None:
+        """ Too many handshakes in progress. We still have to accept to be able to pass a close code
+        (a refused handshake is just a 403), then tell the client when to try again. """
+
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        encoding, subprotocol = negotiate_encoding(scope)
+        hint = admission.retry_hint()
+        frame = encode_frames({'msg_type': 'retry', 'msg_content': hint})[encoding]
+        await send({'type': 'websocket.accept', 'subprotocol': subprotocol})
+        await send({'type': 'websocket.send', 'bytes' if encoding == 'msgpack' else 'text': frame})
+        await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN})
+        logger.info(f'Too many websocket handshakes in progress, client asked to retry in {hint["retry_after"]}s.')
+
+
+class LiveConsumer(AsyncJsonWebsocketConsumer):
+    """ Plumbing shared by our push consumers: auth check, frame encoding, a buffered writer and
+    heartbeats. Subclasses join their groups in `joined()`. """
+
+    encoding = 'json'
+    tasks: List[asyncio.Task] = []
+    live = False
+
+    async def connect(self) -> None:
         # need to be logged in or blocked
         user = self.scope.get('user')
         if not user or isinstance(user, AnonymousUser):
             await self.close()
             logger.info('Failed user subscribe from anonymous user. Connection closed.')
+            return
+        try:
+            await self.start()
+        finally:
+            # the handshake is over - it no longer counts against `WEBSOCKET_MAX_HANDSHAKES`
+            self.scope.get('admission_done', lambda: None)()
+
+    async def start(self) -> None:
+        """ The actual handshake - accept, start the writer and heartbeat, then let the subclass subscribe. """
+
+        subprotocol = self.negotiate_encoding()
+        await self.accept(subprotocol=subprotocol)
+        self.live = True
+        metrics.gauge('ws.connections.live', 1)
+        metrics.ensure_reporter()
+        self.last_seen = time.monotonic()
+        self.outbox: Deque[List] = deque()
+        self.outbox_ready = asyncio.Event()
+        self.tasks = [asyncio.ensure_future(self.write_frames()), asyncio.ensure_future(self.heartbeat())]
+        await self.joined()
+
+    async def joined(self) -> None:
+        pass
+
+    def negotiate_encoding(self) -> Union[str, None]:
+        """ Picks `self.encoding` - returns the subprotocol to accept with. """
+
+        self.encoding, subprotocol = negotiate_encoding(self.scope)
+        return subprotocol
+
+    async def disconnect(self, code: int) -> None:
+        if self.live:
+            self.live = False
+            metrics.gauge('ws.connections.live', -1)
+        for task in self.tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    async def drop(self, code: int) -> None:
+        """ Clean up and close from our side, without waiting for the client to confirm - it is
+        either too slow or gone already, and the server only notices a dead TCP connection much later. """
+
+        await self.disconnect(code)
+        try:
+            await asyncio.wait_for(self.close(code=code), 1)
+        except asyncio.TimeoutError:
+            pass
+
+    async def receive(self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> None:
+        """ Any frame at all counts as a sign of life. """
+
+        self.last_seen = time.monotonic()
+
+    async def heartbeat(self) -> None:
+        """ Pings the client every `WEBSOCKET_HEARTBEAT_INTERVAL` seconds and reaps the connection once
+        nothing came back for `WEBSOCKET_IDLE_TIMEOUT` seconds (i.e. a half-open mobile connection.) """
+
+        while True:
+            await asyncio.sleep(settings.WEBSOCKET_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > settings.WEBSOCKET_IDLE_TIMEOUT:
+                metrics.incr('ws.connections.reaped')
+                logger.info(f'Reaping idle websocket of user #{self.scope["user"].pk}.')
+                await self.drop(CLOSE_IDLE)
+                return
+            self.queue_frame('ping', PING_FRAMES[self.encoding])
+
+    async def send_frame(self, frame: Union[str, bytes]) -> None:
+        """ Sends an already encoded frame - text for JSON, binary for msgpack. """
+
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
         else:
-            await self.accept()
-            user_pk = self.scope['user'].pk
-            self.group_name = f'ws-user-{user_pk}'
-            await self.channel_layer.group_add(self.group_name, self.channel_name)
-            logger.info(f'User subscribed to updates - group_name: {self.group_name}')
+            await self.send(text_data=frame)
+
+    def queue_frame(self, msg_type: str, frame: Union[str, bytes], key: Optional[str] = None) -> None:
+        """ Hands a frame to the writer instead of sending it inline, so a slow client never blocks
+        the consumer from reading the channel layer.
+
+        A state message replaces an older one with the same `key` (the message type by default) that
+        hasn't gone out yet - the client only needs the latest state - and once `WEBSOCKET_MAX_QUEUE`
+        frames are waiting the oldest is dropped. """
+
+        key = key or msg_type
+        if msg_type in CONFLATED_TYPES:
+            for entry in self.outbox:
+                if entry[0] == key:
+                    entry[1] = frame
+                    metrics.incr('ws.frames.conflated')
+                    return
+        if len(self.outbox) >= settings.WEBSOCKET_MAX_QUEUE:
+            self.outbox.popleft()
+            metrics.incr('ws.frames.dropped')
+        self.outbox.append([key, frame])
+        self.outbox_ready.set()
+
+    async def write_frames(self) -> None:
+        """ Drains the outbox. A client that can't take a frame within `WEBSOCKET_SEND_TIMEOUT`
+        seconds is disconnected rather than letting its frames pile up in the worker. """
+
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            while self.outbox:
+                key, frame = self.outbox.popleft()
+                try:
+                    await asyncio.wait_for(self.send_frame(frame), settings.WEBSOCKET_SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    metrics.incr('ws.slow_disconnects')
+                    logger.warning(f'Closing slow websocket of user #{self.scope["user"].pk}.')
+                    await self.drop(CLOSE_TOO_SLOW)
+                    return
+
+
+class UserConsumer(LiveConsumer):
+    """ Allows frontend to subscribe to updates to their user instance. """
+
+    serializer_class = UserSerializer
+
+    async def joined(self) -> None:
+        """ On connect register them in their own private group so we can
+        communicate with them directly from a Django signal later. """
+
+        user_pk = self.scope['user'].pk
+        self.group_name = f'ws-user-{user_pk}'
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        logger.info(f'User subscribed to updates - group_name: {self.group_name}')
+
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        if 'last_event_id' in params:
+            await self.resume(params['last_event_id'][0])
+
+    async def resume(self, last_event_id: str) -> None:
+        """ A client coming back sends the id of the last update it got: replay what it missed from
+        the user's stream, or send the current state if we can't tell (see `contrib.streams`.)
+        We joined the group first, so nothing falls in between - at worst an update arrives twice. """
+
+        for content in await database_sync_to_async(catch_up)(self.scope['user'].pk, last_event_id):
+            self.queue_frame('user.updated', encode_frames(content)[self.encoding])
+
+    async def disconnect(self, code: int) -> None:
+        """ Leave the group so the channel layer isn't holding on to dead sockets. """
+
+        await super().disconnect(code)
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def user_update(self, event: dict) -> None:
         """ This can be called from an external function by using django channel's `group_send` """
 
         logger.info(f'Sending user update to group_name {self.group_name}.')
+        if 'frames' in event:
+            self.queue_frame('user.updated', event['frames'][self.encoding])
+            return
+
         resp = {
             'msg_type': 'user.updated',
             'msg_content': event['text']
         }
-        await self.send_json(resp)
+        self.queue_frame('user.updated', encode_frames(resp)[self.encoding])
+
+
+def cors_headers(scope: dict) -> List[Tuple[bytes, bytes]]:
+    """ The CORS headers `CorsMiddleware` would add to the response - for the http consumers asgi.py
+    serves ahead of Django, and so of its middleware. Same settings (`CORS_ORIGIN_ALLOW_ALL`,
+    `CORS_ORIGIN_WHITELIST`...), minus the `check_request_enabled` signal, which wants a Django request. """
+
+    if not re.match(cors_conf.CORS_URLS_REGEX, scope['path']):
+        return []
+    headers = [(b'vary', b'Origin')]
+    origin = next((value.decode('latin1') for name, value in scope.get('headers', []) if name == b'origin'), None)
+    try:
+        url = urlsplit(origin) if origin else None
+    except ValueError:
+        url = None
+    if url is None:
+        return headers
+
+    if cors_conf.CORS_ALLOW_CREDENTIALS:
+        headers.append((b'access-control-allow-credentials', b'true'))
+    if not cors_conf.CORS_ALLOW_ALL_ORIGINS and not cors.origin_found_in_white_lists(origin, url):
+        return headers
+    allowed = '*' if cors_conf.CORS_ALLOW_ALL_ORIGINS and not cors_conf.CORS_ALLOW_CREDENTIALS else origin
+    headers.append((b'access-control-allow-origin', allowed.encode('latin1')))
+    if cors_conf.CORS_EXPOSE_HEADERS:
+        headers.append((b'access-control-expose-headers', ', '.join(cors_conf.CORS_EXPOSE_HEADERS).encode()))
+    if scope['method'] == 'OPTIONS':
+        headers += [
+            (b'access-control-allow-headers', ', '.join(cors_conf.CORS_ALLOW_HEADERS).encode()),
+            (b'access-control-allow-methods', ', '.join(cors_conf.CORS_ALLOW_METHODS).encode()),
+        ]
+        if cors_conf.CORS_PREFLIGHT_MAX_AGE:
+            headers.append((b'access-control-max-age', str(cors_conf.CORS_PREFLIGHT_MAX_AGE).encode()))
+    return headers
+
+
+cors = CorsMiddleware(lambda request: None)  # for its origin whitelist checks only
+
+
+class UserEventsConsumer(AsyncHttpConsumer):
+    """ Server-sent events flavour of `UserConsumer` for clients that only listen: `GET /me/events/`
+    streams the same `user.updated` messages, one `data:` line each, from the same channel layer group.
+
+    Nothing but the group membership and a keepalive timer is kept per connection - no outbox, and
+    the protocol server's own flow control deals with slow readers. """
+
+    group_name: Optional[str] = None
+    keepalive: Optional[asyncio.Task] = None
+
+    async def http_request(self, message: dict) -> None:
+        """ Unlike the parent, keep going once the request is in - the response ends when the client leaves. """
+
+        if not message.get('more_body'):
+            await self.handle(b'')
+
+    async def handle(self, body: bytes) -> None:
+        cors = cors_headers(self.scope)
+        if self.scope['method'] == 'OPTIONS':
+            await self.send_response(200, b'', headers=cors + [(b'content-length', b'0')])  # a preflight
+            raise StopConsumer()
+        user = self.scope.get('user')
+        if not user or isinstance(user, AnonymousUser):
+            await self.send_response(401, b'Authentication credentials were not provided.', headers=cors)
+            raise StopConsumer()
+
+        await self.send_headers(headers=cors + [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),  # or nginx holds the events back
+        ])
+        await self.send_body(f'retry: {settings.SSE_RETRY * 1000}\n\n'.encode(), more_body=True)
+        metrics.gauge('sse.connections.live', 1)
+        metrics.ensure_reporter()
+
+        self.group_name = f'ws-user-{user.pk}'
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        self.keepalive = asyncio.ensure_future(self.send_keepalives())
+
+        last_event_id = self.get_last_event_id()
+        if last_event_id:
+            for content in await database_sync_to_async(catch_up)(user.pk, last_event_id):
+                await self.send_event(content.get('event_id'), json.dumps(content))
+
+    def get_last_event_id(self) -> Optional[str]:
+        """ Browsers send `Last-Event-ID` by themselves when they reconnect, the param is for the first connect. """
+
+        for name, value in self.scope.get('headers', []):
+            if name == b'last-event-id':
+                return value.decode('latin1')
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        return params.get('last_event_id', [None])[0]
+
+    async def send_event(self, event_id: Optional[str], data: str) -> None:
+        event = f'id: {event_id}\n' if event_id else ''
+        await self.send_body(f'{event}data: {data}\n\n'.encode(), more_body=True)
+
+    async def send_keepalives(self) -> None:
+        """ Comment lines, so proxies don't time out a quiet stream. """
+
+        while True:
+            await asyncio.sleep(settings.SSE_KEEPALIVE_INTERVAL)
+            await self.send_body(b': keepalive\n\n', more_body=True)
+
+    async def disconnect(self) -> None:
+        if self.keepalive:
+            self.keepalive.cancel()
+        if self.group_name:
+            metrics.gauge('sse.connections.live', -1)
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            self.group_name = None
+
+    async def user_update(self, event: dict) -> None:
+        await self.send_event(event.get('event_id'), event['frames']['json'])
+
+
+def user_updated(data: dict) -> dict:
+    return {
+        'msg_type': 'user.updated',
+        'msg_content': data
+    }
+
+
+def user_update_message(data: dict, event_id: Optional[str] = None) -> dict:
+    """ The channel layer message carrying a serialized user to its watchers. `event_id` is the
+    update's position in the user's stream, which clients pass back as `?last_event_id=` to resume. """
+
+    # encode here once per group message, rather than once per connected socket
+    resp = user_updated(data)
+    if event_id:
+        resp['event_id'] = event_id
+    return {
+        'type': 'user.update',
+        'event_id': event_id,
+        'frames': encode_frames(resp)
+    }
+
+
+def catch_up(user_pk: int, last_event_id: str) -> List[dict]:
+    """ What a client coming back after `last_event_id` missed: the updates since then from the
+    user's stream, or the current state if we can't tell (see `contrib.streams`) - nothing if the
+    user was deleted meanwhile. """
+
+    events = streams.read_since(user_pk, last_event_id)
+    if events is not None:
+        metrics.incr('resume.replays')
+        return [dict(content, event_id=event_id) for event_id, content in events]
+
+    event_id = streams.latest_id(user_pk)  # read first, so the state is at least that recent
+    user = User.objects.filter(pk=user_pk).first()
+    if user is None:
+        return []
+    metrics.incr('resume.snapshots')
+    content = user_updated(user_payload(user))
+    content['event_id'] = event_id
+    return [content]
+
+
+def publish_users(users: Iterable[Union[User, int]]) -> int:
+    """ Pushes the current state of many users (instances or pks) to their watchers at once:
+    one query, one payload cache lookup and one bulk send per `PUBLISH_BATCH_SIZE` users, instead of
+    a `post_save` round per row.
+    Returns the number of users published. """
+
+    pks = [getattr(user, 'pk', user) for user in users]
+    channel_layer = get_channel_layer()
+    published = 0
+    for start in range(0, len(pks), PUBLISH_BATCH_SIZE):
+        users = User.objects.filter(pk__in=pks[start:start + PUBLISH_BATCH_SIZE])
+        payloads = [json.loads(payload) for payload in get_user_payloads(users)]
+        event_ids = streams.append_many((data['id'], user_updated(data)) for data in payloads)
+        messages = [
+            (f'ws-user-{data["id"]}', user_update_message(data, event_id))
+            for data, event_id in zip(payloads, event_ids)
+        ]
+        if messages:
+            logger.debug(f'Publishing {len(messages)} user updates.')
+            async_to_sync(group_send_many)(channel_layer, messages)
+        published += len(messages)
+    return published
 
 
 @receiver(post_save, sender=User, dispatch_uid='update_user_overwatchers')
@@ -54,15 +522,21 @@ def update_user_watchers(sender, instance, **kwargs):
     """
 
     logger.debug(f'Signal received that user #{instance.pk} has been updated.')
+    if settings.USER_EVENTS_OUTBOX:
+        # same transaction as the save - `dispatch_outbox` publishes it, redis stays off the write path
+        OutboxEvent.objects.create(topic='user.updated', object_id=instance.pk)
+        return
+    # not before the save commits: it may roll back, and the row is locked until then (see `User.save`)
+    transaction.on_commit(lambda: publish_user(instance), using=kwargs.get('using'))
+
+
+def publish_user(instance: User) -> None:
     group_name = f'ws-user-{instance.pk}'
-    serializer = UserSerializer(instance)
+    payload = user_payload(instance)
 
     channel_layer = get_channel_layer()
-
-    data = {
-        'type': 'user.update',
-        'text': serializer.data
-    }
+    event_id = streams.append(instance.pk, user_updated(payload))
+    data = user_update_message(payload, event_id)
     logger.debug(f'Passing this data to the consumer with group_name {group_name}: {data}.')
 
     # since group_send is a async process but signals are sync,
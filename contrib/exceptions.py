@@ -0,0 +1,41 @@
+from django.http import HttpResponse
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import APIException
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from users.hashers import HashingUnavailable
+
+
+class HashingBusy(APIException):
+    status_code = 503
+    default_detail = _('Too many sign-ins right now, please try again in a moment.')
+    default_code = 'hashing_unavailable'
+    wait = 1  # DRF sends it as Retry-After
+
+
+def exception_handler(exc: Exception, context: dict):
+    """ DRF's exception handler, which also answers the errors of code that doesn't know about DRF
+    (i.e. password hashers, called by Django) with an API response. """
+
+    if isinstance(exc, HashingUnavailable):
+        exc = HashingBusy()
+    return drf_exception_handler(exc, context)
+
+
+class HashingBusyMiddleware:
+    """ Answers `HashingUnavailable` with a 503 outside the API too, i.e. the admin login or any other
+    Django view checking passwords through `ModelBackend`. """
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception: Exception):
+        if not isinstance(exception, HashingUnavailable):
+            return None
+        response = HttpResponse(str(HashingBusy.default_detail), status=503, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(HashingBusy.wait)
+        return response
@@ -0,0 +1,274 @@
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import logging
+import random
+import string
+import time
+
+from contrib.metrics import metrics
+
+logger = logging.getLogger('sockets')
+
+
+async def group_send_many(layer: BaseChannelLayer, messages: Iterable[Tuple[str, dict]]) -> None:
+    """ Sends a batch of `(group, message)` pairs - in one go if the layer knows how, one by one otherwise. """
+
+    if hasattr(layer, 'group_send_many'):
+        await layer.group_send_many(messages)
+        return
+    for group, message in messages:
+        await layer.group_send(group, message)
+
+
+async def groups_with_members(layer: BaseChannelLayer, groups: Iterable[str]) -> Set[str]:
+    """ Those of `groups` anybody is listening to - so publishers can skip serializing for nobody.
+    All of them for layers that can't tell. """
+
+    groups = set(groups)
+    if isinstance(layer, FanoutChannelLayer):
+        members = await layer.remote_members(groups)
+    elif isinstance(layer, RedisChannelLayer):
+        members = await redis_group_members(layer, groups)
+    elif isinstance(layer, InMemoryChannelLayer):
+        members = {group: layer.groups.get(group) for group in groups}
+    else:
+        return groups
+    return {group for group, channels in members.items() if channels}
+
+
+async def redis_group_members(layer: RedisChannelLayer, groups: Set[str]) -> Dict[str, List[str]]:
+    """ Channels in each group, in one pipelined call per shard (skipping expired memberships like
+    `group_send` does.) """
+
+    by_connection: Dict[int, List[str]] = defaultdict(list)
+    for group in groups:
+        by_connection[layer.consistent_hash(group)].append(group)
+
+    members = {}
+    oldest = int(time.time()) - layer.group_expiry
+    for index, shard_groups in by_connection.items():
+        async with layer.connection(index) as connection:
+            pipe = connection.pipeline()
+            for group in shard_groups:
+                pipe.zrangebyscore(layer._group_key(group), min=oldest)
+            results = await pipe.execute()
+        for group, channels in zip(shard_groups, results):
+            members[group] = [channel.decode('utf8') for channel in channels]
+    return members
+
+
+class FanoutChannelLayer(BaseChannelLayer):
+    """ Channel layer where each ASGI process joins a Redis group once and fans the
+    messages out to its own consumers in memory.
+
+    With the stock Redis layer every websocket is a member of the Redis group, so each
+    connect costs a `group_add` round-trip and each `group_send` costs one message per
+    connection. Here the consumers of this process get in-memory channels and only a
+    single per-process channel is registered with Redis, so Redis traffic scales with
+    the number of processes rather than the number of sockets.
+
+    Caveat: process-local channels can only be reached through groups (which is all
+    `contrib.consumers` needs), and only they can join groups - redis members get the
+    `fanout.*` envelopes meant for processes, so other channels are turned down in
+    `group_add`. Sends to any other channel name are handed straight to Redis.
+    """
+
+    extensions = ['groups', 'flush']
+    local_layer_class = InMemoryChannelLayer
+    remote_layer_class = RedisChannelLayer
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs) -> None:
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.group_expiry = group_expiry
+        self.local = self.local_layer_class(
+            expiry=expiry, group_expiry=group_expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.remote = self.remote_layer_class(
+            expiry=expiry, group_expiry=group_expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+
+        # every channel created by this process shares this marker, which is how we tell them apart
+        self.local_marker = '.fanout-' + ''.join(random.choice(string.ascii_letters) for i in range(8)) + '!'
+        self.local_groups: Dict[str, Set[str]] = defaultdict(set)
+        self.remote_groups: Dict[str, float] = {}  # group -> last time we (re)joined it in redis
+        self.process_channel: Optional[str] = None
+        self.reader: Optional[asyncio.Task] = None
+
+    def is_local(self, channel: str) -> bool:
+        return self.local_marker in channel
+
+    async def new_channel(self, prefix: str = 'specific') -> str:
+        """ Channels for our own consumers live in memory only. """
+
+        return prefix + self.local_marker + ''.join(random.choice(string.ascii_letters) for i in range(12))
+
+    async def send(self, channel: str, message: dict) -> None:
+        if self.is_local(channel):
+            await self.local.send(channel, message)
+        else:
+            await self.remote.send(channel, message)
+
+    async def receive(self, channel: str) -> dict:
+        if self.is_local(channel):
+            return await self.local.receive(channel)
+        return await self.remote.receive(channel)
+
+    async def group_add(self, group: str, channel: str) -> None:
+        """ Local channels are tracked in memory - redis only ever sees our process channel,
+        and only the first time the group gets a member here (or when the membership would expire.) """
+
+        if not self.is_local(channel):
+            raise ValueError(f'Only channels of this layer can join groups, not {channel}.')
+
+        members = self.local_groups[group]
+        if channel not in members:
+            members.add(channel)
+            metrics.gauge('channels.local_members', 1)
+            metrics.set('channels.local_groups', len(self.local_groups))
+        await self._ensure_reader()
+
+        joined_at = self.remote_groups.get(group)
+        if joined_at is None or joined_at < time.time() - self.group_expiry / 2:
+            await self.remote.group_add(group, self.process_channel)
+            self.remote_groups[group] = time.time()
+
+    async def group_discard(self, group: str, channel: str) -> None:
+        """ Leave the redis group once our last local member is gone. """
+
+        members = self.local_groups.get(group)
+        if members is None or channel not in members:
+            return
+        members.discard(channel)
+        metrics.gauge('channels.local_members', -1)
+        if not members:
+            del self.local_groups[group]
+            metrics.set('channels.local_groups', len(self.local_groups))
+            if self.remote_groups.pop(group, None) is not None:
+                await self.remote.group_discard(group, self.process_channel)
+
+    async def group_send(self, group: str, message: dict) -> None:
+        """ One redis message per subscribed process - the process fans it out itself. """
+
+        await self.remote.group_send(group, {'type': 'fanout.message', 'group': group, 'message': message})
+
+    async def group_send_many(self, messages: Iterable[Tuple[str, dict]]) -> None:
+        """ Bulk `group_send`. Memberships for all groups are read in one pipelined redis call per shard,
+        and every subscribed process then gets a single message with everything meant for it - instead
+        of one round-trip and one message per group. """
+
+        messages = list(messages)
+        members = await self.remote_members({group for group, message in messages})
+
+        batches: Dict[str, List] = defaultdict(list)
+        for group, message in messages:
+            for channel in members.get(group, ()):
+                batches[channel].append([group, message])
+        for channel, batch in batches.items():
+            try:
+                await self.remote.send(channel, {'type': 'fanout.batch', 'messages': batch})
+            except ChannelFull:
+                metrics.incr('channels.capacity_errors')
+                logger.warning(f'Process channel {channel} is full, batch of {len(batch)} messages dropped.')
+
+    async def remote_members(self, groups: Set[str]) -> Dict[str, List[str]]:
+        """ Process channels subscribed to each group in redis. """
+
+        return await redis_group_members(self.remote, groups)
+
+    async def flush(self) -> None:
+        await self.local.flush()
+        await self.remote.flush()
+        self.local_groups.clear()
+        self.remote_groups.clear()
+
+    async def close(self) -> None:
+        if self.reader:
+            self.reader.cancel()
+        if hasattr(self.remote, 'close_pools'):  # channels_redis
+            await self.remote.close_pools()
+
+    async def _ensure_reader(self) -> None:
+        """ Start (or restart, if the event loop changed under us) the task listening to our process channel. """
+
+        loop = asyncio.get_running_loop()
+        if self.reader and not self.reader.done() and self.reader.get_loop() is loop:
+            return
+        if self.process_channel is None:
+            self.process_channel = await self.remote.new_channel('fanout')
+        self.reader = loop.create_task(self._read())
+
+    async def _read(self) -> None:
+        """ Forward everything sent to this process to the local members of the group. """
+
+        while True:
+            try:
+                envelope = await self.remote.receive(self.process_channel)
+                if envelope['type'] == 'fanout.batch':
+                    for group, message in envelope['messages']:
+                        await self._forward(group, message)
+                else:
+                    await self._forward(envelope['group'], envelope['message'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Fanout reader failed to forward a message.')
+                await asyncio.sleep(1)
+
+    async def _forward(self, group: str, message: dict) -> None:
+        channels = list(self.local_groups.get(group, ()))
+        metrics.observe('channels.fanout_size', len(channels))
+        for channel in channels:
+            try:
+                await self.local.send(channel, message)
+            except ChannelFull:
+                # the consumer isn't keeping up - say so instead of dropping silently
+                metrics.incr('channels.capacity_errors')
+                logger.warning(f'Channel {channel} in group {group} is full, message dropped.')
+
+
+class InstrumentedLayerMixin:
+    """ Counts and times what goes through a channel layer, in `contrib.metrics`. Goes in front of the
+    layer class, see `InstrumentedFanoutChannelLayer`. """
+
+    async def send(self, channel: str, message: dict) -> None:
+        metrics.incr('channels.sends')
+        with metrics.timer('channels.send_latency'):
+            try:
+                await super().send(channel, message)
+            except ChannelFull:
+                metrics.incr('channels.capacity_errors')
+                raise
+
+    async def group_send(self, group: str, message: dict) -> None:
+        metrics.incr('channels.group_sends')
+        with metrics.timer('channels.group_send_latency'):
+            await super().group_send(group, message)
+
+    async def group_send_many(self, messages: Iterable[Tuple[str, dict]]) -> None:
+        messages = list(messages)
+        metrics.incr('channels.group_sends', len(messages))
+        with metrics.timer('channels.group_send_many_latency'):
+            if hasattr(super(), 'group_send_many'):
+                await super().group_send_many(messages)
+            else:
+                for group, message in messages:
+                    await super().group_send(group, message)
+
+    async def group_add(self, group: str, channel: str) -> None:
+        metrics.incr('channels.group_adds')
+        await super().group_add(group, channel)
+
+    async def group_discard(self, group: str, channel: str) -> None:
+        metrics.incr('channels.group_discards')
+        await super().group_discard(group, channel)
+
+
+class InstrumentedFanoutChannelLayer(InstrumentedLayerMixin, FanoutChannelLayer):
+    pass
+
+
+class InstrumentedRedisChannelLayer(InstrumentedLayerMixin, RedisChannelLayer):
+    pass
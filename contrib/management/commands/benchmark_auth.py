@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.test import override_settings
+
+from channels.testing import HttpCommunicator
+from asgiref.sync import async_to_sync
+from collections import Counter, defaultdict
+from typing import Dict, List
+import asyncio
+import json
+import time
+
+from contrib.management.commands.benchmark_sockets import percentile
+from users.hashers import hashing_pool
+from users.models import User
+from users.tokens import issue_tokens
+
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Mix password logins with /me/ and /_health/ reads against the ASGI app and report the latency of each.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help='Number of clients logging in over and over.')
+        parser.add_argument('--readers', type=int, default=20, help='Number of clients reading /me/ and /_health/.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run for.')
+        parser.add_argument('--pool-size', type=int, default=None,
+                            help='Overrides PASSWORD_HASHING_POOL_SIZE, 0 to hash inline.')
+        parser.add_argument('--max-queue', type=int, default=None, help='Overrides PASSWORD_HASHING_MAX_QUEUE.')
+
+    def handle(self, *args, **options):
+        overrides = {'HEALTH_RATE_THROTTLE': '1000000/hour'}
+        if options['pool_size'] is not None:
+            overrides['PASSWORD_HASHING_POOL_SIZE'] = options['pool_size']
+        if options['max_queue'] is not None:
+            overrides['PASSWORD_HASHING_MAX_QUEUE'] = options['max_queue']
+
+        with override_settings(**overrides):
+            encoded = make_password(PASSWORD)  # hashed once, the users all share it
+            users = [User.objects.create(username=f'benchmark-auth-{i}', password=encoded)
+                     for i in range(max(options['logins'], options['readers']))]
+            try:
+                report = async_to_sync(self.run)(users, options)
+            finally:
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+                hashing_pool.shutdown()
+
+        self.stdout.write(f'logins: {options["logins"]} clients, readers: {options["readers"]} clients, '
+                          f'{options["duration"]:.0f}s')
+        for path, latencies in report['latencies'].items():
+            statuses = ', '.join(f'{status}: {count}' for status, count in sorted(report['statuses'][path].items()))
+            self.stdout.write(f'{path} {len(latencies) / options["duration"]:.0f}/s ({statuses})')
+            self.stdout.write(
+                f'  latency ms: p50 {percentile(latencies, 50):.1f}, p90 {percentile(latencies, 90):.1f}, '
+                f'p99 {percentile(latencies, 99):.1f}, max {max(latencies):.1f}')
+
+    async def run(self, users: List[User], options: dict) -> dict:
+        """ Every client sends its next request as soon as the previous one is answered, until time is up. """
+
+        from asgi import application
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        statuses: Dict[str, Counter] = defaultdict(Counter)
+        tokens = {pk: issued['access'] for pk, issued in issue_tokens(users, kinds=('access',)).items()}
+        deadline = time.monotonic() + options['duration']
+
+        async def request(path: str, method: str = 'GET', body: bytes = b'', headers: list = ()) -> None:
+            communicator = HttpCommunicator(application, method, path, body=body, headers=list(headers))
+            started = time.monotonic()
+            response = await communicator.get_response(timeout=60)
+            latencies[path].append((time.monotonic() - started) * 1000)
+            statuses[path][response['status']] += 1
+
+        async def login(user: User) -> None:
+            body = json.dumps({'username': user.username, 'password': PASSWORD}).encode()
+            while time.monotonic() < deadline:
+                await request('/auth/token/', 'POST', body, [
+                    (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())])
+
+        async def read(user: User) -> None:
+            authorization = [(b'authorization', f'Bearer {tokens[user.pk]}'.encode())]
+            while time.monotonic() < deadline:
+                await request('/me/', headers=authorization)
+                await request('/_health/')
+
+        await asyncio.gather(
+            *[login(users[i]) for i in range(options['logins'])],
+            *[read(users[i]) for i in range(options['readers'])],
+        )
+        return {'latencies': latencies, 'statuses': statuses}
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from channels_redis.core import RedisChannelLayer
+from asgiref.sync import async_to_sync
+import asyncio
+import redis
+import time
+
+from contrib.layers import FanoutChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Compare redis traffic of the stock redis channel layer and the fanout layer with many simulated sockets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=5000, help='Number of simulated websocket consumers.')
+        parser.add_argument('--groups', type=int, default=500, help='Number of `ws-user-*` groups to spread them over.')
+        parser.add_argument('--messages', type=int, default=1000, help='Number of group_send calls.')
+        parser.add_argument('--host', default=None, help='Redis host, defaults to the one in CHANNEL_LAYERS.')
+        parser.add_argument('--port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        host = options['host'] or settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0][0]
+        hosts = [(host, options['port'])]
+        client = redis.Redis(host=host, port=options['port'])
+
+        for layer_class in (RedisChannelLayer, FanoutChannelLayer):
+            layer = layer_class(hosts=hosts, capacity=10000)
+            result = async_to_sync(self.run_layer)(layer, client, options)
+            self.stdout.write(
+                f'{layer_class.__name__}: '
+                f'connect {result["connect_seconds"]:.2f}s ({result["connect_commands"]} redis commands), '
+                f'broadcast {result["send_seconds"]:.2f}s ({result["send_commands"]} redis commands), '
+                f'delivered {result["delivered"]}/{result["expected"]}'
+            )
+
+    async def run_layer(self, layer, client: redis.Redis, options: dict) -> dict:
+        """ Connect the sockets, broadcast to every group in turn, wait for delivery. """
+
+        sockets, groups, messages = options['sockets'], options['groups'], options['messages']
+        members = {f'ws-user-{i}': 0 for i in range(groups)}
+        delivered = 0
+
+        async def socket(group: str) -> None:
+            nonlocal delivered
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+            ready.release()
+            while True:
+                await layer.receive(channel)
+                delivered += 1
+
+        ready = asyncio.Semaphore(0)
+        commands = client.info('stats')['total_commands_processed']
+        started = time.monotonic()
+        tasks = []
+        for i in range(sockets):
+            group = f'ws-user-{i % groups}'
+            members[group] += 1
+            tasks.append(asyncio.ensure_future(socket(group)))
+        for i in range(sockets):
+            await ready.acquire()
+        connect_seconds = time.monotonic() - started
+        connect_commands = client.info('stats')['total_commands_processed'] - commands
+
+        expected = sum(members[f'ws-user-{i % groups}'] for i in range(messages))
+        commands = client.info('stats')['total_commands_processed']
+        started = time.monotonic()
+        for i in range(messages):
+            await layer.group_send(f'ws-user-{i % groups}', {'type': 'user.update', 'text': {'id': i}})
+        deadline = time.monotonic() + 30
+        while delivered < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        send_seconds = time.monotonic() - started
+        send_commands = client.info('stats')['total_commands_processed'] - commands
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if isinstance(layer, FanoutChannelLayer):
+            await layer.close()
+        else:
+            await layer.close_pools()
+
+        return {
+            'connect_seconds': connect_seconds,
+            'connect_commands': connect_commands,
+            'send_seconds': send_seconds,
+            'send_commands': send_commands,
+            'delivered': delivered,
+            'expected': expected,
+        }
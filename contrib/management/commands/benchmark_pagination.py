@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from typing import Callable
+import time
+
+from contrib.pagination import Cursor, KeysetPagination
+from users.models import User
+
+PREFIX = 'benchmark-page-'
+
+
+def best_time(run: Callable[[], None], rounds: int) -> float:
+    """ Best of `rounds`, so a GC pause or a noisy neighbour doesn't decide the result. """
+
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = 'Compare a deep page with LimitOffsetPagination against KeysetPagination (contrib.pagination).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_001, help='Users to create (removed afterwards).')
+        parser.add_argument('--offset', type=int, default=1_000_000)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help='Keep the users for the next run.')
+
+    def handle(self, *args, **options):
+        existing = User.objects.filter(username__startswith=PREFIX).count()
+        for start in range(existing, options['rows'], 10000):
+            User.objects.bulk_create([
+                User(username=f'{PREFIX}{i:09}', email=f'{PREFIX}{i}@example.com')
+                for i in range(start, min(start + 10000, options['rows']))
+            ])
+        self.stdout.write(f'{User.objects.count():,} users')
+
+        queryset = User.objects.order_by('username')
+        offset, page_size = options['offset'], options['page_size']
+        factory = APIRequestFactory()
+
+        def offset_page():
+            request = Request(factory.get('/users/', {'limit': page_size, 'offset': offset}))
+            paginator = LimitOffsetPagination()
+            paginator.get_paginated_response(paginator.paginate_queryset(queryset, request))
+
+        # the cursor a client would have after paging to `offset` - worked out once, outside the timing
+        keyset = KeysetPagination()
+        keyset.ordering, keyset.base_url = ['username'], 'http://testserver/users/'
+        before = queryset.values_list('username', flat=True)[offset - 1]
+        cursor_url = keyset.encode_cursor(Cursor(values=[before], reverse=False))
+
+        def keyset_page():
+            paginator = KeysetPagination()
+            paginator.get_paginated_response(paginator.paginate_queryset(queryset, Request(factory.get(cursor_url))))
+
+        try:
+            stock = best_time(offset_page, options['rounds'])
+            fast = best_time(keyset_page, options['rounds'])
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=PREFIX).delete()
+        self.stdout.write(f'page at offset {offset:,}: limit/offset {stock * 1000:,.2f}ms, '
+                          f'keyset {fast * 1000:,.2f}ms ({stock / fast:,.0f}x)')
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+from rest_framework.renderers import JSONRenderer
+from typing import Any, List, Tuple
+import time
+
+from contrib.compiler import compile_serializer
+from contrib.renderers import ORJSONRenderer
+from users.models import User
+from users.serializers import (
+    AccountVerifySerializer, PasswordResetConfirmSerializer, PasswordResetSerializer, SocialAuthInputSerializer,
+    SocialAuthOutputSerializer, UserSerializer,
+)
+
+
+def seconds_per_render(renderer: JSONRenderer, data: Any, rounds: int, repeat: int) -> float:
+    """ Best of `rounds`, so a GC pause or a noisy neighbour doesn't decide the result. """
+
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            renderer.render(data)
+        best = min(best, time.perf_counter() - started)
+    return best / repeat
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and response size of DRF\'s JSON renderer against orjson (contrib.renderers).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Users in the `UserSerializer` list payload.')
+        parser.add_argument('--repeat', type=int, default=1000, help='Renders per round.')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def payloads(self, n: int) -> List[Tuple[str, Any]]:
+        """ What the API actually sends for the serializers in `users.serializers` - output, and the
+        validation errors (lazy translation strings included) the input serializers answer with. """
+
+        users = [
+            User(id=i, username=f'user-{i}', first_name='Zoé', last_name='Hayward', email=f'user-{i}@example.com')
+            for i in range(n)
+        ]
+        invalid = [
+            PasswordResetSerializer(data={'email': 'not an email'}),
+            PasswordResetConfirmSerializer(data={'new_password1': 'short', 'new_password2': 'short'}),
+            AccountVerifySerializer(data={}),
+            SocialAuthInputSerializer(data={'provider': '', 'access_token': 'x' * 5000}),
+        ]
+        payloads = [
+            ('UserSerializer', compile_serializer(UserSerializer).to_representation(users[0])),
+            (f'UserSerializer x{n}', {'count': n, 'next': None, 'previous': None,
+                                      'results': compile_serializer(UserSerializer).many(users)}),
+            ('SocialAuthOutputSerializer', SocialAuthOutputSerializer(
+                {'email': 'user@example.com', 'username': 'user', 'token': 'e' * 200}).data),
+        ]
+        for serializer in invalid:
+            serializer.is_valid()
+            payloads.append((f'{type(serializer).__name__} (errors)', serializer.errors))
+        return payloads
+
+    def handle(self, *args, **options):
+        stock, fast = JSONRenderer(), ORJSONRenderer()
+        for name, data in self.payloads(options['users']):
+            size = len(stock.render(data))
+            if fast.render(data) != stock.render(data):
+                self.stderr.write(f'{name}: orjson output differs!')
+            before = seconds_per_render(stock, data, options['rounds'], options['repeat'])
+            after = seconds_per_render(fast, data, options['rounds'], options['repeat'])
+            self.stdout.write(f'{name}: {size:,} bytes, json {before * 1e6:,.1f}µs, orjson {after * 1e6:,.1f}µs '
+                              f'({before / after:.1f}x)')
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from contextlib import ExitStack
+from typing import Any, Callable, List
+from unittest import mock
+import time
+
+from contrib.compiler import compile_serializer
+from contrib.models import PublicGlobalSettings
+from contrib.serializers import HealthSerializer, PublicGlobalSettingsSerializer
+from users.models import User
+from users.serializers import UserSerializer
+
+
+def objects_per_second(serialize: Callable[[Any], Any], instances: List[Any], rounds: int) -> float:
+    """ Best of `rounds`, so a GC pause or a noisy neighbour doesn't decide the result. """
+
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for instance in instances:
+            serialize(instance)
+        best = min(best, time.perf_counter() - started)
+    return len(instances) / best
+
+
+class Command(BaseCommand):
+    help = 'Compare objects/sec of stock DRF serializers against their compiled versions (contrib.compiler).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=10000, help='Objects to serialize per round.')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        n = options['objects']
+        cases = [
+            (UserSerializer, [
+                User(id=i, username=f'user-{i}', first_name='Dylan', last_name='Hayward', email=f'user-{i}@example.com')
+                for i in range(n)
+            ]),
+            (PublicGlobalSettingsSerializer, [PublicGlobalSettings(id=1) for _ in range(n)]),
+            (HealthSerializer, [{} for _ in range(n)]),
+        ]
+
+        with ExitStack() as stack:
+            # the health checks themselves hit storage and the database - only the serializer is measured
+            stack.enter_context(mock.patch.object(HealthSerializer, 'is_storage_ok', return_value=True))
+            stack.enter_context(mock.patch.object(HealthSerializer, 'is_postgres_ok', return_value=True))
+
+            for serializer_class, instances in cases:
+                compiled = compile_serializer(serializer_class)
+                if compiled.to_representation(instances[0]) != serializer_class(instances[0]).data:
+                    self.stderr.write(f'{serializer_class.__name__}: compiled output differs!')
+                stock = objects_per_second(lambda instance: serializer_class(instance).data, instances, options['rounds'])
+                fast = objects_per_second(compiled.to_representation, instances, options['rounds'])
+                self.stdout.write(f'{serializer_class.__name__}: DRF {stock:,.0f}/s, compiled {fast:,.0f}/s '
+                                  f'({fast / stock:.1f}x)')
@@ -0,0 +1,138 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import async_to_sync, sync_to_async
+from typing import Dict, List
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from users.models import User
+from users.tokens import issue_tokens
+
+LAYERS = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'fanout': 'contrib.layers.FanoutChannelLayer',
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """ Nearest-rank percentile, good enough for a benchmark report. """
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Open N websocket clients against the ASGI app and measure how UserConsumer copes with user saves.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Number of concurrent websocket clients.')
+        parser.add_argument('--users', type=int, default=100, help='Number of distinct users the clients log in as.')
+        parser.add_argument('--rate', type=float, default=50, help='User saves per second.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to keep saving users for.')
+        parser.add_argument('--layer', choices=LAYERS.keys(), default='memory', help='Channel layer to run against.')
+        parser.add_argument('--host', default=None, help='Redis host for the redis/fanout layers.')
+        parser.add_argument('--port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        config = {'capacity': 1000}
+        if options['layer'] != 'memory':
+            host = options['host'] or settings.CHANNEL_LAYERS['default']['CONFIG']['hosts'][0][0]
+            config['hosts'] = [(host, options['port'])]
+        channel_layers.set('default', import_string(LAYERS[options['layer']])(**config))
+
+        users = [User.objects.create(username=f'benchmark-socket-{i}') for i in range(options['users'])]
+        try:
+            report = async_to_sync(self.run)(users, options)
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        latencies = [seconds * 1000 for seconds in report['latencies']]
+        self.stdout.write(f'layer: {options["layer"]}, clients: {options["clients"]}, users: {options["users"]}')
+        self.stdout.write(f'connect: {report["connected"]} clients in {report["connect_seconds"]:.2f}s '
+                          f'({report["connected"] / report["connect_seconds"]:.0f}/s)')
+        self.stdout.write(f'memory: {report["memory"] / max(report["connected"], 1) / 1024:.1f} KiB per connection')
+        self.stdout.write(f'saves: {report["saves"]}, pushes expected: {report["expected"]}, '
+                          f'received: {len(latencies)}, dropped: {report["expected"] - len(latencies)}')
+        if latencies:
+            self.stdout.write(
+                f'push latency ms: p50 {percentile(latencies, 50):.1f}, p90 {percentile(latencies, 90):.1f}, '
+                f'p99 {percentile(latencies, 99):.1f}, max {max(latencies):.1f}, mean {statistics.mean(latencies):.1f}')
+
+    async def run(self, users: List[User], options: dict) -> dict:
+        """ Connect everyone, save users at the given rate, then wait for the pushes to drain. """
+
+        from asgi import application
+
+        saved_at: Dict[str, float] = {}
+        latencies: List[float] = []
+
+        async def listen(communicator: WebsocketCommunicator) -> None:
+            while True:
+                response = await communicator.receive_json_from(timeout=3600)
+                if response['msg_type'] != 'user.updated':
+                    continue  # heartbeat pings
+                stamp = response['msg_content']['first_name']
+                if stamp in saved_at:
+                    latencies.append(time.monotonic() - saved_at[stamp])
+
+        tokens = {pk: issued['access'] for pk, issued in issue_tokens(users, kinds=('access',)).items()}
+
+        tracemalloc.start()
+        memory = tracemalloc.get_traced_memory()[0]
+        started = time.monotonic()
+
+        communicators = []
+        for i in range(options['clients']):
+            token = tokens[users[i % len(users)].pk]
+            communicator = WebsocketCommunicator(application, f'ws/user-watcher/?token={token}')
+            communicators.append(communicator)
+        results = await asyncio.gather(*[communicator.connect(timeout=30) for communicator in communicators])
+        connected = [communicator for communicator, (ok, _) in zip(communicators, results) if ok]
+
+        connect_seconds = time.monotonic() - started
+        memory = tracemalloc.get_traced_memory()[0] - memory
+        tracemalloc.stop()
+
+        listeners = [asyncio.ensure_future(listen(communicator)) for communicator in connected]
+        clients_per_user = {user.pk: 0 for user in users}
+        for i in range(len(connected)):
+            clients_per_user[users[i % len(users)].pk] += 1
+
+        saves = int(options['rate'] * options['duration'])
+        expected = 0
+        saving_started = time.monotonic()
+        for i in range(saves):
+            user = users[i % len(users)]
+            user.first_name = f'bench-{i}'
+            saved_at[user.first_name] = time.monotonic()
+            await sync_to_async(user.save)(update_fields=['first_name'])
+            expected += clients_per_user[user.pk]
+            await asyncio.sleep(max(0, saving_started + (i + 1) / options['rate'] - time.monotonic()))
+
+        deadline = time.monotonic() + 10
+        while len(latencies) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        await asyncio.gather(*[communicator.disconnect() for communicator in connected], return_exceptions=True)
+
+        return {
+            'connected': len(connected),
+            'connect_seconds': connect_seconds,
+            'memory': memory,
+            'saves': saves,
+            'expected': expected,
+            'latencies': latencies,
+        }
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from contrib.services import Outbox
+
+
+class Command(BaseCommand):
+    help = 'Publish outbox events (i.e. user updates) to the channel layer. Runs until stopped, unless --once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Events locked and published at a time.')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Stop once the outbox is empty.')
+
+    def handle(self, *args, **options):
+        outbox = Outbox(batch_size=options['batch_size'])
+        dispatched = outbox.run(interval=options['interval'], once=options['once'])
+        self.stdout.write(f'Dispatched {dispatched} events.')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+import json
+
+from contrib.metrics import collect
+
+
+class Command(BaseCommand):
+    help = 'Print the metrics (counters, gauges, histograms) last reported by each ASGI worker, and their total.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--total', action='store_true', help='Only print the total of all workers.')
+
+    def handle(self, *args, **options):
+        report = collect()
+        if options['total']:
+            report = report['total']
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+import asyncio
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger('sockets')
+
+# histogram bucket upper bounds - in milliseconds for timings
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class Metrics:
+    """ Process-local counters, gauges and histograms. Every ASGI worker has its own set, so numbers
+    are per worker - each worker publishes its snapshot to the cache now and then (see `report()`),
+    and `collect()` adds them all up. """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()  # signals bump counters from sync threads too
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = defaultdict(float)
+        self.histograms: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = defaultdict(float)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.reporter = None
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name: str, delta: float) -> None:
+        """ Moves a gauge up or down, i.e. `gauge('ws.connections', 1)` on connect and -1 on disconnect. """
+
+        with self.lock:
+            self.gauges[name] += delta
+
+    def set(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """ Adds a value to a histogram, i.e. a latency in ms. """
+
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = [0] * len(BUCKETS)
+            self.histograms[name][bisect.bisect_left(BUCKETS, value)] += 1
+            self.sums[name] += value
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """ Observes how long the block took, in ms. """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {
+                    name: {
+                        'count': sum(buckets),
+                        'sum': self.sums[name],
+                        'buckets': list(buckets),
+                    }
+                    for name, buckets in self.histograms.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.sums.clear()
+
+    def publish(self) -> None:
+        """ Leaves this worker's snapshot in the cache for `collect()`. Entries expire, so workers that
+        are gone drop out on their own. """
+
+        key = f'metrics:worker:{self.worker_id}'
+        cache.set(key, self.snapshot(), settings.METRICS_REPORT_INTERVAL * 3)
+        workers = set(cache.get('metrics:workers') or ())
+        if key not in workers:
+            cache.set('metrics:workers', workers | {key}, None)
+
+    def ensure_reporter(self) -> None:
+        """ Starts publishing every `METRICS_REPORT_INTERVAL` seconds from the running event loop,
+        unless that already happens. """
+
+        loop = asyncio.get_running_loop()
+        if self.reporter and not self.reporter.done() and self.reporter.get_loop() is loop:
+            return
+        self.reporter = loop.create_task(self.report())
+
+    async def report(self) -> None:
+        from asgiref.sync import sync_to_async
+
+        while True:
+            try:
+                await sync_to_async(self.publish, thread_sensitive=False)()
+            except Exception:
+                logger.exception('Could not publish metrics.')
+            await asyncio.sleep(settings.METRICS_REPORT_INTERVAL)
+
+
+def merge(snapshots: List[dict]) -> dict:
+    """ Adds up snapshots of several workers (gauges too - they count things like open sockets.) """
+
+    total: dict = {'counters': defaultdict(int), 'gauges': defaultdict(float), 'histograms': {}}
+    for snapshot in snapshots:
+        for name, value in snapshot['counters'].items():
+            total['counters'][name] += value
+        for name, value in snapshot['gauges'].items():
+            total['gauges'][name] += value
+        for name, histogram in snapshot['histograms'].items():
+            merged = total['histograms'].setdefault(name, {'count': 0, 'sum': 0, 'buckets': [0] * len(BUCKETS)})
+            merged['count'] += histogram['count']
+            merged['sum'] += histogram['sum']
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+    total['counters'] = dict(total['counters'])
+    total['gauges'] = dict(total['gauges'])
+    return total
+
+
+def collect() -> dict:
+    """ The last snapshot of every live worker, and their total. """
+
+    keys = cache.get('metrics:workers') or set()
+    workers = cache.get_many(list(keys))
+    if set(workers) != set(keys):
+        cache.set('metrics:workers', set(workers), None)  # forget the expired ones
+    return {
+        'buckets': [str(bound) for bound in BUCKETS],
+        'total': merge(list(workers.values())),
+        'workers': {key.split(':', 2)[2]: snapshot for key, snapshot in workers.items()},
+    }
+
+
+metrics = Metrics()
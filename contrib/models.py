@@ -49,3 +49,21 @@ class PublicGlobalSettings(SingletonModel):
     class Meta:
         verbose_name = 'Public Global Settings'
         verbose_name_plural = 'Private Global Settings'
+
+
+class OutboxEvent(models.Model):
+    """ A change waiting to be published, written in the same transaction as the change itself and
+    sent out afterwards by the `dispatch_outbox` command (see `contrib.services.Outbox`). Only the
+    topic and object id are kept - the current state is read when it's dispatched. """
+
+    topic = models.CharField(max_length=64)
+    object_id = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.topic} #{self.object_id}'
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Outbox event'
+        verbose_name_plural = 'Outbox events'
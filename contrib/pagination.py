@@ -0,0 +1,176 @@
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db.models import Field, Q, QuerySet
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, List, NamedTuple, Optional
+import binascii
+import datetime
+import json
+
+
+def encode_value(value: Any) -> str:
+    """ Cursor values that aren't JSON types - as strings the field parses back when filtering (datetimes
+    with all their microseconds, unlike `DjangoJSONEncoder`.) """
+
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)  # decimals, UUIDs...
+
+
+class Cursor(NamedTuple):
+    values: List[Any]  # of the ordering fields, for the row the page starts after (or before, in reverse)
+    reverse: bool
+
+
+class KeysetPagination(CursorPagination):
+    """ Keyset pagination: each page is the `page_size` rows that come after the last one of the page
+    before, by the queryset's ordering - `WHERE (username, id) > (last username, last id)` rather than
+    `OFFSET n`, so a deep page costs as much as the first one. There is no `count` (and no `COUNT(*)`),
+    only `next` and `previous` links with opaque cursors.
+
+    The ordering is the pagination's `ordering` if set, or the queryset's (an `OrderingFilter`, a view's
+    `order_by()`, or the model's `Meta.ordering`.) The primary key is added as the last field unless a
+    unique field comes before it, so rows never tie. Ordering fields should be indexed and non-null.
+    """
+
+    ordering = None
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> Optional[list]:
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor:
+            queryset = queryset.filter(self.keyset_filter(self.cursor))
+        if self.cursor and self.cursor.reverse:
+            queryset = queryset.order_by(*[self.invert(field) for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.cursor and self.cursor.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def get_ordering(self, request, queryset: QuerySet, view) -> List[str]:
+        ordering = type(self).ordering or queryset.query.order_by or queryset.model._meta.ordering or ['pk']
+        ordering = [ordering] if isinstance(ordering, str) else list(ordering)
+        if not all(isinstance(field, str) and field.lstrip('-') and field != '?' for field in ordering):
+            raise ImproperlyConfigured(f'{type(self).__name__} only works with field name orderings, not {ordering!r}.')
+
+        fields = []
+        for field in ordering:
+            fields.append(field)
+            if self.is_unique(queryset.model, field.lstrip('-')):
+                return fields
+        return fields + ['pk']
+
+    def is_unique(self, model, name: str) -> bool:
+        if name == 'pk':
+            return True
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return field.unique and not field.null
+
+    def invert(self, field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def keyset_filter(self, cursor: Cursor) -> Q:
+        """ Rows after the cursor's, by the (maybe inverted) ordering: `a > x OR (a = x AND b > y) ...` """
+
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith('-') != cursor.reverse
+            step = Q(**{f'{field.lstrip("-")}__{"lt" if descending else "gt"}': cursor.values[i]})
+            for previous, value in zip(self.ordering[:i], cursor.values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def get_field(self, path: str) -> Optional[Field]:
+        """ The model field an ordering goes by, through relations - None for anything else (i.e. an
+        annotation.) """
+
+        model = self.model
+        field = None
+        for name in path.split('__'):
+            if model is None:
+                return None
+            try:
+                field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            model = field.related_model
+        return field if isinstance(field, Field) else None  # not a reverse relation
+
+    def get_values(self, instance) -> List[Any]:
+        values = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            values.append(getattr(value, 'pk', value))  # a related object, ordered by its key
+        return values
+
+    def decode_cursor(self, request) -> Optional[Cursor]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            cursor = Cursor(values=list(data['v']), reverse=bool(data.get('r')))
+            ordering = data['o']
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or len(cursor.values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)  # made for another ordering
+        try:
+            # the client may have changed the values - filtering with invalid ones would fail later on
+            for i, field in enumerate(self.ordering):
+                model_field = self.get_field(field.lstrip('-'))
+                if cursor.values[i] is None:
+                    raise ValueError(f'No value for {field}.')
+                if model_field is not None:
+                    cursor.values[i] = model_field.to_python(cursor.values[i])
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor: Cursor) -> str:
+        data = {'o': self.ordering, 'v': cursor.values}
+        if cursor.reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(data, default=encode_value, separators=(',', ':')).encode())
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        if not self.page:
+            # an empty page reached backwards - start again from the beginning
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(self.get_values(self.page[-1]), reverse=False))
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return None  # the rows this cursor came from are gone
+        return self.encode_cursor(Cursor(self.get_values(self.page[0]), reverse=True))
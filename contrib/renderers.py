@@ -0,0 +1,92 @@
+from django.conf import settings
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+import math
+import orjson
+import re
+
+# datetimes, dates and times go through DRF's encoder, which formats them differently than orjson would
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+# a float orjson wrote in exponent form (`1e16`, `1.5e-7`), which `json` writes as `1e+16`, `1.5e-07`
+EXPONENT_FLOAT = re.compile(rb'(?:^|[:,\[])-?\d+(?:\.\d+)?e[-+]?\d+(?:$|[,\]}])')
+
+SCALARS = frozenset((str, int, bool, type(None)))
+
+
+def has_non_finite_float(data) -> bool:
+    """ Whether there is a NaN or an infinity anywhere in `data` - orjson writes them as `null`. """
+
+    stack = [[data]]
+    while stack:
+        node = stack.pop()
+        for value in (node.values() if isinstance(node, dict) else node):
+            kind = type(value)
+            if kind in SCALARS:
+                continue
+            if kind is float:
+                if not math.isfinite(value):
+                    return True
+            elif isinstance(value, (dict, list, tuple)):
+                stack.append(value)
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ `JSONRenderer`, encoding with orjson - byte for byte the same output.
+
+    Anything orjson doesn't know (decimals, lazy translations, querysets, datetimes...) is handed to
+    DRF's own encoder, and pretty printing, non-compact or ascii-only output (or anything orjson
+    rejects, i.e. ints past 64 bits) falls back to `JSONRenderer` altogether. So does data with floats
+    orjson writes differently: in exponent form, or NaN and infinities (`JSONRenderer` refuses them
+    under `STRICT_JSON`, orjson would write `null`.) Those are only looked for in the data when the
+    output has a `null` at all. """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+        if not self.compact or self.ensure_ascii or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT_FLOAT.search(ret) or (b'null' in ret and has_non_finite_float(data)):
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            # escaped like JSONRenderer does, so the output stays a strict javascript subset
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class ORJSONParser(JSONParser):
+    """ `JSONParser`, decoding utf-8 bodies with orjson. Whatever orjson turns down is parsed again by
+    `JSONParser`, so errors (and what is accepted) stay the same. """
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if encoding.lower().replace('_', '-') not in ('utf-8', 'utf8') or stream is None:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # i.e. NaN, which the stdlib parser accepts (unless `STRICT_JSON`) - and it words the error
+            return super().parse(BytesStream(body), media_type, parser_context)
+
+
+class BytesStream:
+    """ Just enough of a stream for `JSONParser` to read an already consumed body again. """
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def read(self, *args) -> bytes:
+        body, self.body = self.body, b''
+        return body
@@ -3,9 +3,13 @@ from django.core.files.temp import NamedTemporaryFile
 from django.contrib.auth import get_user_model
 from django.core.files.storage import get_storage_class
 from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
 
 from rest_framework import serializers
+from rest_framework.request import Request
 
+from functools import cached_property
+from typing import List, Optional, Set, Tuple
 import uuid
 
 from . import models
@@ -13,6 +17,78 @@ from . import models
 User = get_user_model()
 
 
+def requested_fields(request: Optional[Request]) -> Tuple[Optional[Set[str]], Set[str]]:
+    """ `(fields, omit)` from `?fields=id,username` and `?omit=email` - fields is None when not given. """
+
+    if request is None or not hasattr(request, 'query_params'):
+        return None, set()
+    fields, omit = request.query_params.get('fields'), request.query_params.get('omit', '')
+    names = {name.strip() for name in fields.split(',') if name.strip()} if fields is not None else None
+    return names, {name.strip() for name in omit.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """ Sparse fieldsets: `?fields=id,username` outputs only these fields, `?omit=email` all but these.
+    Unknown names are ignored, input (write) fields are never affected, and only the top-level serializer
+    is trimmed - nested ones aren't. Without a request in the context, everything is output.
+
+    Pair it with `contrib.views.SparseFieldsViewMixin` so the database only loads what is output. """
+
+    @cached_property
+    def sparse_fieldset(self) -> Tuple[Optional[Set[str]], Set[str]]:
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if parent is not None:
+            return None, set()
+        return requested_fields(self.context.get('request'))
+
+    @property
+    def _readable_fields(self):
+        fields, omit = self.sparse_fieldset
+        for field in super()._readable_fields:
+            if (fields is None or field.field_name in fields) and field.field_name not in omit:
+                yield field
+
+    def get_sparse_columns(self) -> Optional[List[str]]:
+        """ The model fields behind the fields that will be output, for `.only()` - or None if that can't
+        be told, i.e. for a `SerializerMethodField` or a property. """
+
+        model = getattr(getattr(self, 'Meta', None), 'model', None)
+        if model is None:
+            return None
+        columns = []
+        for field in self._readable_fields:
+            if isinstance(field, serializers.SerializerMethodField) or len(field.source_attrs) != 1:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                return None
+            if not model_field.concrete:
+                return None
+            columns.append(model_field.name)
+        return columns
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """ One sub-request of a batch. """
+
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.RegexField(r'^/', help_text='i.e. "/users/?fields=id,username"', max_length=2000)
+    headers = serializers.DictField(child=serializers.CharField(max_length=4096), required=False)
+    body = serializers.JSONField(required=False, allow_null=True, help_text='sent as JSON')
+
+
+class BatchSerializer(serializers.Serializer):
+    """ A list of sub-requests, run in-process as the same user. """
+
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value: list) -> list:
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f'At most {settings.BATCH_MAX_REQUESTS} requests per batch.')
+        return value
+
+
 class PublicGlobalSettingsSerializer(serializers.ModelSerializer):
     """ We're going to give frontend some global settings. """
 
@@ -10,19 +10,24 @@ from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.utils import timezone
 from django.template.loader import render_to_string
+from django.db import transaction
+from django.utils.module_loading import import_string
 
-from typing import Optional, Dict, List
+from collections import defaultdict
+from typing import Callable, Optional, Dict, List, Set
 from hashids import Hashids
 import urllib.parse
 import logging
 import glob
 import os
+import time
 
 from users.models import User
-from contrib.models import PrivateGlobalSettings
+from contrib.models import OutboxEvent, PrivateGlobalSettings
 
 mail_logger = logging.getLogger('emails')
 django_logger = logging.getLogger('django')
+sockets_logger = logging.getLogger('sockets')
 
 
 class Mail:
@@ -236,3 +241,85 @@ class Backup:
 
         django_logger.info(f'Backed up database: {abs_file_path}')
         self._clean_path()
+
+
+class Outbox:
+    """ Drains `OutboxEvent`s to their publishers, in batches.
+
+    Delivery is at-least-once: rows are locked (skipping those another dispatcher holds), published,
+    then deleted in the same transaction. If publishing a topic fails, its rows stay and are retried
+    after the next wait, while the other topics go on - if the commit fails after publishing, they go
+    out twice. Rows whose topic has no handler (anymore) are logged and dropped. """
+
+    # topic -> function taking a list of object ids (`resource.<name>` topics go to the subscription resource)
+    handlers = {
+        'user.updated': 'contrib.consumers.publish_users',
+    }
+
+    def __init__(self, batch_size: int = 500) -> None:
+        self.batch_size = batch_size
+        self.failing: Set[str] = set()  # topics skipped until the next wait
+
+    def dispatch_batch(self) -> int:
+        """ Publishes (at most) one batch and returns how many events it held, those of failing
+        topics aside. """
+
+        with transaction.atomic():
+            events = list(OutboxEvent.objects.select_for_update(skip_locked=True)
+                          .exclude(topic__in=self.failing)[:self.batch_size])
+            if not events:
+                return 0
+
+            by_topic: Dict[str, List[OutboxEvent]] = defaultdict(list)
+            for event in events:
+                by_topic[event.topic].append(event)
+            done: List[int] = []
+            for topic, topic_events in by_topic.items():
+                if self.dispatch_topic(topic, topic_events):
+                    done += [event.pk for event in topic_events]
+            OutboxEvent.objects.filter(pk__in=done).delete()
+        return len(done)
+
+    def dispatch_topic(self, topic: str, events: List[OutboxEvent]) -> bool:
+        """ Whether the events are done with - published, or dropped for want of a handler. """
+
+        handler = self.get_handler(topic)
+        if handler is None:
+            sockets_logger.error(f'Dropping {len(events)} outbox events: no handler for topic {topic!r}.')
+            return True
+        try:
+            with transaction.atomic():  # a failed query only rolls back this topic
+                # the same object changed several times only needs publishing once
+                handler(list(dict.fromkeys(event.object_id for event in events)))
+        except Exception:
+            sockets_logger.exception(f'Could not dispatch {topic!r} outbox events, retrying later.')
+            self.failing.add(topic)
+            return False
+        return True
+
+    def get_handler(self, topic: str) -> Optional[Callable[[List[int]], int]]:
+        if topic.startswith('resource.'):
+            from contrib.subscriptions import registry  # imports the consumers, which import this module's models
+            resource = registry.get(topic[len('resource.'):])
+            return resource.publish if resource is not None else None
+        return import_string(self.handlers[topic]) if topic in self.handlers else None
+
+    def run(self, interval: float = 1, once: bool = False) -> int:
+        """ Dispatches until the outbox is empty, then waits `interval` seconds and starts over
+        (unless `once`.) Returns how many events went out. """
+
+        dispatched = 0
+        while True:
+            try:
+                count = self.dispatch_batch()
+            except Exception:
+                sockets_logger.exception('Could not dispatch outbox events, retrying.')
+                count = 0
+            dispatched += count
+            if count:
+                sockets_logger.debug(f'Dispatched {count} outbox events.')
+            elif once:
+                return dispatched
+            else:
+                self.failing.clear()
+                time.sleep(interval)
@@ -0,0 +1,88 @@
+from django.conf import settings
+
+from redis.exceptions import RedisError
+from typing import Iterable, List, Optional, Tuple
+import json
+import logging
+
+logger = logging.getLogger('sockets')
+
+
+def get_client():
+    """ The redis client behind the cache, or None if the cache isn't django_redis (i.e. in tests). """
+
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def stream_key(user_pk: int) -> str:
+    return f'stream:user-{user_pk}'
+
+
+def parse_id(event_id: str) -> Optional[Tuple[int, int]]:
+    try:
+        ms, seq = event_id.split('-')
+        return int(ms), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+
+def append_many(events: Iterable[Tuple[int, dict]]) -> List[Optional[str]]:
+    """ Adds `(user_pk, message)` pairs to the users' capped streams in one pipelined call and returns
+    the event ids. Without redis (or when it fails) events just aren't kept, and the ids are None. """
+
+    events = list(events)
+    client = get_client()
+    if client is None or not events:
+        return [None] * len(events)
+
+    pipe = client.pipeline(transaction=False)
+    for user_pk, message in events:
+        key = stream_key(user_pk)
+        pipe.xadd(key, {'msg': json.dumps(message)}, maxlen=settings.USER_STREAM_MAXLEN, approximate=True)
+        pipe.expire(key, settings.USER_STREAM_TTL)
+    try:
+        results = pipe.execute()
+    except RedisError:
+        logger.exception('Could not append user events to their streams.')
+        return [None] * len(events)
+    return [event_id.decode() for event_id in results[::2]]
+
+
+def append(user_pk: int, message: dict) -> Optional[str]:
+    return append_many([(user_pk, message)])[0]
+
+
+def latest_id(user_pk: int) -> Optional[str]:
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        entries = client.xrevrange(stream_key(user_pk), count=1)
+    except RedisError:
+        return None
+    return entries[0][0].decode() if entries else None
+
+
+def read_since(user_pk: int, last_event_id: str) -> Optional[List[Tuple[str, dict]]]:
+    """ Events that came after `last_event_id`, oldest first.
+
+    Returns None when we can't tell what was missed - no redis, a malformed id, or `last_event_id`
+    itself no longer being in the stream (trimmed or expired, so there is a gap.) The caller should
+    send a snapshot then. """
+
+    client = get_client()
+    if client is None or parse_id(last_event_id) is None:
+        return None
+    try:
+        # starting at the last seen event, which doubles as proof that nothing in between was trimmed
+        entries = client.xrange(stream_key(user_pk), min=last_event_id)
+    except RedisError:
+        logger.exception(f'Could not read the event stream of user #{user_pk}.')
+        return None
+    if not entries or entries[0][0].decode() != last_event_id:
+        return None
+    return [(event_id.decode(), json.loads(fields[b'msg'])) for event_id, fields in entries[1:]]
@@ -0,0 +1,197 @@
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_save
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from rest_framework import serializers
+from asgiref.sync import async_to_sync
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Type, Union
+import json
+import logging
+import msgpack
+import weakref
+
+from contrib.consumers import PUBLISH_BATCH_SIZE, LiveConsumer, encode_frames
+from contrib.layers import group_send_many, groups_with_members
+from contrib.models import OutboxEvent
+
+logger = logging.getLogger('sockets')
+
+
+class Resource:
+    """ A model clients can subscribe to through `SubscriptionConsumer`. Subclass, fill in
+    `name`, `model` and `serializer_class`, and decorate with `@register`.
+
+    Whoever passes `has_permission` for an instance when subscribing gets every later update to
+    it - the check is not repeated on each update. """
+
+    name: str
+    model: Type[models.Model]
+    serializer_class: Type[serializers.Serializer]
+
+    def get_queryset(self) -> models.QuerySet:
+        return self.model._default_manager.all()
+
+    def has_permission(self, user, instance: models.Model) -> bool:
+        return False
+
+    def group_name(self, pk: Union[int, str]) -> str:
+        return f'sub-{self.name}-{pk}'
+
+    def update_message(self, data: dict) -> dict:
+        """ The channel layer message carrying one serialized instance to its subscribers. """
+
+        content = {'resource': self.name, 'pk': data['id'], 'data': data}
+        return {
+            'type': 'resource.update',
+            'resource': self.name,
+            'pk': data['id'],
+            'frames': encode_frames({'msg_type': 'resource.updated', 'msg_content': content}),
+        }
+
+    def publish(self, pks: Iterable[int]) -> int:
+        """ Sends the current state of these instances to their subscribers - one query and one bulk
+        send per `PUBLISH_BATCH_SIZE` instances. Instances nobody subscribed to are skipped before
+        they're even loaded. """
+
+        layer = get_channel_layer()
+        pks = list(pks)
+        published = 0
+        for start in range(0, len(pks), PUBLISH_BATCH_SIZE):
+            groups = {self.group_name(pk): pk for pk in pks[start:start + PUBLISH_BATCH_SIZE]}
+            listened = async_to_sync(groups_with_members)(layer, groups)
+            if not listened:
+                continue
+            queryset = self.get_queryset().filter(pk__in=[groups[group] for group in listened])
+            messages = [(self.group_name(data['id']), self.update_message(data))
+                        for data in self.serializer_class(queryset, many=True).data]
+            if messages:
+                async_to_sync(group_send_many)(layer, messages)
+            published += len(messages)
+        return published
+
+    def changed(self, pks: Iterable[int], using: Optional[str] = None) -> None:
+        """ Queues instances for publishing once the current transaction commits. Everything
+        changed within one transaction goes out together, as a single batch per resource.
+
+        With `USER_EVENTS_OUTBOX`, they are written to the outbox instead, as `resource.<name>` events. """
+
+        if settings.USER_EVENTS_OUTBOX:
+            OutboxEvent.objects.using(using).bulk_create(
+                [OutboxEvent(topic=f'resource.{self.name}', object_id=pk) for pk in pks], batch_size=PUBLISH_BATCH_SIZE)
+            return
+
+        connection = transaction.get_connection(using)
+        batch = connection.subscription_batch() if hasattr(connection, 'subscription_batch') else None
+        if batch is not None and batch.pending:
+            batch.resources[self.name].update(pks)
+            return
+
+        # only its on_commit hook keeps a batch alive - a rollback drops both, and the next change starts over
+        batch = PendingBatch()
+        batch.resources[self.name].update(pks)
+        connection.subscription_batch = weakref.ref(batch)
+        transaction.on_commit(batch.flush, using=using)  # runs right away outside a transaction
+
+    def saved(self, sender, instance: models.Model, using: str, **kwargs) -> None:
+        self.changed([instance.pk], using=using)
+
+
+class PendingBatch:
+    """ Instances changed in the current transaction, by resource name. """
+
+    def __init__(self) -> None:
+        self.resources: Dict[str, Set[int]] = defaultdict(set)
+        self.pending = True  # until flushed - later changes then need a batch of their own
+
+    def flush(self) -> None:
+        self.pending = False
+        for name, pks in self.resources.items():
+            registry[name].publish(pks)
+        self.resources.clear()
+
+
+registry: Dict[str, Resource] = {}
+
+
+def register(resource_class: Type[Resource]) -> Type[Resource]:
+    """ Makes a resource available to subscribers and publishes its instances whenever they're saved. """
+
+    resource = resource_class()
+    registry[resource.name] = resource
+    post_save.connect(resource.saved, sender=resource.model, dispatch_uid=f'subscriptions-{resource.name}')
+    return resource_class
+
+
+class SubscriptionConsumer(LiveConsumer):
+    """ One socket, any number of subscriptions to registered resources. Clients send
+
+        {"action": "subscribe", "resource": "users", "pk": 1}
+        {"action": "unsubscribe", "resource": "users", "pk": 1}
+
+    and get the current state back as `subscribed`, then every change as `resource.updated`. """
+
+    async def joined(self) -> None:
+        self.subscriptions: Dict[str, Set[int]] = defaultdict(set)
+
+    async def disconnect(self, code: int) -> None:
+        await super().disconnect(code)
+        for name, pks in getattr(self, 'subscriptions', {}).items():
+            for pk in pks:
+                await self.channel_layer.group_discard(registry[name].group_name(pk), self.channel_name)
+
+    async def receive(self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> None:
+        await super().receive(text_data, bytes_data)
+        try:
+            content = msgpack.unpackb(bytes_data) if bytes_data is not None else json.loads(text_data)
+        except (ValueError, TypeError):
+            return self.reply('error', {'detail': 'Malformed message.'})
+        if not isinstance(content, dict) or content.get('action') not in ('subscribe', 'unsubscribe'):
+            return  # pongs and other chatter
+
+        resource = registry.get(content.get('resource'))
+        pk = content.get('pk')
+        if resource is None or not isinstance(pk, int):
+            return self.reply('error', {'detail': 'Unknown resource.', 'resource': content.get('resource')})
+        if content['action'] == 'subscribe':
+            await self.subscribe(resource, pk)
+        else:
+            await self.unsubscribe(resource, pk)
+
+    async def subscribe(self, resource: Resource, pk: int) -> None:
+        if pk in self.subscriptions[resource.name]:
+            return
+        if sum(len(pks) for pks in self.subscriptions.values()) >= settings.WEBSOCKET_MAX_SUBSCRIPTIONS:
+            return self.reply('error', {'detail': 'Too many subscriptions.', 'resource': resource.name, 'pk': pk})
+
+        data = await self.get_snapshot(resource, pk)
+        if data is None:
+            # same answer whether it doesn't exist or isn't theirs
+            return self.reply('error', {'detail': 'Not found.', 'resource': resource.name, 'pk': pk})
+        self.subscriptions[resource.name].add(pk)
+        await self.channel_layer.group_add(resource.group_name(pk), self.channel_name)
+        self.reply('subscribed', {'resource': resource.name, 'pk': pk, 'data': data})
+
+    async def unsubscribe(self, resource: Resource, pk: int) -> None:
+        if pk not in self.subscriptions[resource.name]:
+            return
+        self.subscriptions[resource.name].discard(pk)
+        await self.channel_layer.group_discard(resource.group_name(pk), self.channel_name)
+        self.reply('unsubscribed', {'resource': resource.name, 'pk': pk})
+
+    @database_sync_to_async
+    def get_snapshot(self, resource: Resource, pk: int) -> Optional[dict]:
+        instance = resource.get_queryset().filter(pk=pk).first()
+        if instance is None or not resource.has_permission(self.scope['user'], instance):
+            return None
+        return resource.serializer_class(instance).data
+
+    def reply(self, msg_type: str, content: dict) -> None:
+        self.queue_frame(msg_type, encode_frames({'msg_type': msg_type, 'msg_content': content})[self.encoding])
+
+    async def resource_update(self, event: dict) -> None:
+        # one pending update per instance at most - older ones are replaced
+        key = f'resource.updated:{event["resource"]}:{event["pk"]}'
+        self.queue_frame('resource.updated', event['frames'][self.encoding], key=key)
@@ -0,0 +1,59 @@
+from rest_framework import serializers
+from unittest import mock
+
+from contrib.compiler import CompiledSerializer, compile_serializer
+from contrib.models import PublicGlobalSettings
+from contrib.serializers import HealthSerializer, PublicGlobalSettingsSerializer
+from contrib.tests.base import BaseTestCase
+from users.authentication import get_cached_user
+from users.factories import UserFactory
+from users.models import User
+from users.serializers import UserSerializer
+
+
+class EventSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    when = serializers.DateTimeField()
+    note = serializers.CharField(required=False)
+    active = serializers.BooleanField()
+    size = serializers.SerializerMethodField()
+
+    def get_size(self, obj: dict) -> int:
+        return len(obj['name'])
+
+
+class TestCompiledSerializer(BaseTestCase):
+    def assertSameOutput(self, serializer_class, instance):
+        expected = serializer_class(instance).data
+        compiled = compile_serializer(serializer_class).to_representation(instance)
+        self.assertEqual(list(compiled.items()), list(expected.items()))
+
+    def test_user_serializer(self):
+        for user in [UserFactory(), UserFactory(email='', first_name='')]:
+            self.assertSameOutput(UserSerializer, user)
+        self.assertSameOutput(UserSerializer, get_cached_user(user.pk))  # deferred fields
+
+    def test_many(self):
+        UserFactory.create_batch(3)
+        users = User.objects.all()
+        self.assertEqual(compile_serializer(UserSerializer).many(users), UserSerializer(users, many=True).data)
+
+    def test_public_global_settings_serializer(self):
+        self.assertSameOutput(PublicGlobalSettingsSerializer, PublicGlobalSettings.objects.create())
+
+    @mock.patch.object(HealthSerializer, 'is_storage_ok', return_value=True)
+    def test_health_serializer(self, is_storage_ok):
+        self.assertSameOutput(HealthSerializer, {})
+
+    def test_fallback_fields(self):
+        """ Fields without a fast path (dates, booleans, missing optional values...) behave like DRF's. """
+
+        for event in [
+            {'name': 'launch', 'when': '2020-01-01T10:00:00Z', 'active': 'yes'},
+            {'name': 'party', 'when': None, 'note': 'bring cake', 'active': 0},
+        ]:
+            self.assertSameOutput(EventSerializer, event)
+
+    def test_compiled_once(self):
+        self.assertIs(compile_serializer(UserSerializer), compile_serializer(UserSerializer))
+        self.assertIsInstance(compile_serializer(UserSerializer), CompiledSerializer)
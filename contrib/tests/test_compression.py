@@ -0,0 +1,155 @@
+from django.test import override_settings
+
+from channels.testing import ApplicationCommunicator, HttpCommunicator
+from unittest import mock, skipUnless
+import gzip
+import random
+import json
+import zlib
+
+from contrib import compression
+from contrib.compression import CompressionMiddleware, choose_encoding
+from contrib.metrics import metrics
+from contrib.tests.base import BaseTestCase
+
+BROTLI = compression.brotli
+NOISE = random.Random(0).randbytes(1000)
+BODY = b'{"username": "bob", "first_name": "Bob"}' * 50
+
+
+def app_sending(*chunks: bytes, content_type: bytes = b'application/json', headers=()):
+    """ An ASGI app answering with `chunks` - with a Content-Length when there is a single chunk. """
+
+    async def app(scope, receive, send):
+        response_headers = [(b'content-type', content_type), *headers]
+        if len(chunks) == 1:
+            response_headers.append((b'content-length', str(len(chunks[0])).encode()))
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+        for i, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': i < len(chunks) - 1})
+    return app
+
+
+class TestChooseEncoding(BaseTestCase):
+    def test_gzip(self):
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(choose_encoding('gzip, deflate, br'), 'gzip')
+            self.assertEqual(choose_encoding('*'), 'gzip')
+            self.assertIsNone(choose_encoding('br'))
+            self.assertIsNone(choose_encoding('gzip;q=0, deflate'))
+            self.assertIsNone(choose_encoding(''))
+
+    def test_brotli(self):
+        with mock.patch.object(compression, 'brotli', mock.Mock()):
+            self.assertEqual(choose_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(choose_encoding('br;q=0.5, gzip'), 'gzip')
+            self.assertEqual(choose_encoding('identity'), None)
+
+
+@mock.patch.object(compression, 'brotli', None)
+class TestCompressionMiddleware(BaseTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    async def request(self, app, accept_encoding: bytes = b'gzip', method: str = 'GET') -> dict:
+        headers = [(b'accept-encoding', accept_encoding)] if accept_encoding else []
+        communicator = HttpCommunicator(CompressionMiddleware(app), method, '/', headers=headers)
+        response = await communicator.get_response()
+        response['headers'] = {key.lower(): value for key, value in response['headers']}
+        return response
+
+    async def test_gzip(self):
+        response = await self.request(app_sending(BODY))
+        self.assertEqual(response['headers'][b'content-encoding'], b'gzip')
+        self.assertEqual(response['headers'][b'vary'], b'Accept-Encoding')
+        self.assertEqual(int(response['headers'][b'content-length']), len(response['body']))
+        self.assertEqual(gzip.decompress(response['body']), BODY)
+        histogram = metrics.snapshot()['histograms']['http.compression_ratio']
+        self.assertEqual(histogram['count'], 1)
+        self.assertAlmostEqual(histogram['sum'], len(response['body']) * 100 / len(BODY))
+
+    async def test_chunked_body(self):
+        """ i.e. Django sending a large response in 64kb pieces - with its Content-Length. """
+
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/html'), (b'content-length', str(len(BODY) * 2).encode())]})
+            await send({'type': 'http.response.body', 'body': BODY, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': BODY})
+
+        response = await self.request(app)
+        self.assertNotIn(b'content-length', response['headers'])
+        self.assertEqual(gzip.decompress(response['body']), BODY * 2)
+
+    async def test_not_compressed(self):
+        cases = [
+            (app_sending(b'{"short": true}'), b'gzip'),  # below the threshold
+            (app_sending(BODY), b''),
+            (app_sending(BODY), b'br'),
+            (app_sending(BODY, content_type=b'image/png'), b'gzip'),
+            (app_sending(BODY, headers=[(b'content-encoding', b'gzip')]), b'gzip'),
+            (app_sending(NOISE), b'gzip'),  # doesn't get smaller
+        ]
+        for app, accept_encoding in cases[:-2]:
+            response = await self.request(app, accept_encoding)
+            self.assertNotIn(b'content-encoding', response['headers'])
+            self.assertIn(b'content-length', response['headers'])
+        response = await self.request(cases[-2][0])
+        self.assertEqual(response['body'], BODY)  # not encoded a second time
+        response = await self.request(cases[-1][0])
+        self.assertEqual(response['body'], NOISE)
+        self.assertNotIn('http.compression_ratio', metrics.snapshot()['histograms'])
+
+    async def test_reports_metrics(self):
+        """ HTTP-only workers never start the reporter from a consumer. """
+
+        with mock.patch.object(metrics, 'ensure_reporter') as ensure_reporter:
+            await self.request(app_sending(BODY), b'')
+        ensure_reporter.assert_called_once_with()
+
+    async def test_head(self):
+        response = await self.request(app_sending(BODY), method='HEAD')
+        self.assertNotIn(b'content-encoding', response['headers'])
+
+    async def test_strong_etag_is_weakened(self):
+        response = await self.request(app_sending(BODY, headers=[(b'etag', b'"abc"'), (b'vary', b'Cookie')]))
+        self.assertEqual(response['headers'][b'etag'], b'W/"abc"')
+        self.assertEqual(response['headers'][b'vary'], b'Cookie, Accept-Encoding')
+
+    async def test_streaming_flushes_every_chunk(self):
+        """ Server-sent events have to be readable as soon as each one is sent. """
+
+        events = [b'retry: 3000\n\n', b'data: {"id": 1}\n\n', b'data: {"id": 2}\n\n']
+        communicator = ApplicationCommunicator(
+            CompressionMiddleware(app_sending(*events, content_type=b'text/event-stream')),
+            {'type': 'http', 'method': 'GET', 'path': '/', 'headers': [(b'accept-encoding', b'gzip')]},
+        )
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output()
+        self.assertIn((b'content-encoding', b'gzip'), start['headers'])
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for event in events:
+            message = await communicator.receive_output()
+            self.assertEqual(decompressor.decompress(message['body']), event)
+        self.assertFalse(message.get('more_body'))
+        self.assertEqual(metrics.snapshot()['histograms']['http.compression_ratio']['count'], 1)
+
+    @skipUnless(BROTLI, 'brotli is not installed')
+    async def test_brotli(self):
+        with mock.patch.object(compression, 'brotli', BROTLI):
+            response = await self.request(app_sending(BODY), b'gzip, br')
+        self.assertEqual(response['headers'][b'content-encoding'], b'br')
+        self.assertEqual(BROTLI.decompress(response['body']), BODY)
+
+    async def test_through_the_app(self):
+        from asgi import application
+
+        languages = [[code, f'Language {i}'] for i, code in enumerate(['en', 'fr', 'de', 'es', 'it', 'nl'] * 5)]
+        with override_settings(LANGUAGES=languages):
+            communicator = HttpCommunicator(application, 'GET', '/langs/', headers=[(b'accept-encoding', b'gzip')])
+            response = await communicator.get_response()
+        headers = {key.lower(): value for key, value in response['headers']}
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response['body'])), languages)
@@ -1,13 +1,32 @@
-from channels.testing import WebsocketCommunicator
+from django.db import DatabaseError, transaction
+from django.test import override_settings
+
+from channels.layers import get_channel_layer
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
 from channels.auth import AuthMiddlewareStack
 from asgiref.sync import sync_to_async
+from collections import deque
+from unittest import mock
+import asyncio
+import json
+import msgpack
 
 
-from contrib.consumers import UserConsumer
+from contrib.consumers import AdmissionMiddleware, UserConsumer, UserEventsConsumer, publish_users, CLOSE_TOO_SLOW, CLOSE_IDLE, CLOSE_TRY_AGAIN
+from contrib.metrics import metrics
 from contrib.tests.base import BaseTestCase
+from users.authentication import JWTAuthMiddleware
+from users.factories import UserFactory
 from users.models import User
 
 
+def save_committed(test: BaseTestCase, user: User) -> None:
+    """ `user.save()`, with what it publishes once committed - a test case never commits. """
+
+    with test.captureOnCommitCallbacks(execute=True):
+        user.save()
+
+
 class WebsocketTests(BaseTestCase):
     async def test_user_sub_but_not_logged_in(self):
         """ Must be logged in to connect to this websocket - so this should fail. """
@@ -40,8 +59,358 @@ class WebsocketTests(BaseTestCase):
 
         await communicator.connect()
         user.username = 'gao'
-        await sync_to_async(user.save)()
+        await sync_to_async(save_committed)(self, user)
         response = await communicator.receive_json_from()
 
         self.assertEqual(response['msg_content']['username'], 'gao')
         await communicator.disconnect()
+
+    async def test_msgpack_subprotocol_gets_binary_frames(self):
+        """ Clients asking for the msgpack subprotocol should get it back, with binary frames. """
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        app = AuthMiddlewareStack(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/', subprotocols=['msgpack'])
+        communicator.scope['user'] = user
+
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual(subprotocol, 'msgpack')
+        user.username = 'gao'
+        await sync_to_async(save_committed)(self, user)
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        self.assertEqual(response['msg_type'], 'user.updated')
+        self.assertEqual(response['msg_content']['username'], 'gao')
+        await communicator.disconnect()
+
+    async def test_msgpack_query_param_gets_binary_frames(self):
+        """ Same thing, but for clients that can't set a subprotocol. """
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        app = AuthMiddlewareStack(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/?encoding=msgpack')
+        communicator.scope['user'] = user
+
+        await communicator.connect()
+        user.username = 'gao'
+        await sync_to_async(save_committed)(self, user)
+        response = msgpack.unpackb(await communicator.receive_from())
+
+        self.assertEqual(response['msg_content']['username'], 'gao')
+        await communicator.disconnect()
+
+
+class BackpressureTests(BaseTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.consumer = UserConsumer()
+        self.consumer.outbox = deque()
+        self.consumer.outbox_ready = asyncio.Event()
+
+    def test_user_state_is_conflated(self):
+        """ Two user updates waiting to go out - only the latest one is worth sending. """
+
+        self.consumer.queue_frame('user.updated', 'old')
+        self.consumer.queue_frame('user.updated', 'new')
+        self.assertEqual(list(self.consumer.outbox), [['user.updated', 'new']])
+        self.assertEqual(metrics.counters['ws.frames.conflated'], 1)
+
+    @override_settings(WEBSOCKET_MAX_QUEUE=2)
+    def test_full_outbox_drops_oldest(self):
+        """ Past the limit, the oldest frame makes room for the new one. """
+
+        for frame in ('one', 'two', 'three'):
+            self.consumer.queue_frame('ping', frame)
+        self.assertEqual([frame for _, frame in self.consumer.outbox], ['two', 'three'])
+        self.assertEqual(metrics.counters['ws.frames.dropped'], 1)
+
+    @override_settings(WEBSOCKET_SEND_TIMEOUT=0.05)
+    async def test_slow_client_is_disconnected(self):
+        """ If a frame can't be sent in time, the socket is closed instead of buffering forever. """
+
+        async def stuck(self, frame):
+            await asyncio.sleep(10)
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        app = AuthMiddlewareStack(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+
+        with mock.patch.object(UserConsumer, 'send_frame', stuck):
+            user.username = 'gao'
+            await sync_to_async(save_committed)(self, user)
+            output = await communicator.receive_output(timeout=1)
+
+        self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_TOO_SLOW})
+        self.assertEqual(metrics.counters['ws.slow_disconnects'], 1)
+        await communicator.disconnect()
+
+
+@override_settings(WEBSOCKET_HEARTBEAT_INTERVAL=0.05, WEBSOCKET_IDLE_TIMEOUT=0.12)
+class HeartbeatTests(BaseTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    async def connect(self) -> WebsocketCommunicator:
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        app = AuthMiddlewareStack(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        return communicator
+
+    async def test_silent_client_is_reaped(self):
+        """ Nobody answers our pings - connection gets closed and counted. """
+
+        communicator = await self.connect()
+        self.assertEqual(metrics.gauges['ws.connections.live'], 1)
+
+        self.assertEqual(await communicator.receive_json_from(), {'msg_type': 'ping'})
+        self.assertEqual(await communicator.receive_json_from(), {'msg_type': 'ping'})
+        output = await communicator.receive_output(timeout=1)
+
+        self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_IDLE})
+        self.assertEqual(metrics.gauges['ws.connections.live'], 0)
+        self.assertEqual(metrics.counters['ws.connections.reaped'], 1)
+        await communicator.disconnect()
+
+    async def test_answering_client_is_kept(self):
+        """ A client that keeps answering stays connected. """
+
+        communicator = await self.connect()
+        for i in range(5):
+            self.assertEqual(await communicator.receive_json_from(), {'msg_type': 'ping'})
+            await communicator.send_json_to({'msg_type': 'pong'})
+
+        self.assertEqual(metrics.counters['ws.connections.reaped'], 0)
+        await communicator.disconnect()
+        self.assertEqual(metrics.gauges['ws.connections.live'], 0)
+
+
+class AdmissionTests(BaseTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    @override_settings(WEBSOCKET_MAX_HANDSHAKES=0, WEBSOCKET_RETRY_AFTER=2, WEBSOCKET_RETRY_JITTER=10)
+    async def test_busy_worker_asks_client_to_retry(self):
+        """ Over the handshake cap, the client gets a retry hint and a "try again later" close code -
+        before its token is even looked at. """
+
+        app = AdmissionMiddleware(JWTAuthMiddleware(UserConsumer.as_asgi()))
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/?token=abc', subprotocols=['msgpack'])
+
+        with mock.patch.object(JWTAuthMiddleware, 'get_user') as get_user:
+            connected, subprotocol = await communicator.connect()
+            response = msgpack.unpackb(await communicator.receive_from())
+        get_user.assert_not_called()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'msgpack')
+        self.assertEqual(response['msg_type'], 'retry')
+        self.assertTrue(2 <= response['msg_content']['retry_after'] <= 12)
+        self.assertEqual(response['msg_content']['jitter'], 10)
+
+        output = await communicator.receive_output()
+        self.assertEqual(output, {'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN})
+        self.assertEqual(metrics.counters['ws.handshakes.rejected'], 1)
+        await communicator.disconnect()
+
+    async def test_admitted_handshake_is_released(self):
+        """ Once subscribed, the handshake no longer counts against the cap. """
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        app = AdmissionMiddleware(AuthMiddlewareStack(UserConsumer.as_asgi()))
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/')
+        communicator.scope['user'] = user
+
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(metrics.counters['ws.handshakes.admitted'], 1)
+        self.assertEqual(metrics.gauges['ws.handshakes.in_flight'], 0)
+        await communicator.disconnect()
+
+    async def test_refused_handshake_is_released(self):
+        app = AdmissionMiddleware(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, 'ws/user-watcher/')
+
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(metrics.gauges['ws.handshakes.in_flight'], 0)
+        await communicator.disconnect()
+
+
+class PublishTests(BaseTestCase):
+    @mock.patch('contrib.consumers.group_send_many')
+    def test_publish_users(self, group_send_many):
+        """ One bulk send for all users, each message going to that user's own group. """
+
+        users = UserFactory.create_batch(3)
+        self.assertEqual(publish_users([users[0], users[1].pk]), 2)
+
+        group_send_many.assert_called_once()
+        messages = dict(group_send_many.call_args[0][1])
+        self.assertEqual(set(messages), {f'ws-user-{users[0].pk}', f'ws-user-{users[1].pk}'})
+        frame = json.loads(messages[f'ws-user-{users[1].pk}']['frames']['json'])
+        self.assertEqual(frame['msg_content']['username'], users[1].username)
+
+    @mock.patch('contrib.consumers.publish_user')
+    def test_save_publishes_on_commit(self, publish):
+        """ Not while the save holds its row lock, nor at all if it rolls back. """
+
+        user = UserFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            publish.assert_not_called()
+        publish.assert_called_once_with(user)
+
+        publish.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    user.save()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+        publish.assert_not_called()
+
+    @mock.patch('contrib.consumers.publish_users')
+    def test_queryset_update_publishes_on_commit(self, publish):
+        """ `update()` doesn't send `post_save`, so it publishes the users it matched itself. """
+
+        users = UserFactory.create_batch(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk__in=[user.pk for user in users]).update(is_active=False)
+            publish.assert_not_called()
+        self.assertEqual(sorted(publish.call_args[0][0]), sorted(user.pk for user in users))
+
+    @mock.patch('contrib.consumers.PUBLISH_BATCH_SIZE', 2)
+    @mock.patch('contrib.consumers.group_send_many')
+    def test_large_update_is_published_in_batches(self, group_send_many):
+        """ However many users an update touches, each of them is published - a batch at a time. """
+
+        users = UserFactory.create_batch(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk__in=[user.pk for user in users]).update(is_active=False)
+        self.assertEqual([len(call.args[1]) for call in group_send_many.call_args_list], [2, 2, 1])
+        published = {group for call in group_send_many.call_args_list for group, _ in call.args[1]}
+        self.assertEqual(published, {f'ws-user-{user.pk}' for user in users})
+
+
+class ResumeTests(BaseTestCase):
+    async def connect(self, user, last_event_id):
+        app = AuthMiddlewareStack(UserConsumer.as_asgi())
+        communicator = WebsocketCommunicator(app, f'ws/user-watcher/?last_event_id={last_event_id}')
+        communicator.scope['user'] = user
+        await communicator.connect()
+        return communicator
+
+    @mock.patch('contrib.streams.read_since', return_value=[('2-0', {'msg_type': 'user.updated', 'msg_content': {}})])
+    async def test_missed_events_are_replayed(self, read_since):
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        communicator = await self.connect(user, '1-0')
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['event_id'], '2-0')
+        read_since.assert_called_once_with(user.pk, '1-0')
+        await communicator.disconnect()
+
+    @mock.patch('contrib.streams.latest_id', return_value='9-0')
+    @mock.patch('contrib.streams.read_since', return_value=None)
+    async def test_gap_sends_snapshot(self, read_since, latest_id):
+        """ If we can't replay, the client gets the current state - and an id to resume from next time. """
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        communicator = await self.connect(user, '1-0')
+
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['msg_content']['username'], 'bob')
+        self.assertEqual(response['event_id'], '9-0')
+        await communicator.disconnect()
+
+    @mock.patch('contrib.streams.latest_id', return_value='9-0')
+    @mock.patch('contrib.streams.read_since', return_value=None)
+    async def test_deleted_user_gets_no_snapshot(self, read_since, latest_id):
+        """ i.e. a socket authenticated by token, for a user deleted since. """
+
+        user = await sync_to_async(User.objects.create, thread_sensitive=True)(username='bob')
+        await sync_to_async(User.objects.filter(pk=user.pk).delete, thread_sensitive=True)()
+        communicator = await self.connect(user, '1-0')
+
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class UserEventsTests(BaseTestCase):
+    def request(self, query_string: bytes = b'', headers: list = None, method: str = 'GET') -> ApplicationCommunicator:
+        scope = {
+            'type': 'http', 'method': method, 'path': '/me/events/',
+            'query_string': query_string, 'headers': headers or [],
+        }
+        return ApplicationCommunicator(JWTAuthMiddleware(UserEventsConsumer.as_asgi()), scope)
+
+    async def test_anonymous_is_refused(self):
+        communicator = self.request()
+        await communicator.send_input({'type': 'http.request'})
+        response = await communicator.receive_output()
+        self.assertEqual(response['status'], 401)
+        await communicator.wait()
+
+    @override_settings(CORS_ORIGIN_ALLOW_ALL=False, CORS_ORIGIN_WHITELIST=['https://app.example.com'])
+    async def test_cors(self):
+        """ Same origins as the API - the stream is served ahead of Django's CORS middleware. """
+
+        user = await sync_to_async(UserFactory)()
+        for origin, allowed in [(b'https://app.example.com', True), (b'https://evil.example.com', False)]:
+            communicator = self.request(f'token={user.access_token}'.encode(), headers=[(b'origin', origin)])
+            await communicator.send_input({'type': 'http.request'})
+            headers = dict((await communicator.receive_output())['headers'])
+            self.assertEqual(headers.get(b'access-control-allow-origin'), origin if allowed else None)
+            self.assertEqual(headers[b'vary'], b'Origin')
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait()
+
+        communicator = self.request(headers=[(b'origin', b'https://app.example.com')], method='OPTIONS')
+        await communicator.send_input({'type': 'http.request'})
+        response = await communicator.receive_output()
+        self.assertEqual(response['status'], 200)
+        self.assertIn(b'authorization', dict(response['headers'])[b'access-control-allow-headers'])
+        await communicator.wait()
+
+    async def test_updates_are_streamed(self):
+        """ Headers and a retry hint first, then each update as an event - until the client goes away. """
+
+        user = await sync_to_async(UserFactory)(username='bob')
+        communicator = self.request(f'token={user.access_token}'.encode())
+        await communicator.send_input({'type': 'http.request'})
+
+        response = await communicator.receive_output()
+        self.assertEqual(response['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), response['headers'])
+        self.assertTrue((await communicator.receive_output())['body'].startswith(b'retry: '))
+
+        await get_channel_layer().group_send(f'ws-user-{user.pk}', {
+            'type': 'user.update', 'event_id': '1-0', 'frames': {'json': '{"msg_type": "user.updated"}'},
+        })
+        body = (await communicator.receive_output())['body']
+        self.assertEqual(body, b'id: 1-0\ndata: {"msg_type": "user.updated"}\n\n')
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
+
+    @mock.patch('contrib.streams.latest_id', return_value='9-0')
+    @mock.patch('contrib.streams.read_since', return_value=None)
+    async def test_last_event_id_resumes(self, read_since, latest_id):
+        user = await sync_to_async(UserFactory)(username='bob')
+        headers = [(b'authorization', f'Bearer {user.access_token}'.encode()), (b'last-event-id', b'1-0')]
+        communicator = self.request(headers=headers)
+        await communicator.send_input({'type': 'http.request'})
+        await communicator.receive_output()
+        await communicator.receive_output()
+
+        body = (await communicator.receive_output())['body'].decode()
+        self.assertTrue(body.startswith('id: 9-0\ndata: '))
+        self.assertIn('"username": "bob"', body)
+        read_since.assert_called_once_with(user.pk, '1-0')
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
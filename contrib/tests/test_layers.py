@@ -0,0 +1,104 @@
+from django.test import SimpleTestCase
+
+from channels.layers import InMemoryChannelLayer
+from unittest import mock
+import asyncio
+
+from contrib.layers import FanoutChannelLayer, groups_with_members
+
+
+class InMemoryFanoutChannelLayer(FanoutChannelLayer):
+    """ No redis in the test suite - an in-memory layer stands in for it. """
+
+    remote_layer_class = InMemoryChannelLayer
+
+    async def remote_members(self, groups):
+        return {group: list(self.remote.groups.get(group, {})) for group in groups}
+
+
+class FanoutChannelLayerTests(SimpleTestCase):
+    def make_layers(self):
+        """ Two 'processes' sharing one broker. """
+
+        first = InMemoryFanoutChannelLayer()
+        second = InMemoryFanoutChannelLayer()
+        second.remote = first.remote
+        return first, second
+
+    async def test_group_send_reaches_every_process(self):
+        """ Each local member of the group gets the message, whichever process it lives in. """
+
+        first, second = self.make_layers()
+        channels = [await first.new_channel(), await first.new_channel(), await second.new_channel()]
+        await first.group_add('ws-user-1', channels[0])
+        await first.group_add('ws-user-1', channels[1])
+        await second.group_add('ws-user-1', channels[2])
+
+        await first.group_send('ws-user-1', {'type': 'user.update', 'text': 'hi'})
+        for layer, channel in zip((first, first, second), channels):
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual(message, {'type': 'user.update', 'text': 'hi'})
+
+        await first.close()
+        await second.close()
+
+    async def test_one_remote_membership_per_process(self):
+        """ Redis should only know about the process channel - not every socket. """
+
+        layer, _ = self.make_layers()
+        for i in range(5):
+            await layer.group_add('ws-user-1', await layer.new_channel())
+
+        self.assertEqual(list(layer.remote.groups['ws-user-1']), [layer.process_channel])
+        await layer.close()
+
+    async def test_last_discard_leaves_remote_group(self):
+        """ Once nobody in the process listens to a group, the process leaves it too. """
+
+        layer, _ = self.make_layers()
+        channels = [await layer.new_channel(), await layer.new_channel()]
+        for channel in channels:
+            await layer.group_add('ws-user-1', channel)
+
+        await layer.group_discard('ws-user-1', channels[0])
+        self.assertIn('ws-user-1', layer.remote.groups)
+        await layer.group_discard('ws-user-1', channels[1])
+        self.assertNotIn('ws-user-1', layer.remote.groups)
+        await layer.close()
+
+    async def test_only_local_channels_join_groups(self):
+        """ A channel from elsewhere would be sent the process envelopes rather than the messages. """
+
+        layer, _ = self.make_layers()
+        with self.assertRaises(ValueError):
+            await layer.group_add('ws-user-1', 'specific.other-process!abc')
+        self.assertNotIn('ws-user-1', layer.remote.groups)
+        await layer.group_discard('ws-user-1', 'specific.other-process!abc')
+        await layer.close()
+
+    async def test_groups_with_members(self):
+        first, second = self.make_layers()
+        await second.group_add('ws-user-1', await second.new_channel())
+        self.assertEqual(await groups_with_members(first, ['ws-user-1', 'ws-user-2']), {'ws-user-1'})
+        await first.close()
+        await second.close()
+
+    async def test_group_send_many_batches_per_process(self):
+        """ Many groups, one message per subscribed process - and every local member still gets its own. """
+
+        first, second = self.make_layers()
+        channels = [await first.new_channel(), await first.new_channel(), await second.new_channel()]
+        await first.group_add('ws-user-1', channels[0])
+        await first.group_add('ws-user-2', channels[1])
+        await second.group_add('ws-user-2', channels[2])
+
+        with mock.patch.object(first.remote, 'send', wraps=first.remote.send) as send:
+            await first.group_send_many([('ws-user-1', {'type': 'a'}), ('ws-user-2', {'type': 'b'})])
+        self.assertEqual(send.call_count, 2)
+
+        for layer, channel, expected in zip((first, first, second), channels, ('a', 'b', 'b')):
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual(message, {'type': expected})
+
+        await first.close()
+        await second.close()
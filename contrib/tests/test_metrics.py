@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from contrib.layers import InstrumentedLayerMixin
+from contrib.metrics import Metrics, collect, metrics, BUCKETS
+
+
+class InstrumentedInMemoryChannelLayer(InstrumentedLayerMixin, InMemoryChannelLayer):
+    pass
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_histogram_buckets(self):
+        """ Each value lands in the first bucket whose bound it doesn't exceed. """
+
+        registry = Metrics()
+        for value in (0.5, 1, 3, 10000):
+            registry.observe('latency', value)
+
+        histogram = registry.snapshot()['histograms']['latency']
+        self.assertEqual(histogram['count'], 4)
+        self.assertEqual(histogram['sum'], 10004.5)
+        self.assertEqual(histogram['buckets'][0], 2)
+        self.assertEqual(histogram['buckets'][BUCKETS.index(5)], 1)
+        self.assertEqual(histogram['buckets'][-1], 1)
+
+    def test_collect_adds_up_workers(self):
+        """ Every worker leaves its snapshot in the cache - `collect()` reports each and the total. """
+
+        first, second = Metrics(), Metrics()
+        first.worker_id, second.worker_id = 'web-1:1', 'web-2:1'
+        first.incr('channels.sends', 2)
+        second.incr('channels.sends', 3)
+        second.observe('channels.send_latency', 4)
+        first.publish()
+        second.publish()
+
+        report = collect()
+        self.assertEqual(set(report['workers']), {'web-1:1', 'web-2:1'})
+        self.assertEqual(report['total']['counters']['channels.sends'], 5)
+        self.assertEqual(report['total']['histograms']['channels.send_latency']['count'], 1)
+
+
+class InstrumentedLayerTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    async def test_layer_calls_are_counted(self):
+        layer = InstrumentedInMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add('ws-user-1', channel)
+        await layer.group_send('ws-user-1', {'type': 'a'})
+        await layer.group_discard('ws-user-1', channel)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['channels.group_adds'], 1)
+        self.assertEqual(snapshot['counters']['channels.group_sends'], 1)
+        self.assertEqual(snapshot['counters']['channels.group_discards'], 1)
+        self.assertEqual(snapshot['histograms']['channels.group_send_latency']['count'], 1)
+
+    async def test_capacity_errors_are_counted(self):
+        layer = InstrumentedInMemoryChannelLayer(capacity=1)
+        await layer.send('full', {'type': 'a'})
+        with self.assertRaises(ChannelFull):
+            await layer.send('full', {'type': 'b'})
+        self.assertEqual(metrics.counters['channels.capacity_errors'], 1)
+        self.assertEqual(metrics.counters['channels.sends'], 2)
@@ -0,0 +1,92 @@
+from django.utils import timezone
+
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from base64 import urlsafe_b64encode
+from datetime import datetime, timedelta
+from typing import List, Optional
+import json
+
+from contrib.pagination import KeysetPagination
+from contrib.tests.base import BaseTestCase
+from users.models import User
+
+factory = APIRequestFactory()
+
+
+class JoinedPagination(KeysetPagination):
+    ordering = ['-date_joined']
+
+
+class TestKeysetPagination(BaseTestCase):
+    def setUp(self):
+        now = timezone.now()
+        # first names and join dates repeat, so rows only differ by their pk there
+        self.users = [
+            User.objects.create(username=f'user-{i:02}', first_name=['Ann', 'Bob', 'Cy'][i % 3],
+                                date_joined=now - timedelta(microseconds=i // 2))
+            for i in range(25)
+        ]
+
+    def paginate(self, queryset, url: str = '/users/', pagination_class=KeysetPagination) -> dict:
+        paginator = pagination_class()
+        page = paginator.paginate_queryset(queryset, Request(factory.get(url)))
+        return paginator.get_paginated_response([user.pk for user in page]).data
+
+    def walk(self, queryset, pagination_class=KeysetPagination, url: Optional[str] = '/users/') -> List[int]:
+        pks = []
+        while url:
+            data = self.paginate(queryset, url, pagination_class)
+            pks += data['results']
+            url = data['next']
+        return pks
+
+    def test_model_ordering(self):
+        with self.assertNumQueries(1):  # no COUNT(*)
+            data = self.paginate(User.objects.all())
+        self.assertEqual(list(data), ['next', 'previous', 'results'])
+        self.assertIsNone(data['previous'])
+        self.assertEqual(self.walk(User.objects.all()), [user.pk for user in self.users])
+
+    def test_ties_go_by_pk(self):
+        queryset = User.objects.order_by('first_name')
+        self.assertEqual(self.walk(queryset), list(queryset.order_by('first_name', 'pk').values_list('pk', flat=True)))
+
+    def test_descending_datetimes(self):
+        expected = list(User.objects.order_by('-date_joined', 'pk').values_list('pk', flat=True))
+        self.assertEqual(self.walk(User.objects.all(), JoinedPagination), expected)
+
+    def test_previous(self):
+        first = self.paginate(User.objects.all())
+        second = self.paginate(User.objects.all(), first['next'])
+        third = self.paginate(User.objects.all(), second['next'])
+        self.assertEqual(len(third['results']), 5)
+        self.assertIsNone(third['next'])
+        self.assertEqual(self.paginate(User.objects.all(), third['previous'])['results'], second['results'])
+        back = self.paginate(User.objects.all(), second['previous'])
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_page_size(self):
+        self.assertEqual(len(self.paginate(User.objects.all(), '/users/?page_size=3')['results']), 3)
+
+    def test_invalid_cursor(self):
+        other_ordering = self.paginate(User.objects.order_by('first_name'))['next']
+        tampered = [
+            {'o': ['-date_joined', 'pk'], 'v': ['notadate', 1]},
+            {'o': ['-date_joined', 'pk'], 'v': [timezone.now().isoformat(), 'one']},
+            {'o': ['-date_joined', 'pk'], 'v': [None, 1]},
+            {'o': ['-date_joined', 'pk'], 'v': [timezone.now().isoformat(), [1]]},
+        ]
+        urls = [f'/users/?cursor={urlsafe_b64encode(json.dumps(data).encode()).decode()}' for data in tampered]
+        for url, pagination_class in [('/users/?cursor=nope', KeysetPagination), (other_ordering, KeysetPagination),
+                                      *[(url, JoinedPagination) for url in urls]]:
+            with self.assertRaises(NotFound):
+                self.paginate(User.objects.all(), url, pagination_class)
+
+    def test_cursor_values_are_parsed(self):
+        data = self.paginate(User.objects.all(), pagination_class=JoinedPagination)
+        paginator = JoinedPagination()
+        paginator.paginate_queryset(User.objects.all(), Request(factory.get(data['next'])))
+        self.assertIsInstance(paginator.cursor.values[0], datetime)
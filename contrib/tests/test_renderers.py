@@ -0,0 +1,78 @@
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from decimal import Decimal
+from io import BytesIO
+import datetime
+import uuid
+
+from contrib.renderers import ORJSONParser, ORJSONRenderer
+from contrib.tests.base import BaseTestCase
+
+
+class TestORJSONRenderer(BaseTestCase):
+    def assertSameOutput(self, data, accepted_media_type=None):
+        expected = JSONRenderer().render(data, accepted_media_type)
+        self.assertEqual(ORJSONRenderer().render(data, accepted_media_type), expected)
+
+    def test_same_output(self):
+        tz = datetime.timezone(datetime.timedelta(hours=2))
+        for data in [
+            {'when': datetime.datetime(2021, 3, 4, 5, 6, 7, 123456, tzinfo=datetime.timezone.utc)},
+            {'when': datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=tz), 'naive': datetime.datetime(2021, 3, 4)},
+            {'day': datetime.date(2021, 3, 4), 'at': datetime.time(5, 6, 7, 890)},
+            {'now': timezone.now(), 'duration': datetime.timedelta(days=1, seconds=3)},
+            {'price': Decimal('12.50'), 'tiny': Decimal('0.1'), 'id': uuid.uuid4()},
+            {'message': _('Invalid value'), 'errors': [_('This field is required.')]},
+            {'text': 'Zoé     \U0001f600', 'set': {1}, 'nested': [{'a': None, 'b': True, 'c': 1.5}]},
+            [1, 2 ** 70], 'string', 3,
+            [1.5, 0.1, -0.0, 123456789.123, 1e15, 1e16, 1e-4, 1e-7, -2.5e-5, 1e300, {'x': 5e-324}],
+            {'ratio': 2.0, 'big': 1.7976931348623157e308}, 1e16,
+        ]:
+            self.assertSameOutput(data)
+
+    def test_non_finite_floats(self):
+        for data in [{'a': float('nan')}, [None, [float('inf')]], {'a': None, 'b': -float('inf')}]:
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+            with self.assertRaises(ValueError):
+                ORJSONRenderer().render(data)
+
+    def test_indent(self):
+        self.assertSameOutput({'a': [1, 2]}, 'application/json; indent=4')
+
+    def test_none(self):
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_api_response(self):
+        self.user_auth()
+        response = self.client.get('/me/?format=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, JSONRenderer().render(response.json()))
+
+
+class TestORJSONParser(BaseTestCase):
+    def parse(self, parser, body: bytes):
+        return parser.parse(BytesIO(body), 'application/json', {})
+
+    def test_same_result(self):
+        for body in [b'{"a": [1, 2.5, null, true], "b": "Zo\\u00e9"}', '"Zoé"'.encode(), b'[]']:
+            self.assertEqual(repr(self.parse(ORJSONParser(), body)), repr(self.parse(JSONParser(), body)))
+
+    def test_parse_error(self):
+        for body in [b'{"a": ', b'[NaN]']:
+            with self.assertRaises(ParseError) as expected:
+                self.parse(JSONParser(), body)
+            with self.assertRaises(ParseError) as error:
+                self.parse(ORJSONParser(), body)
+            self.assertEqual(str(error.exception.detail), str(expected.exception.detail))
+
+    def test_api_request(self):
+        self.user_auth()
+        response = self.client.patch(f'/users/{self.user.pk}/', data='{"first_name": "Zoé"}',
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['first_name'], 'Zoé')
@@ -3,14 +3,18 @@ from django.test import TestCase, override_settings
 from django.conf import settings
 from django.core.files.temp import NamedTemporaryFile
 from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
+from django.db.models import QuerySet
 
 from unittest import mock
 import tempfile
 import glob
 
-from contrib.models import PrivateGlobalSettings
-from contrib.services import Mail, Backup
+from contrib.models import OutboxEvent, PrivateGlobalSettings
+from contrib.services import Mail, Backup, Outbox
+from contrib.subscriptions import registry
 from users.factories import UserFactory
+from users.models import User
 
 
 class EmailTest(TestCase):
@@ -169,3 +173,80 @@ class BackupTest(TestCase):
 
         backup = Backup(path='/asjkdjakjsdkasdjkas', max_backup_count=5)
         backup.run()
+
+
+@override_settings(USER_EVENTS_OUTBOX=True)
+class OutboxTest(TestCase):
+    @mock.patch('contrib.consumers.publish_users')
+    def test_saves_go_to_the_outbox(self, publish):
+        """ With the outbox on, saving a user only writes a row - nothing is published yet. """
+
+        user = User.objects.create(username='bob')
+        User.objects.filter(pk=user.pk).update(first_name='gao')
+
+        events = list(OutboxEvent.objects.order_by('pk').values_list('topic', 'object_id'))
+        self.assertEqual(events, [('user.updated', user.pk), ('resource.users', user.pk)] * 2)
+        publish.assert_not_called()
+
+    def test_update_commits_with_its_events(self):
+        """ Under autocommit too: an update whose events can't be written doesn't happen either. """
+
+        user = User.objects.create(username='bob')
+        with mock.patch.object(QuerySet, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                User.objects.filter(pk=user.pk).update(first_name='gao')
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, '')
+
+    @mock.patch.object(registry['users'], 'publish')
+    @mock.patch('contrib.consumers.publish_users')
+    def test_dispatch(self, publish, resource_publish):
+        """ One publish per topic and batch, each object once, and the rows are gone afterwards. """
+
+        users = [User.objects.create(username='bob'), User.objects.create(username='gao')]
+        users[0].save()
+
+        self.assertEqual(Outbox(batch_size=10).run(once=True), 6)
+        publish.assert_called_once_with([users[0].pk, users[1].pk])
+        resource_publish.assert_called_once_with([users[0].pk, users[1].pk])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @mock.patch.object(registry['users'], 'publish')
+    @mock.patch('contrib.consumers.publish_users', side_effect=ConnectionError)
+    def test_failed_dispatch_keeps_events(self, publish, resource_publish):
+        """ At-least-once: if publishing a topic fails, its events stay for the next round - without
+        holding up the other topics meanwhile. """
+
+        user = User.objects.create(username='bob')
+        outbox = Outbox()
+        with self.assertLogs('sockets', 'ERROR'):
+            self.assertEqual(outbox.dispatch_batch(), 1)
+        resource_publish.assert_called_once_with([user.pk])
+        self.assertEqual(list(OutboxEvent.objects.values_list('topic', flat=True)), ['user.updated'])
+
+        user.save()
+        self.assertEqual(outbox.dispatch_batch(), 1)  # the failing topic is skipped until the next wait
+        self.assertEqual(publish.call_count, 1)
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+
+        publish.side_effect = None
+        with mock.patch('contrib.services.time.sleep', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                outbox.run()  # nothing else to do - it waits, then tries the failing topic again
+        self.assertFalse(outbox.failing)
+        self.assertEqual(outbox.dispatch_batch(), 2)
+        publish.assert_called_with([user.pk])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @mock.patch('contrib.consumers.publish_users')
+    def test_unknown_topics_are_dropped(self, publish):
+        """ Events nothing can publish anymore don't block the outbox forever. """
+
+        user = User.objects.create(username='bob')
+        OutboxEvent.objects.bulk_create([OutboxEvent(topic='user.deleted', object_id=user.pk),
+                                         OutboxEvent(topic='resource.gone', object_id=user.pk)])
+        with mock.patch.object(registry['users'], 'publish'), self.assertLogs('sockets', 'ERROR') as logs:
+            self.assertEqual(Outbox().run(once=True), 4)
+        self.assertEqual(len(logs.records), 2)
+        publish.assert_called_once_with([user.pk])
+        self.assertFalse(OutboxEvent.objects.exists())
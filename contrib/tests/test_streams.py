@@ -0,0 +1,46 @@
+from unittest import mock
+
+from contrib import streams
+from contrib.tests.base import BaseTestCase
+
+
+class StreamTests(BaseTestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        patcher = mock.patch('contrib.streams.get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_append_many_pipelines(self):
+        """ All events go out in one pipeline, capped and with an expiry. """
+
+        pipe = self.client.pipeline.return_value
+        pipe.execute.return_value = [b'1-0', True, b'2-0', True]
+
+        ids = streams.append_many([(1, {'msg_type': 'a'}), (2, {'msg_type': 'b'})])
+        self.assertEqual(ids, ['1-0', '2-0'])
+        self.assertEqual(pipe.xadd.call_count, 2)
+        self.assertEqual(pipe.xadd.call_args[0], ('stream:user-2', {'msg': '{"msg_type": "b"}'}))
+        pipe.execute.assert_called_once()
+
+    def test_read_since_replays_missed_events(self):
+        self.client.xrange.return_value = [
+            (b'1-0', {b'msg': b'{"msg_type": "a"}'}),
+            (b'2-0', {b'msg': b'{"msg_type": "b"}'}),
+        ]
+        self.assertEqual(streams.read_since(1, '1-0'), [('2-0', {'msg_type': 'b'})])
+        self.client.xrange.assert_called_once_with('stream:user-1', min='1-0')
+
+    def test_read_since_gap(self):
+        """ When the last seen event was trimmed away, we can't know what was missed. """
+
+        self.client.xrange.return_value = [(b'5-0', {b'msg': b'{}'})]
+        self.assertIsNone(streams.read_since(1, '1-0'))
+        self.assertIsNone(streams.read_since(1, 'not-an-id'))
+
+    def test_no_redis(self):
+        """ Without redis nothing is kept and every resume is a snapshot. """
+
+        with mock.patch('contrib.streams.get_client', return_value=None):
+            self.assertEqual(streams.append_many([(1, {})]), [None])
+            self.assertIsNone(streams.read_since(1, '1-0'))
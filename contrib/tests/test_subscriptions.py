@@ -0,0 +1,109 @@
+from django.db import transaction
+
+from channels.testing import WebsocketCommunicator
+from channels.auth import AuthMiddlewareStack
+from asgiref.sync import sync_to_async
+from unittest import mock
+
+from contrib.subscriptions import SubscriptionConsumer, registry
+from contrib.tests.base import BaseTestCase
+from users.factories import UserFactory
+
+
+class SubscriptionConsumerTests(BaseTestCase):
+    async def connect(self, user) -> WebsocketCommunicator:
+        communicator = WebsocketCommunicator(AuthMiddlewareStack(SubscriptionConsumer.as_asgi()), 'ws/subscriptions/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_subscribe_and_receive_updates(self):
+        """ Subscribing returns the current state, and later changes follow on the same socket. """
+
+        user = await sync_to_async(UserFactory)(username='bob')
+        communicator = await self.connect(user)
+
+        await communicator.send_json_to({'action': 'subscribe', 'resource': 'users', 'pk': user.pk})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['msg_type'], 'subscribed')
+        self.assertEqual(response['msg_content']['data']['username'], 'bob')
+
+        user.username = 'gao'
+        await sync_to_async(user.save)()
+        await sync_to_async(registry['users'].publish)([user.pk])
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['msg_type'], 'resource.updated')
+        self.assertEqual(response['msg_content']['pk'], user.pk)
+        self.assertEqual(response['msg_content']['data']['username'], 'gao')
+        await communicator.disconnect()
+
+    async def test_permission_is_checked(self):
+        """ Users can't follow somebody else's account. """
+
+        user, other = await sync_to_async(UserFactory.create_batch)(2)
+        communicator = await self.connect(user)
+
+        await communicator.send_json_to({'action': 'subscribe', 'resource': 'users', 'pk': other.pk})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['msg_type'], 'error')
+        self.assertEqual(response['msg_content']['detail'], 'Not found.')
+        await communicator.disconnect()
+
+    async def test_unknown_resource(self):
+        user = await sync_to_async(UserFactory)()
+        communicator = await self.connect(user)
+
+        await communicator.send_json_to({'action': 'subscribe', 'resource': 'cats', 'pk': 1})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['msg_content']['detail'], 'Unknown resource.')
+        await communicator.disconnect()
+
+    async def test_malformed_frames(self):
+        user = await sync_to_async(UserFactory)()
+        communicator = await self.connect(user)
+
+        for frame in [{'bytes': b''}, {'bytes': b'\xc1'}, {'text': '{"action": '}]:
+            await communicator.send_input({'type': 'websocket.receive', **frame})
+            response = await communicator.receive_json_from()
+            self.assertEqual(response['msg_content']['detail'], 'Malformed message.')
+        await communicator.disconnect()
+
+
+class BatchTests(BaseTestCase):
+    @mock.patch.object(registry['users'], 'publish')
+    def test_changes_are_batched_per_transaction(self, publish):
+        """ Everything saved in one transaction goes out in one publish per resource, after commit. """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            users = UserFactory.create_batch(3)
+            users[0].save()
+            publish.assert_not_called()
+
+        publish.assert_called_once_with({user.pk for user in users})
+
+    @mock.patch.object(registry['users'], 'publish')
+    def test_rolled_back_batch_is_dropped(self, publish):
+        """ Changes after a rollback get a batch (and an on_commit hook) of their own. """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user, other = UserFactory.create_batch(2)
+        publish.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    user.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            other.save()
+
+        publish.assert_called_once_with({other.pk})
+
+    def test_nobody_subscribed(self):
+        """ Instances without subscribers aren't even loaded. """
+
+        user = UserFactory()
+        with self.assertNumQueries(0):
+            self.assertEqual(registry['users'].publish([user.pk]), 0)
@@ -1,11 +1,13 @@
 from django.urls import reverse
-from django.db import DatabaseError
+from django.db import DatabaseError, connection
 from django.conf import settings
+from django.test import override_settings
 from django.core.cache import cache
 
 from unittest import mock
 import shutil
 
+from contrib import batch
 from contrib.tests.base import BaseTestCase
 from contrib.models import PublicGlobalSettings
 
@@ -99,3 +101,98 @@ class SwaggerTest(BaseTestCase):
         }
         response = self.client.get(self.SWAGGER_URL, params)
         self.assertEqual(response.status_code, 200)
+
+
+class TestMetricsView(BaseTestCase):
+    METRICS_URL = reverse('metrics')
+
+    def test_admin_only(self):
+        self.user_auth()
+        response = self.client.get(self.METRICS_URL)
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_report(self):
+        self.admin_auth()
+        response = self.client.get(self.METRICS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total', response.data)
+        self.assertIn('workers', response.data)
+
+
+class TestBatchView(BaseTestCase):
+    BATCH_URL = reverse('batch')
+
+    def setUp(self):
+        self.user_auth()
+
+    def batch(self, *requests, status_code: int = 200) -> list:
+        response = self.client.post(self.BATCH_URL, data={'requests': list(requests)}, format='json')
+        self.assertEqual(response.status_code, status_code, response.content)
+        return response.json().get('responses')
+
+    def test_boot(self):
+        PublicGlobalSettings.objects.create()
+        with self.assertNumQueries(2):  # the settings and the user list - /me/ comes from the payload cache
+            me, globals_, langs, users = self.batch(
+                {'path': '/me/'}, {'path': '/global-settings/'}, {'path': '/langs/'}, {'path': '/users/?fields=id'})
+        self.assertEqual([me['status'], globals_['status'], langs['status'], users['status']], [200] * 4)
+        self.assertEqual(me['body']['username'], self.user.username)
+        self.assertEqual(me['headers']['ETag'], f'W/"{self.user.pk}-{self.user.version}"')
+        self.assertEqual(langs['body'], [list(lang) for lang in settings.LANGUAGES])
+        self.assertEqual(users['body']['results'], [{'id': self.user.pk}])
+
+    def test_errors_are_per_request(self):
+        responses = self.batch(
+            {'path': '/nope/'},
+            {'path': '/batch/', 'method': 'POST'},
+            {'path': '/_metrics/'},
+            {'path': '/users/', 'method': 'POST', 'body': {'username': ''}},
+            {'path': '/me/', 'headers': {'If-None-Match': f'W/"{self.user.pk}-{self.user.version}"'}},
+            {'path': '/langs/'},
+        )
+        self.assertEqual([response['status'] for response in responses], [404, 400, 403, 400, 304, 200])
+        self.assertIn('username', responses[3]['body'])
+
+    def test_reads_see_earlier_writes(self):
+        url = reverse('users-detail', args=[self.user.pk])
+        patched, me = self.batch({'path': url, 'method': 'PATCH', 'body': {'first_name': 'Dylan'}}, {'path': '/me/'})
+        self.assertEqual(patched['status'], 200)
+        self.assertEqual(me['body']['first_name'], 'Dylan')
+
+    def test_batch_user_is_left_alone(self):
+        """ Sub-requests after a write run as a reloaded user, not the batch's own `request.user`. """
+
+        url = reverse('users-detail', args=[self.user.pk])
+        with mock.patch('contrib.batch.run_sub_request', wraps=batch.run_sub_request) as run_sub_request:
+            self.batch({'path': url, 'method': 'PATCH', 'body': {'first_name': 'Dylan'}}, {'path': '/me/'})
+        (request, _, before), (_, _, after) = [call.args for call in run_sub_request.call_args_list]
+        self.assertIs(before, request.user)
+        self.assertIsNot(after, before)
+        self.assertEqual(after.first_name, 'Dylan')
+        self.assertNotEqual(request.user.first_name, 'Dylan')
+
+    @override_settings(BATCH_MAX_CONCURRENCY=4)
+    def test_concurrent_reads(self):
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=60), \
+                mock.patch('contrib.batch.close_old_connections') as close_old_connections:
+            responses = self.batch({'path': '/langs/'}, {'path': '/me/'}, {'path': '/langs/?x=1'})
+        self.assertEqual([response['status'] for response in responses], [200, 200, 200])
+        self.assertEqual(responses[1]['body']['username'], self.user.username)
+        self.assertEqual(close_old_connections.call_count, 3)  # once per thread run
+
+    @override_settings(BATCH_MAX_CONCURRENCY=4)
+    def test_no_threads_without_persistent_connections(self):
+        with mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0), \
+                mock.patch('contrib.batch.close_old_connections') as close_old_connections:
+            responses = self.batch({'path': '/langs/'}, {'path': '/me/'})
+        self.assertEqual([response['status'] for response in responses], [200, 200])
+        close_old_connections.assert_not_called()
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_invalid(self):
+        self.batch(status_code=400)
+        self.batch({'path': '/langs/'}, {'path': '/langs/'}, {'path': '/langs/'}, status_code=400)
+        self.batch({'path': 'langs/'}, status_code=400)
+        self.client.logout()
+        self.client.force_authenticate(None)
+        self.batch({'path': '/langs/'}, status_code=401)
@@ -2,8 +2,10 @@ from django.urls import path
 
 from rest_framework.routers import DefaultRouter
 
+from users.authentication import JWTAuthMiddleware
 from . import views
 from . import consumers
+from . import subscriptions
 
 router = DefaultRouter()
 
@@ -24,4 +26,10 @@ router.register(
 # These are our sync/async websocket routes which will be picked up by asgi.py
 websocket_urls = [
     path('ws/user-watcher/', consumers.UserConsumer.as_asgi(), name='ws-user'),
+    path('ws/subscriptions/', subscriptions.SubscriptionConsumer.as_asgi(), name='ws-subscriptions'),
+]
+
+# Async http routes (i.e. server-sent events) which asgi.py serves ahead of the Django app
+http_urls = [
+    path('me/events/', JWTAuthMiddleware(consumers.UserEventsConsumer.as_asgi()), name='user-events'),
 ]
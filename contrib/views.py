@@ -1,20 +1,45 @@
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.db.models import QuerySet
 
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.throttling import AnonRateThrottle
 from rest_framework import viewsets
 
 from drf_yasg.utils import swagger_auto_schema
+from typing import Tuple
 
 from . import serializers, models
+from .batch import run_batch
+from .compiler import compile_serializer
+from .metrics import collect
 
 User = get_user_model()
 
 
+class SparseFieldsViewMixin:
+    """ For views whose serializer has `contrib.serializers.SparseFieldsMixin`: when a read asks for
+    `?fields=` or `?omit=`, only the columns of the fields that will be output are loaded (`.only()`), along
+    with the primary key, the ordering fields and `sparse_fields_always`. """
+
+    sparse_fields_always: Tuple[str, ...] = ()  # read by the view itself, i.e. to build an ETag
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        queryset = super().filter_queryset(queryset)
+        fields, omit = serializers.requested_fields(self.request)
+        if self.request.method not in SAFE_METHODS or (fields is None and not omit):
+            return queryset
+        columns = self.get_serializer().get_sparse_columns()
+        if columns is None:
+            return queryset
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        ordering = [field.lstrip('-').split('__')[0] for field in ordering if isinstance(field, str) and field != '?']
+        return queryset.only(*dict.fromkeys(['pk', *columns, *ordering, *self.sparse_fields_always]))
+
+
 class LanguageViewSet(viewsets.ViewSet):
     """ Returns possible languages from settings. """
 
@@ -50,11 +75,10 @@ class HealthViewSet(viewsets.ViewSet):
     def list(self, request: Request, format=None) -> Response:
         """ Indicates health of the server and key associated services. """
 
-        serializer = self.serializer_class(data={})
-        serializer.is_valid(raise_exception=True)
-        if not all(serializer.data.values()):
-            return Response(serializer.data, status=400)
-        return Response(serializer.data)
+        data = compile_serializer(self.serializer_class).to_representation({})
+        if not all(data.values()):
+            return Response(data, status=400)
+        return Response(data)
 
 
 @swagger_auto_schema(
@@ -75,5 +99,37 @@ def global_settings(request: Request) -> Response:
     except models.PublicGlobalSettings.DoesNotExist:
         return Response({})  # not set yet
 
-    serializer = serializers.PublicGlobalSettingsSerializer(pub_settings)
-    return Response(serializer.data)
+    return Response(compile_serializer(serializers.PublicGlobalSettingsSerializer).to_representation(pub_settings))
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_id='batch',
+    operation_summary='Run several requests at once',
+    operation_description='Sub-requests run in-process as the same user, each with its own status. Consecutive '
+                          'GETs run concurrently; anything else runs in order.',
+    request_body=serializers.BatchSerializer,
+    responses={
+        200: 'The `responses`, in order, as `{"status", "headers", "body"}`.',
+    })
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request: Request) -> Response:
+    """ Saves the frontend a round trip (authentication, middleware, TLS...) per request when booting. """
+
+    serializer = serializers.BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response({'responses': run_batch(request, serializer.validated_data['requests'])})
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_id='metrics',
+    operation_summary='Fetch channel layer and websocket metrics of every worker',
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_report(request: Request) -> Response:
+    """ Counters, gauges and histograms from `contrib.metrics`, as last reported by each ASGI worker. """
+
+    return Response(collect())
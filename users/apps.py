@@ -6,3 +6,4 @@ class UsersConfig(AppConfig):
 
     def ready(self) -> None:
         import users.signals  # noqa
+        import users.subscriptions  # noqa
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import AnonymousUser
+from django.utils.translation import gettext_lazy as _
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from typing import Iterable, Optional, Union
+from urllib.parse import parse_qs
+import logging
+
+from contrib.cache import LocalCache
+from users.models import User
+
+logger = logging.getLogger('users')
+
+# the subprotocol a browser client offers right before its token, i.e. `new WebSocket(url, ['jwt', token])`
+JWT_SUBPROTOCOL = 'jwt'
+
+
+# what authentication, permissions and `UserSerializer` need - anything else is deferred
+# (in model field order, which is what `Model.from_db` expects the values in)
+AUTH_USER_FIELDS = tuple(field.attname for field in User._meta.concrete_fields if field.attname in {
+    'id', 'username', 'first_name', 'last_name', 'email', 'email_verified', 'is_active', 'is_staff', 'is_superuser',
+    'version',
+})
+
+local_users = LocalCache(maxsize=settings.AUTH_USER_LOCAL_CACHE_SIZE, ttl=settings.AUTH_USER_LOCAL_CACHE_TTL)
+
+# left in redis in place of a changed user for `AUTH_USER_INVALIDATED_TTL` seconds (see `get_cached_user`)
+INVALIDATED = 'invalidated'
+
+
+def auth_cache_key(user_id: int) -> str:
+    return f'users:auth:{user_id}'
+
+
+def get_cached_user(user_id: int) -> Optional[User]:
+    """ Loads a user for authentication through two caches - in-process, then redis - so most
+    authenticated requests (and websocket reconnects) don't query Postgres at all.
+
+    Only `AUTH_USER_FIELDS` are cached; the returned instance has every other field deferred,
+    so reading one costs a query and saving it only writes the loaded fields.
+
+    A row read from the database is only cached where nothing is: a change committed between the
+    read and the store leaves `INVALIDATED` behind, so the (now old) row doesn't get cached again.
+    Until that marker expires, the user is read from the database every time. """
+
+    key = auth_cache_key(user_id)
+    values = local_users.get(key)
+    if values is None:
+        values = cache.get(key)
+        if values is None or values == INVALIDATED:
+            invalidated = values is not None
+            values = User.objects.filter(pk=user_id).values_list(*AUTH_USER_FIELDS).first()
+            if values is None:
+                return None
+            if invalidated or not cache.add(key, values, settings.AUTH_USER_CACHE_TTL):
+                return User.from_db(User.objects.db, AUTH_USER_FIELDS, values)  # and not cached locally either
+        local_users.set(key, values)
+    return User.from_db(User.objects.db, AUTH_USER_FIELDS, values)
+
+
+def invalidate_cached_user(user_id: int) -> None:
+    """ Other processes may still hold the user for up to `AUTH_USER_LOCAL_CACHE_TTL` seconds.
+    Call it once the change is committed - before that, the next request would cache the old row again. """
+
+    invalidate_cached_users([user_id])
+
+
+def invalidate_cached_users(user_ids: Iterable[int]) -> None:
+    keys = [auth_cache_key(user_id) for user_id in user_ids]
+    for key in keys:
+        local_users.delete(key)
+    cache.set_many({key: INVALIDATED for key in keys}, settings.AUTH_USER_INVALIDATED_TTL)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ simplejwt's `JWTAuthentication`, loading the user through `get_cached_user`. """
+
+    def get_user(self, validated_token) -> User:
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class JWTAuthMiddleware:
+    """ Authenticates websocket (and other ASGI) connections with the same JWT the API uses.
+
+    The token is read from, in order: an `Authorization: Bearer <token>` header, the subprotocol
+    that follows `jwt` in the offered subprotocols, or a `?token=` query param. It is checked by
+    signature only - `scope['user']` becomes a `TokenUser` built from the claims, so no session or
+    User query is needed. Set `WEBSOCKET_JWT_LOAD_USER` to get a real User instead, through the same
+    cache as `CachedJWTAuthentication`.
+
+    Connections without a token fall back to the normal session based `AuthMiddlewareStack`.
+    """
+
+    def __init__(self, inner) -> None:
+        self.inner = inner
+        self.session_inner = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        raw_token = self.get_raw_token(scope)
+        if raw_token is None:
+            return await self.session_inner(scope, receive, send)
+
+        scope = dict(scope)
+        scope['subprotocols'] = [p for p in scope.get('subprotocols', []) if p != raw_token]
+        scope['user'] = await self.get_user(raw_token)
+        return await self.inner(scope, receive, send)
+
+    def get_raw_token(self, scope: dict) -> Optional[str]:
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                parts = value.decode('latin1').split()
+                if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                    return parts[1]
+
+        subprotocols = scope.get('subprotocols', [])
+        if JWT_SUBPROTOCOL in subprotocols:
+            index = subprotocols.index(JWT_SUBPROTOCOL)
+            if index + 1 < len(subprotocols):
+                return subprotocols[index + 1]
+
+        params = parse_qs(scope.get('query_string', b'').decode())
+        if 'token' in params:
+            return params['token'][0]
+        return None
+
+    async def get_user(self, raw_token: str) -> Union[TokenUser, User, AnonymousUser]:
+        try:
+            validated_token = JWTAuthentication().get_validated_token(raw_token)
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except (InvalidToken, KeyError):
+            logger.info('Rejected websocket token.')
+            return AnonymousUser()
+
+        if not settings.WEBSOCKET_JWT_LOAD_USER:
+            return TokenUser(validated_token)
+        user = await database_sync_to_async(get_cached_user)(user_id)
+        if user is None or not user.is_active:
+            return AnonymousUser()
+        return user
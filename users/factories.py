@@ -13,7 +13,7 @@ class UserFactory(factory.django.DjangoModelFactory):
 
     first_name = factory.Faker('first_name')
     last_name = factory.Faker('last_name')
-    email = factory.Faker('safe_email')
+    email = factory.Sequence(lambda n: f'user{n}@example.com')  # unique, like the index on it
     username = factory.Faker('user_name')
     password = factory.PostGenerationMethodCall('set_password', 'password')
     is_active = True
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.encoding import force_bytes
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+import base64
+import hashlib
+import logging
+import multiprocessing
+import threading
+
+from contrib.metrics import metrics
+
+logger = logging.getLogger('users')
+
+
+class HashingUnavailable(Exception):
+    """ Too many hashes waiting already - answered with a 503, by the API and the other views alike (see
+    `contrib.exceptions`.) """
+
+
+class HashingPool:
+    """ Runs PBKDF2 in a few worker processes, so hashing and checking passwords can't take all the
+    CPU of a web worker.
+
+    At most `PASSWORD_HASHING_MAX_QUEUE` hashes wait or run at once per web worker - past that we
+    fail fast with `HashingUnavailable` (a 503) rather than tie up even more request threads. With `PASSWORD_HASHING_POOL_SIZE`
+    at 0 passwords are hashed inline, like Django does. """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+
+    def pbkdf2(self, password: bytes, salt: bytes, iterations: int, digest: str) -> bytes:
+        if not settings.PASSWORD_HASHING_POOL_SIZE:
+            return hashlib.pbkdf2_hmac(digest, password, salt, iterations)
+
+        with self.lock:
+            if self.pending >= settings.PASSWORD_HASHING_MAX_QUEUE:
+                metrics.incr('auth.hashing_rejected')
+                raise HashingUnavailable()
+            self.pending += 1
+            executor = self.get_executor()
+        try:
+            with metrics.timer('auth.hashing_latency'):
+                # a builtin, so the worker processes don't need to import (or set up) anything of ours
+                return executor.submit(hashlib.pbkdf2_hmac, digest, password, salt, iterations).result()
+        except BrokenProcessPool:
+            logger.exception('Password hashing pool broke, hashing inline.')
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            return hashlib.pbkdf2_hmac(digest, password, salt, iterations)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """ Started on first use - spawned rather than forked, the web worker has threads running. """
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                settings.PASSWORD_HASHING_POOL_SIZE, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+hashing_pool = HashingPool()
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """ Django's default hasher, computed in `hashing_pool`. Same algorithm and encoding, so existing
+    hashes keep working - and `verify()` goes through `encode()`, so checks are pooled too. """
+
+    def encode(self, password: str, salt: str, iterations: Optional[int] = None) -> str:
+        assert password is not None
+        assert salt and '$' not in salt
+        iterations = iterations or self.iterations
+        hash = hashing_pool.pbkdf2(force_bytes(password), force_bytes(salt), iterations, self.digest().name)
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt, hash)
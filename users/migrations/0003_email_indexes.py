@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+EMAIL_INDEX = 'users_user_email_idx'
+EMAIL_UNIQUE_INDEX = 'users_user_email_upper_uniq'
+
+
+def create_email_indexes(apps, schema_editor):
+    """ Built CONCURRENTLY on Postgres, so signups and logins carry on while it runs. The unique index
+    can't be built while two accounts share an email in different cases - merge those first. """
+
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('postgresql', 'sqlite'):
+        return
+    table = schema_editor.quote_name(apps.get_model('users', 'User')._meta.db_table)
+    concurrently = 'CONCURRENTLY' if vendor == 'postgresql' else ''
+    schema_editor.execute(f'CREATE INDEX {concurrently} IF NOT EXISTS {EMAIL_INDEX} ON {table} (email)')
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {concurrently} IF NOT EXISTS {EMAIL_UNIQUE_INDEX} ON {table} (UPPER(email)) "
+        f"WHERE email <> ''")
+
+
+def drop_email_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in ('postgresql', 'sqlite'):
+        return
+    concurrently = 'CONCURRENTLY' if vendor == 'postgresql' else ''
+    for index in (EMAIL_UNIQUE_INDEX, EMAIL_INDEX):
+        schema_editor.execute(f'DROP INDEX {concurrently} IF EXISTS {index}')
+
+
+class Migration(migrations.Migration):
+    atomic = False  # CREATE INDEX CONCURRENTLY can't run in a transaction
+
+    dependencies = [
+        ('users', '0002_user_manager'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='user',
+                    index=models.Index(fields=['email'], name=EMAIL_INDEX),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_email_indexes, drop_email_indexes),
+            ],
+        ),
+    ]
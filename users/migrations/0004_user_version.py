@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:41
+
+from django.db import migrations, models
+import django.db.models.functions.text
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_email_indexes'),
+    ]
+
+    operations = [
+        # 0003 built it with raw SQL - tell the state about it too, or rebuilding the table on sqlite
+        # (i.e. for the field below) drops it
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='user',
+                    index=users.models.UniqueIndex(
+                        django.db.models.functions.text.Upper('email'),
+                        condition=models.Q(('email', ''), _negated=True),
+                        name='users_user_email_upper_uniq',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Version'),
+        ),
+    ]
@@ -1,32 +1,117 @@
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.db import models, transaction
+from django.db.models.functions import Upper
 from django.conf import settings
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
-
 import logging
 from typing import Optional
 
+from users.tokens import TokenIssuer
+
 logger = logging.getLogger('users')
 
+# case-insensitive and unique, on non-empty emails (migration 0003 builds it without locking the table)
+EMAIL_UNIQUE_INDEX = 'users_user_email_upper_uniq'
+
+
+class UniqueIndex(models.Index):
+    """ An `Index` that is unique - `UniqueConstraint` only takes expressions from Django 4.0 on. """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        sql = schema_editor.sql_create_unique_index
+        if kwargs.get('concurrently'):
+            sql = sql.replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX CONCURRENTLY')
+        return super().create_sql(model, schema_editor, using=using, sql=sql, **kwargs)
+
+
+class UserQuerySet(models.QuerySet):
+    """ `update()` skips `post_save`, so websocket watchers and subscribers would never hear
+    about it - publish the affected users in bulk once the transaction commits, `PUBLISH_BATCH_SIZE`
+    at a time (through the outbox when it's on.) """
+
+    def update(self, **kwargs) -> int:
+        # these all import this module
+        from contrib.consumers import PUBLISH_BATCH_SIZE, publish_users
+        from contrib.models import OutboxEvent
+        from contrib.subscriptions import registry
+        from users.authentication import invalidate_cached_users
+
+        # one transaction, so the outbox events can't be lost between the update and their insert
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))  # before the update, which may change what matches
+            kwargs.setdefault('version', models.F('version') + 1)
+            rows = super().update(**kwargs)
+            if pks:
+                # all of them, however many - the auth cache must not keep serving the old rows either
+                transaction.on_commit(lambda: invalidate_cached_users(pks), using=self.db)
+            if pks and settings.USER_EVENTS_OUTBOX:
+                OutboxEvent.objects.using(self.db).bulk_create(
+                    [OutboxEvent(topic='user.updated', object_id=pk) for pk in pks], batch_size=PUBLISH_BATCH_SIZE)
+                registry['users'].changed(pks, using=self.db)
+            elif pks:
+                transaction.on_commit(lambda: publish_users(pks), using=self.db)
+                registry['users'].changed(pks, using=self.db)
+        return rows
+
+    update.alters_data = True
+    # `bulk_update()` goes through `update()` for each batch, so it is covered as well
+
+    def by_email(self, email: str) -> 'UserQuerySet':
+        """ The user with this email, in any case - written to match the `UPPER(email)` index. """
+
+        return self.filter(email__iexact=email).exclude(email='')
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    """ Django's `UserManager`, returning `UserQuerySet`s. """
+
 
 class User(AbstractUser):
     """ The main user model for further customization. """
 
     email_verified = models.BooleanField(_('Email vérifié'), default=False)
+    # bumped on every save and update - tells whether a user changed (ETags, cache keys, stale frames)
+    version = models.PositiveIntegerField(_('Version'), default=1, editable=False)
+
+    objects = UserManager()
+
+    def save(self, *args, **kwargs) -> None:
+        """ Atomic, so whatever `post_save` writes (i.e. the outbox event) commits or rolls back with the user.
+
+        Also bumps `version`, from the stored one read under a row lock, so concurrent saves can't both
+        end up with the same version - and the instance holds the new one when `post_save` runs. """
+
+        using = kwargs.get('using')
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic(using=using):
+            if not self._state.adding and (update_fields is None or update_fields):
+                stored = type(self)._base_manager.using(using).select_for_update().filter(pk=self.pk)
+                version = stored.values_list('version', flat=True).first()
+                if version is not None:
+                    self.version = version + 1
+                    if update_fields is not None:
+                        kwargs['update_fields'] = {*update_fields, 'version'}
+            super().save(*args, **kwargs)
+
+    @cached_property
+    def token_issuer(self) -> TokenIssuer:
+        """ Signs this user's tokens once and keeps them while they're fresh (see `users.tokens`.) """
+
+        return TokenIssuer(self)
 
     @property
     def access_token(self) -> str:
         """ Creates/retrieves a JWT access token for the user that can be used to authenticate. """
 
-        return str(AccessToken.for_user(self))
+        return self.token_issuer.access()
 
     @property
     def refresh_token(self) -> str:
         """ Creates/retrieves a JWT access token for the user that can be used to obtain new access token. """
 
-        return str(RefreshToken.for_user(self))
+        return self.token_issuer.refresh()
 
     @property
     def autologin_url(self) -> Optional[str]:
@@ -38,3 +123,7 @@ class User(AbstractUser):
 
     class Meta:
         ordering = ['username']
+        indexes = [
+            models.Index(fields=['email'], name='users_user_email_idx'),  # sorting, i.e. in the admin
+            UniqueIndex(Upper('email'), condition=~models.Q(email=''), name=EMAIL_UNIQUE_INDEX),
+        ]
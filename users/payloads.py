@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from typing import Iterable, List, Optional, Tuple
+import orjson
+
+from contrib.cache import LocalCache
+from contrib.compiler import compile_serializer
+from contrib.renderers import ORJSONRenderer
+from users.models import User
+from users.serializers import UserSerializer
+
+# serialized users, as (version, json bytes) by user pk - in redis, and for a few seconds in each process
+local_payloads = LocalCache(maxsize=settings.USER_PAYLOAD_LOCAL_CACHE_SIZE, ttl=settings.USER_PAYLOAD_LOCAL_CACHE_TTL)
+
+
+def payload_cache_key(user_pk: int) -> str:
+    return f'users:payload:{user_pk}'
+
+
+def render_user(user: User) -> bytes:
+    """ Exactly what the API's JSON renderer sends for `UserSerializer(user).data`. """
+
+    return ORJSONRenderer().render(compile_serializer(UserSerializer).to_representation(user))
+
+
+def get_user_payloads(users: Iterable[User]) -> List[bytes]:
+    """ The rendered `UserSerializer` output of each user, in order - from the local cache, then redis
+    (one `get_many`), and rendered (then stored with one `set_many`) only for those that changed since.
+
+    Entries carry the user version they were rendered from. An older instance (i.e. a cached
+    `request.user`) gets its own version rendered, but never overwrites a newer entry. Inside a
+    transaction, what was rendered is only stored once it commits - a rolled back version number
+    gets used again by the next change. """
+
+    users = list(users)
+    entries: List[Optional[Tuple[int, bytes]]] = []
+    for user in users:
+        entry = local_payloads.get(user.pk)
+        entries.append(entry if entry and entry[0] == user.version else None)
+
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if missing:
+        stored = cache.get_many([payload_cache_key(users[i].pk) for i in missing])
+        to_store, to_keep = {}, {}
+        for i in missing:
+            user = users[i]
+            key = payload_cache_key(user.pk)
+            entry = stored.get(key)
+            if not entry or entry[0] != user.version:
+                fresh = (user.version, render_user(user))
+                if not entry or entry[0] < user.version:
+                    to_store[key] = fresh
+                entry = fresh
+            to_keep[user.pk] = entry
+            entries[i] = entry
+        transaction.on_commit(lambda: store_payloads(to_keep, to_store))  # right away outside a transaction
+    return [entry[1] for entry in entries]
+
+
+def store_payloads(local: dict, shared: dict) -> None:
+    for pk, entry in local.items():
+        local_payloads.set(pk, entry)
+    if shared:
+        cache.set_many(shared, settings.USER_PAYLOAD_CACHE_TTL)
+
+
+def get_user_payload(user: User) -> bytes:
+    return get_user_payloads([user])[0]
+
+
+def user_payload(user: User) -> dict:
+    """ `UserSerializer(user).data` through the payload cache - parsing the cached bytes is much cheaper
+    than running the serializer. """
+
+    return orjson.loads(get_user_payload(user))
+
+
+def invalidate_user_payload(user_pk: int) -> None:
+    local_payloads.delete(user_pk)
+    cache.delete(payload_cache_key(user_pk))
@@ -3,6 +3,8 @@ from django.contrib.auth.hashers import make_password
 from django.conf import settings
 from django.contrib.auth.forms import SetPasswordForm
 from django.contrib.auth.tokens import default_token_generator
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_text
 from django.utils.translation import gettext_lazy as _
@@ -11,34 +13,57 @@ from rest_framework import serializers
 from rest_framework.validators import ValidationError
 
 import logging
+from contextlib import contextmanager
+from typing import Iterator
 from urllib.parse import unquote_plus
 from hashids import Hashids
 
+from contrib.serializers import SparseFieldsMixin
 from contrib.services import Mail
-from users.models import User
+from users.models import EMAIL_UNIQUE_INDEX, User
 
 logger = logging.getLogger('users')
 
 
-class UserSerializer(serializers.ModelSerializer):
-    """ Serializer interface for base User model. Write only access to update password. """
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """ Serializer interface for base User model. Write only access to update password.
+    Clients can ask for some fields only with `?fields=`/`?omit=`. """
 
     class Meta:
         model = User
-        fields = ['id', 'password', 'first_name', 'last_name', 'username', 'email']
+        fields = ['id', 'password', 'first_name', 'last_name', 'username', 'email', 'version']
         extra_kwargs = {
             'password': {'write_only': True},
             'id': {'read_only': True},
         }
+        read_only_fields = ['version']
 
     def create(self, validated_data: dict) -> User:
         """ In addition to creation of new user, logs creation information. """
 
-        user = super().create(validated_data)
+        with self.unique_email():
+            user = super().create(validated_data)
         msg = 'Registered new user: {}'
         logger.info(msg.format(user.username))
         return user
 
+    def update(self, instance: User, validated_data: dict) -> User:
+        with self.unique_email():
+            return super().update(instance, validated_data)
+
+    @contextmanager
+    def unique_email(self) -> Iterator[None]:
+        """ `validate_email` can pass for two signups at once - the unique index is what actually stops
+        the second one, so turn that into the same validation error. """
+
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError as error:
+            if EMAIL_UNIQUE_INDEX not in str(error):
+                raise
+            raise ValidationError({'email': ['This email is already registered.']})
+
     def validate_password(self, value: str) -> str:
         """ Transform the plain text supplied for password field of POST/PUT/PATCH into a proper Django hash. """
 
@@ -48,7 +73,8 @@ class UserSerializer(serializers.ModelSerializer):
         """ Blocks the creation/update if the email address is not unique. """
 
         if not self.instance:
-            if User.objects.filter(username=value).exists() or User.objects.filter(email=value).exists():
+            # one query - `email <> ''` is what lets Postgres use the partial `UPPER(email)` index
+            if User.objects.filter(Q(username=value) | Q(email__iexact=value) & ~Q(email='')).exists():
                 raise ValidationError("This email is already registered.")
         return value
 
@@ -61,7 +87,7 @@ class PasswordResetSerializer(serializers.Serializer):
     def validate_email(self, value: str) -> str:
         # Create PasswordResetForm with the serializer
         try:
-            self.user = User.objects.get(email=value)
+            self.user = User.objects.by_email(value).get()
         except (TypeError, AttributeError, ValueError, OverflowError, User.DoesNotExist):
             raise ValidationError({'email': ['Valeur invalide']})
         return value
@@ -122,7 +148,7 @@ class AccountVerifySerializer(serializers.Serializer):
         """ Look User instance by email address and ensure not already registered. """
 
         try:
-            self.user = User.objects.get(email=unquote_plus(value))
+            self.user = User.objects.by_email(unquote_plus(value)).get()
             if self.user.email_verified:
                 raise serializers.ValidationError(_('Ce compte est déjà validé'))
         except (TypeError, AttributeError, ValueError, OverflowError, User.DoesNotExist):
@@ -1,8 +1,12 @@
 from django.contrib.auth.signals import user_login_failed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 import logging
 
+from users.authentication import invalidate_cached_user
+from users.payloads import invalidate_user_payload
 from users.models import User
 from .utils import get_client_ip
 
@@ -17,3 +21,21 @@ def user_login_failed_callback(sender: User, credentials: dict, **kwargs):
     username = credentials['username']
     ip = get_client_ip(kwargs['request'])
     logger.warn(f'BAD LOGIN ATTEMPT | {username} | {ip}')
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_cached_user_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='invalidate_cached_user_on_delete')
+def invalidate_auth_cache(sender: User, instance: User, using: str, **kwargs):
+    """ Authentication reads users from a cache (see `users.authentication.get_cached_user`) -
+    cleared once the change is committed, so no request caches the old row in the meantime. """
+
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_cached_user(pk), using=using)
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_user_payload_on_save')
+@receiver(post_delete, sender=User, dispatch_uid='invalidate_user_payload_on_delete')
+def invalidate_payload_cache(sender: User, instance: User, **kwargs):
+    """ Rendered users are cached too (see `users.payloads`.) """
+
+    invalidate_user_payload(instance.pk)
@@ -0,0 +1,15 @@
+from contrib.subscriptions import Resource, register
+from users.models import User
+from users.serializers import UserSerializer
+
+
+@register
+class UserResource(Resource):
+    """ Users can follow their own account, staff anyone's. """
+
+    name = 'users'
+    model = User
+    serializer_class = UserSerializer
+
+    def has_permission(self, user, instance: User) -> bool:
+        return user.pk == instance.pk or user.is_staff
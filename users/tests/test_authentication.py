@@ -0,0 +1,153 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models import QuerySet
+from django.test import override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from unittest import mock
+
+from rest_framework_simplejwt.models import TokenUser
+
+from contrib.tests.base import BaseTestCase
+from users.authentication import JWTAuthMiddleware, auth_cache_key, get_cached_user, local_users
+from users.factories import UserFactory
+from users.models import User
+
+
+class TestJWTAuthMiddleware(BaseTestCase):
+    def setUp(self):
+        local_users.clear()
+        cache.clear()
+        self.user = UserFactory()
+        self.token = self.user.access_token
+
+    async def resolve(self, **scope) -> dict:
+        """ Runs the middleware in front of a dummy app and returns the scope that app got. """
+
+        received = {}
+
+        async def app(scope, receive, send):
+            received.update(scope)
+
+        scope = dict({'type': 'websocket', 'headers': [], 'subprotocols': [], 'query_string': b''}, **scope)
+        await JWTAuthMiddleware(app)(scope, None, None)
+        return received
+
+    async def test_token_in_query_string(self):
+        """ Signature is enough - we get a TokenUser without touching the db. """
+
+        scope = await self.resolve(query_string=f'token={self.token}'.encode())
+        self.assertIsInstance(scope['user'], TokenUser)
+        self.assertEqual(scope['user'].pk, self.user.pk)
+
+    async def test_token_in_subprotocol(self):
+        """ The token is taken out of the subprotocols, but the `jwt` marker stays so it can be echoed back. """
+
+        scope = await self.resolve(subprotocols=['jwt', self.token, 'msgpack'])
+        self.assertEqual(scope['user'].pk, self.user.pk)
+        self.assertEqual(scope['subprotocols'], ['jwt', 'msgpack'])
+
+    async def test_token_in_header(self):
+        """ Non-browser clients can just send the usual header. """
+
+        scope = await self.resolve(headers=[(b'authorization', f'Bearer {self.token}'.encode())])
+        self.assertEqual(scope['user'].pk, self.user.pk)
+
+    async def test_bad_token_is_anonymous(self):
+        """ A token that doesn't check out should not fall back to anything. """
+
+        scope = await self.resolve(query_string=b'token=all-cats-are-beautiful')
+        self.assertIsInstance(scope['user'], AnonymousUser)
+
+    @override_settings(WEBSOCKET_JWT_LOAD_USER=True)
+    async def test_load_user(self):
+        """ If asked, we get a real User instance back. """
+
+        scope = await self.resolve(query_string=f'token={self.token}'.encode())
+        self.assertIsInstance(scope['user'], User)
+        self.assertEqual(scope['user'].username, self.user.username)
+
+
+class TestCachedJWTAuthentication(BaseTestCase):
+    def setUp(self):
+        local_users.clear()
+        cache.clear()
+        self.user = UserFactory()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.access_token}')
+
+    def test_me_without_queries(self):
+        """ Once the user is cached, `/me/` doesn't need the database at all. """
+
+        with self.assertNumQueries(1):
+            self.client.get(reverse('me'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('me'))
+        self.assertEqual(response.json()['username'], self.user.username)
+
+    def test_shared_cache(self):
+        """ Another process (empty local cache) finds the user in redis. """
+
+        get_cached_user(self.user.pk)
+        local_users.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_user(self.user.pk).email, self.user.email)
+
+    def test_save_invalidates(self):
+        """ Once committed - until then, another request would just cache the old row again. """
+
+        first_name = get_cached_user(self.user.pk).first_name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'gao'
+            self.user.save()
+            self.assertEqual(get_cached_user(self.user.pk).first_name, first_name)
+        self.assertEqual(get_cached_user(self.user.pk).first_name, 'gao')
+
+    def test_update_invalidates(self):
+        get_cached_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(first_name='gao', is_active=False)
+        user = get_cached_user(self.user.pk)
+        self.assertEqual((user.first_name, user.is_active), ('gao', False))
+
+    def test_row_read_before_a_change_is_not_cached(self):
+        """ A request reads the row, the change commits (clearing the caches), then the request
+        stores what it read - the old row mustn't stay cached for `AUTH_USER_CACHE_TTL`. """
+
+        first = QuerySet.first
+
+        def read_then_change(queryset):
+            values = first(queryset)
+            with self.captureOnCommitCallbacks(execute=True):
+                User.objects.filter(pk=self.user.pk).update(is_active=False)
+            return values
+
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=read_then_change):
+            self.assertTrue(get_cached_user(self.user.pk).is_active)
+        self.assertFalse(get_cached_user(self.user.pk).is_active)
+        local_users.clear()  # i.e. another process
+        self.assertFalse(get_cached_user(self.user.pk).is_active)
+
+        cache.delete(auth_cache_key(self.user.pk))  # the marker expired
+        get_cached_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(get_cached_user(self.user.pk).is_active)
+
+    def test_inactive_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('me'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_deferred_fields_are_safe_to_save(self):
+        """ Fields that weren't cached are loaded on access, and saving only writes what was loaded. """
+
+        user = get_cached_user(self.user.pk)
+        self.assertIn('password', user.get_deferred_fields())
+        user.first_name = 'gao'
+        user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'gao')
+        self.assertTrue(self.user.check_password('password'))
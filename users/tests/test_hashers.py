@@ -0,0 +1,63 @@
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+from django.test import Client, override_settings
+from django.urls import reverse
+from unittest import mock
+
+from contrib.tests.base import BaseTestCase
+from users.factories import UserFactory
+from users.hashers import HashingUnavailable, PooledPBKDF2PasswordHasher, hashing_pool
+
+
+class TestPooledHashing(BaseTestCase):
+    PASSWORD_LOGIN_URL = reverse('token-obtain-pair')
+
+    def tearDown(self):
+        hashing_pool.shutdown()
+
+    @override_settings(PASSWORD_HASHING_POOL_SIZE=1)
+    def test_hashes_match_django(self):
+        """ Hashes from the pool are exactly Django's, so existing passwords keep working. """
+
+        encoded = PooledPBKDF2PasswordHasher().encode('Trump2020', 'salty')
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('Trump2020', 'salty'))
+        self.assertTrue(check_password('Trump2020', make_password('Trump2020')))
+        self.assertIsNotNone(hashing_pool.executor)
+
+    @override_settings(PASSWORD_HASHING_POOL_SIZE=0)
+    def test_inline_without_pool(self):
+        self.assertTrue(check_password('Trump2020', make_password('Trump2020')))
+        self.assertIsNone(hashing_pool.executor)
+
+    @override_settings(PASSWORD_HASHING_POOL_SIZE=1, PASSWORD_HASHING_MAX_QUEUE=2)
+    def test_login_fails_fast_when_saturated(self):
+        """ With the queue full, logins get a 503 right away instead of waiting their turn. """
+
+        user = UserFactory(password='Trump2020')
+        data = {'username': user.username, 'password': 'Trump2020'}
+        with mock.patch.object(hashing_pool, 'pending', 2):
+            response = self.client.post(self.PASSWORD_LOGIN_URL, data=data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        response = self.client.post(self.PASSWORD_LOGIN_URL, data=data)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PASSWORD_HASHING_POOL_SIZE=1, PASSWORD_HASHING_MAX_QUEUE=2)
+    def test_saturated_outside_the_api(self):
+        """ The hasher knows nothing of DRF - the API's exception handler makes a 503 of it, and
+        `HashingBusyMiddleware` does for Django's own views. """
+
+        with mock.patch.object(hashing_pool, 'pending', 2), self.assertRaises(HashingUnavailable):
+            make_password('Trump2020')
+
+    @override_settings(PASSWORD_HASHING_POOL_SIZE=1, PASSWORD_HASHING_MAX_QUEUE=2)
+    def test_admin_login_when_saturated(self):
+        user = UserFactory(password='Trump2020', is_staff=True)
+        data = {'username': user.username, 'password': 'Trump2020', 'next': reverse('admin:index')}
+        with mock.patch.object(hashing_pool, 'pending', 2):
+            response = Client().post(reverse('admin:login'), data=data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        response = Client().post(reverse('admin:login'), data=data)
+        self.assertEqual(response.status_code, 302)
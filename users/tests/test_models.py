@@ -1,7 +1,14 @@
+from django.core.cache import cache
+from django.test import override_settings
+
+from rest_framework_simplejwt.tokens import AccessToken
+from unittest import mock
 import re
 
 from contrib.tests.base import BaseTestCase
 from users.factories import UserFactory
+from users.models import User
+from users.tokens import issue_tokens
 
 
 class TestUserModel(BaseTestCase):
@@ -20,3 +27,56 @@ class TestUserModel(BaseTestCase):
         """ Ensure we can render the __str__ and __repr__ for the model. """
         self.assertIn('<User:', repr(self.user))
         self.assertIn(self.user.username, str(self.user))
+
+    def test_version_is_bumped_on_save(self):
+        version = self.user.version
+        self.user.save()
+        self.assertEqual(self.user.version, version + 1)
+
+        self.user.first_name = 'Gao'
+        self.user.save(update_fields=['first_name'])
+        self.assertEqual(User.objects.get(pk=self.user.pk).version, version + 2)
+
+    def test_version_follows_the_stored_one(self):
+        """ A stale instance still ends up past every version handed out so far. """
+
+        stale = User.objects.get(pk=self.user.pk)
+        self.user.save()
+        stale.save()
+        self.assertEqual(stale.version, self.user.version + 1)
+
+    def test_version_is_bumped_on_update(self):
+        version = self.user.version
+        User.objects.filter(pk=self.user.pk).update(first_name='Gao')
+        self.assertEqual(User.objects.get(pk=self.user.pk).version, version + 1)
+
+
+class TestTokenIssuing(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+
+    def test_tokens_are_signed_once(self):
+        """ Reading the tokens again (i.e. through `autologin_url`) doesn't sign new ones. """
+
+        with mock.patch.object(AccessToken, 'for_user', wraps=AccessToken.for_user) as for_user:
+            self.assertEqual(self.user.access_token, self.user.access_token)
+        self.assertEqual(for_user.call_count, 1)
+
+    @override_settings(TOKEN_MIN_REMAINING=10 ** 6)
+    def test_stale_tokens_are_replaced(self):
+        """ A token that's about to expire isn't handed out again. """
+
+        token = self.user.access_token
+        self.assertNotEqual(token, self.user.access_token)
+
+    @override_settings(TOKEN_CACHE_TTL=30)
+    def test_cache_shares_tokens_between_instances(self):
+        token = self.user.refresh_token
+        self.assertEqual(User.objects.get(pk=self.user.pk).refresh_token, token)
+
+    def test_issue_tokens(self):
+        users = UserFactory.create_batch(3)
+        issued = issue_tokens(users)
+        self.assertEqual(set(issued), {user.pk for user in users})
+        self.assertEqual(issued[users[0].pk]['access'], users[0].access_token)
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+from unittest import mock
+
+from contrib.tests.base import BaseTestCase
+from users import payloads
+from users.models import User
+from users.payloads import get_user_payload, get_user_payloads, local_payloads, payload_cache_key
+from users.serializers import UserSerializer
+
+
+class TestUserPayloads(BaseTestCase):
+    def setUp(self):
+        self.user_auth()
+        local_payloads.clear()
+        cache.clear()
+
+    def test_same_bytes_as_the_api(self):
+        self.assertEqual(get_user_payload(self.user), JSONRenderer().render(UserSerializer(self.user).data))
+
+    @mock.patch.object(payloads, 'render_user', wraps=payloads.render_user)
+    def test_rendered_once(self, render_user):
+        """ Rendered on the first call, then served from the local cache, then from redis. """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_payload(self.user)
+        get_user_payload(self.user)
+        local_payloads.clear()  # i.e. another process
+        get_user_payload(self.user)
+        render_user.assert_called_once()
+
+    def test_stored_once_committed(self):
+        """ A version rendered in a transaction that rolls back would be reused by the next change. """
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            get_user_payload(self.user)
+        self.assertIsNone(local_payloads.get(self.user.pk))
+        self.assertIsNone(cache.get(payload_cache_key(self.user.pk)))
+
+        callbacks[0]()  # the commit
+        self.assertEqual(local_payloads.get(self.user.pk)[0], self.user.version)
+        self.assertEqual(cache.get(payload_cache_key(self.user.pk))[0], self.user.version)
+
+    def test_save_invalidates(self):
+        get_user_payload(self.user)
+        self.user.first_name = 'Gao'
+        self.user.save()
+        self.assertIn(b'"first_name":"Gao"', get_user_payload(self.user))
+
+    @mock.patch.object(payloads, 'render_user', wraps=payloads.render_user)
+    def test_stale_instance_does_not_overwrite(self, render_user):
+        """ An outdated instance gets its own version, and leaves the newer entry alone. """
+
+        stale = User.objects.get(pk=self.user.pk)
+        with self.captureOnCommitCallbacks() as published:
+            self.user.first_name = 'Gao'
+            self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            published[0]()  # rendered for the watchers once committed (and stored then too)
+        local_payloads.clear()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertNotIn(b'Gao', get_user_payload(stale))
+        local_payloads.clear()
+        self.assertIn(b'Gao', get_user_payload(self.user))
+        self.assertEqual(render_user.call_count, 2)
+
+    def test_many(self):
+        users = [self.user, User.objects.create(username='gao')]
+        self.assertEqual(get_user_payloads(users), [get_user_payload(user) for user in users])
+
+    def test_browsable_api(self):
+        """ Only plain JSON gets the cached bytes as they are - other formats still render the data. """
+
+        response = self.client.get(reverse('me'), {'format': 'api'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], self.user.username)
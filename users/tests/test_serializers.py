@@ -8,8 +8,11 @@ from unittest import mock
 from hashids import Hashids
 
 from contrib.tests.base import BaseTestCase
-from users.serializers import PasswordResetConfirmSerializer, PasswordResetSerializer, AccountVerifySerializer
+from users.serializers import (
+    PasswordResetConfirmSerializer, PasswordResetSerializer, AccountVerifySerializer, UserSerializer,
+)
 from users.factories import UserFactory
+from users.models import User
 
 
 class TestPasswordResetConfirmSerializer(BaseTestCase):
@@ -184,6 +187,39 @@ class TesPasswordResetSerializer(BaseTestCase):
         serializer = self.serializer(data={'email': registered_email})
         self.assertTrue(serializer.is_valid())
 
+    def test_email_case_is_ignored(self):
+        user = UserFactory(email='Gao@Wertkt.com')
+        serializer = self.serializer(data={'email': 'gao@wertkt.com'})
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.user, user)
+
+
+class TestUserSerializer(BaseTestCase):
+    data = {'username': 'cheeto', 'password': '505asde50', 'email': 'gao@wertkt.com'}
+
+    def test_email_taken_in_another_case(self):
+        UserFactory(email='GAO@wertkt.com')
+        serializer = UserSerializer(data=self.data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('email', serializer.errors)
+
+    @mock.patch('users.serializers.UserSerializer.validate_email', side_effect=lambda value: value)
+    def test_concurrent_signup(self, validate_email):
+        """ When the check passed for both signups, the unique index still turns away the second one. """
+
+        UserFactory(email='GAO@wertkt.com')
+        serializer = UserSerializer(data=self.data)
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as context:
+            serializer.save()
+        self.assertIn('email', context.exception.detail)
+
+    def test_many_users_without_email(self):
+        """ The unique index only covers non-empty emails. """
+
+        users = UserFactory.create_batch(2, email='')
+        self.assertEqual(User.objects.filter(pk__in=[user.pk for user in users], email='').count(), 2)
+
 
 class TestAccountVerifySerializer(BaseTestCase):
     def setUp(self):
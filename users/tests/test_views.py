@@ -1,12 +1,17 @@
+from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from unittest import mock
 from requests.exceptions import HTTPError
 from social_core.exceptions import AuthTokenError
 
 from contrib.tests.base import BaseTestCase
+from users.authentication import local_users
 from users.factories import UserFactory
+from users.models import User
 
 
 class TestMeView(BaseTestCase):
@@ -24,7 +29,42 @@ class TestMeView(BaseTestCase):
         self.user_auth()
         response = self.client.get(self.ME_URL)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['username'], self.user.username)
+        self.assertEqual(response.json()['username'], self.user.username)
+
+    def test_etag(self):
+        """ The user's version is the ETag - asking with the current one gets an empty 304. """
+
+        self.user_auth()
+        response = self.client.get(self.ME_URL)
+        etag = response['ETag']
+        self.assertEqual(etag, f'W/"{self.user.pk}-{self.user.version}"')
+
+        response = self.client.get(self.ME_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+        self.user.first_name = 'Gao'
+        self.user.save()
+        response = self.client.get(self.ME_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Gao')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_after_update(self):
+        """ `request.user` comes from the auth cache, which a queryset `update()` clears as well. """
+
+        local_users.clear()
+        cache.clear()
+        user = UserFactory()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {user.access_token}')
+        etag = self.client.get(self.ME_URL)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=user.pk).update(first_name='Gao')
+        response = self.client.get(self.ME_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['first_name'], 'Gao')
+        self.assertEqual(response['ETag'], f'W/"{user.pk}-{user.version + 1}"')
 
 
 class TestPasswordResetView(BaseTestCase):
@@ -140,7 +180,48 @@ class TestUserViewSet(BaseTestCase):
         UserFactory.create_batch(10)
         response = self.client.get(self.USERS_URL)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_retrieve_etag(self):
+        self.user_auth()
+        url = reverse('users-detail', args=[self.user.id])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_sparse_fieldset(self):
+        """ `?fields=` trims the output and only those columns are loaded. """
+
+        self.user_auth()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.USERS_URL, {'fields': 'id,username'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [{'id': self.user.id, 'username': self.user.username}])
+        select = next(query['sql'] for query in queries if 'FROM "users_user"' in query['sql'])
+        self.assertNotIn('"email"', select.split('FROM')[0])
+
+        response = self.client.get(self.USERS_URL, {'omit': 'email,version'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'first_name', 'last_name', 'username'})
+
+    def test_sparse_fieldset_retrieve(self):
+        self.user_auth()
+        url = reverse('users-detail', args=[self.user.id])
+        response = self.client.get(url, {'fields': 'username,nope'})
+        self.assertEqual(response.json(), {'username': self.user.username})
+        self.assertEqual(response['ETag'], self.client.get(url)['ETag'])
+        self.assertEqual(self.client.get(reverse('me'), {'omit': 'version'}).json(), {
+            'id': self.user.id, 'first_name': self.user.first_name, 'last_name': self.user.last_name,
+            'username': self.user.username, 'email': self.user.email,
+        })
+
+    def test_sparse_fieldset_does_not_affect_input(self):
+        self.user_auth()
+        url = reverse('users-detail', args=[self.user.id])
+        response = self.client.patch(f'{url}?fields=id', data={'first_name': 'Dylan'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': self.user.id})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Dylan')
 
     def test_normal_user_can_see_own_user_data_but_not_password(self):
         """ Ensure that the serializer isn't returning the hashed password. """
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from typing import Dict, Iterable, Optional, Tuple
+import time
+
+TOKEN_CLASSES = {
+    'access': AccessToken,
+    'refresh': RefreshToken,
+}
+
+
+class TokenIssuer:
+    """ Mints the JWTs of one user, signing each kind at most once while it stays fresh - a token
+    is reused until it has less than `TOKEN_MIN_REMAINING` seconds left.
+
+    With `TOKEN_CACHE_TTL` set, tokens are also shared through the cache for that many seconds, so
+    other requests (and processes) reuse them too. """
+
+    def __init__(self, user) -> None:
+        self.user = user
+        self.tokens: Dict[str, Tuple[str, int]] = {}  # kind -> (token, exp)
+
+    def access(self) -> str:
+        return self.get('access')
+
+    def refresh(self) -> str:
+        return self.get('refresh')
+
+    def get(self, kind: str) -> str:
+        token = self.tokens.get(kind)
+        if token is None or not is_fresh(token):
+            token = self.get_cached(kind)
+        if token is None:
+            token = self.mint(kind)
+            if settings.TOKEN_CACHE_TTL:
+                cache.set(token_cache_key(kind, self.user.pk), token, settings.TOKEN_CACHE_TTL)
+        self.tokens[kind] = token
+        return token[0]
+
+    def mint(self, kind: str) -> Tuple[str, int]:
+        token = TOKEN_CLASSES[kind].for_user(self.user)
+        return str(token), token['exp']
+
+    def get_cached(self, kind: str) -> Optional[Tuple[str, int]]:
+        if not settings.TOKEN_CACHE_TTL:
+            return None
+        token = cache.get(token_cache_key(kind, self.user.pk))
+        return token if token and is_fresh(token) else None
+
+
+def token_cache_key(kind: str, user_pk: int) -> str:
+    return f'users:token:{kind}:{user_pk}'
+
+
+def is_fresh(token: Tuple[str, int]) -> bool:
+    return token[1] - time.time() > settings.TOKEN_MIN_REMAINING
+
+
+def issue_tokens(users: Iterable, kinds: Tuple[str, ...] = ('access', 'refresh')) -> Dict[int, Dict[str, str]]:
+    """ Tokens for many users at once (i.e. load test fixtures, invitation links), as `{pk: {kind: token}}`.
+    Each user's issuer keeps them too, and with `TOKEN_CACHE_TTL` set they're cached in one round-trip. """
+
+    issued: Dict[int, Dict[str, str]] = {}
+    to_cache = {}
+    for user in users:
+        issuer = user.token_issuer
+        issued[user.pk] = {}
+        for kind in kinds:
+            token = issuer.tokens.get(kind)
+            if token is None or not is_fresh(token):
+                token = issuer.tokens[kind] = issuer.mint(kind)
+                to_cache[token_cache_key(kind, user.pk)] = token
+            issued[user.pk][kind] = token[0]
+    if to_cache and settings.TOKEN_CACHE_TTL:
+        cache.set_many(to_cache, settings.TOKEN_CACHE_TTL)
+    return issued
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.utils.http import parse_etags
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import viewsets, permissions
@@ -8,14 +10,19 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.validators import ValidationError
 
 from requests.exceptions import HTTPError
 from social_django.utils import load_strategy, load_backend
 from social_core.exceptions import MissingBackend, AuthTokenError, AuthForbidden
 from drf_yasg.utils import swagger_auto_schema
+import json
 import logging
 
+from contrib.serializers import requested_fields
+from contrib.views import SparseFieldsViewMixin
+from .payloads import get_user_payload
 from .permissions import CreateOnly
 from .serializers import (
     UserSerializer,
@@ -30,7 +37,31 @@ logger = logging.getLogger('users')
 User = get_user_model()
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def user_etag(user: User) -> str:
+    """ Weak - the same version renders differently per format (i.e. the browsable API.) """
+
+    return f'W/"{user.pk}-{user.version}"'
+
+
+def user_response(request: Request, user: User) -> Response:
+    """ The user's (cached) payload with its version as ETag, or an empty 304 if the client has it already.
+    Plain JSON requests get the cached bytes as they are, without going through the serializer. """
+
+    etag = user_etag(user)
+    known = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(request.headers.get('If-None-Match', ''))]
+    if etag[2:] in known or '*' in known:
+        return Response(status=304, headers={'ETag': etag})
+    fields, omit = requested_fields(request)
+    if fields is not None or omit:
+        # sparse fieldsets are serialized as asked (and `user` may be missing the other fields)
+        return Response(UserSerializer(user, context={'request': request}).data, headers={'ETag': etag})
+    payload = get_user_payload(user)
+    if isinstance(request.accepted_renderer, JSONRenderer) and 'indent' not in request.accepted_media_type:
+        return HttpResponse(payload, content_type=request.accepted_renderer.media_type, headers={'ETag': etag})
+    return Response(json.loads(payload), headers={'ETag': etag})
+
+
+class UserViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     retrieve:
         Lookup specific user by their id (depends on user permissions.)
@@ -52,10 +83,14 @@ class UserViewSet(viewsets.ModelViewSet):
     """
     permission_classes = [IsAuthenticated | CreateOnly]
     serializer_class = UserSerializer
+    sparse_fields_always = ('version',)  # for the ETag
 
     def get_queryset(self) -> QuerySet:
         return User.objects.filter(id=self.request.user.id)
 
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        return user_response(request, self.get_object())
+
     @swagger_auto_schema(
         security=[],
         operation_id='users-create',
@@ -159,8 +194,7 @@ class SocialViewSet(viewsets.ViewSet):
 def me(request: Request) -> Response:
     """ Get info for the currently logged in user. """
 
-    serializer = UserSerializer(request.user)
-    return Response(serializer.data)
+    return user_response(request, request.user)
 
 
 @swagger_auto_schema(